@@ -16,6 +16,7 @@ from streamlit import session_state as sts
 import hmac
 import wxd_data as db
 from wxd_utilities import setCredentials, log, check_password, version_reset
+from wxd_embeddings import warmEmbeddingModels
 import os
 
 st.set_page_config(
@@ -59,6 +60,9 @@ if (connection == None):
 	db.badConnection()
 	st.stop()
 
+# Load the embedding model in the background so the first question does not wait for it
+warmEmbeddingModels()
+
 st.markdown(
     """
     <style>
@@ -13,6 +13,7 @@
 import streamlit as st
 from streamlit import session_state as sts
 import wxd_data as db
+import wxd_milvus as wxd_milvus
 import pandas as pd 
 import wikipedia
 from wxd_utilities import setCredentials, log, check_password, getLanguageCode, setPage
@@ -129,6 +130,9 @@ def list_documents():
                         ok = db.runDML(connection,sql)
                         sql = f"delete from iceberg_data.documents.rawdata  where id = {id}"
                         ok = db.runDML(connection,sql)                    
+                        ids.append(id)
+
+                wxd_milvus.deleteDocumentVectors(ids)
 
             sts.docs_selected = None
             st.rerun()   
@@ -15,6 +15,7 @@ import wxd_data as db
 import wxd_milvus as wxd_milvus
 import pandas as pd
 import re
+import os
 from time import sleep
 from streamlit import session_state as sts
 from wxd_utilities import setCredentials, log, check_password, setPage
@@ -38,6 +39,72 @@ def getVectorsize():
     """
     sts['vectorsize'] = sts._vectorsize
 
+def getVectorMode():
+    """
+    Replace rebuilds the collection from the selected documents. Append adds the selected documents
+    to an existing collection and skips the documents that are already in it.
+    """
+    sts['vector_mode'] = sts._vector_mode
+
+def getBackend():
+    """
+    The embedding backend used to convert the document chunks into vectors. The ONNX backends
+    are faster on a CPU and produce vectors that are compatible with the PyTorch backend.
+    """
+    sts['embedding_backend'] = sts._embedding_backend
+
+def getWorkers():
+    """
+    The number of worker processes used to vectorize large documents.
+    """
+    sts['embedding_workers'] = sts._embedding_workers
+
+def getIndexProfile():
+    """
+    The Milvus index type used for the collection. The build and search parameters that go with
+    the index are saved with the collection.
+    """
+    sts['index_profile'] = sts._index_profile
+
+def getRecallTarget():
+    """
+    The search parameters of the collection are tuned to find at least this fraction of the
+    results that an exhaustive search would return.
+    """
+    sts['recall_target'] = sts._recall_target
+
+def getFusion():
+    """
+    Keyword search stores a BM25 vector with each chunk so that searches also find exact terms
+    like product names. RRF and Weighted choose how the keyword and vector results are combined.
+    """
+    sts['fusion'] = sts._fusion
+
+def getStorage():
+    """
+    The storage mode sets how the vectors are kept in Milvus. FLOAT16, SQ8, and BINARY use less
+    memory than FLOAT32 at some cost in recall.
+    """
+    sts['storage'] = sts._storage
+
+def getProjection():
+    """
+    PCA or truncation reduces the vectors to fewer dimensions before they are stored in Milvus.
+    """
+    sts['projection'] = sts._projection
+
+def getProjectionDim():
+    """
+    The number of dimensions the vectors are reduced to.
+    """
+    sts['projection_dim'] = sts._projection_dim
+
+def getContextWindow():
+    """
+    The number of neighbouring chunks on each side that are added to a Small-to-Big search result.
+    """
+    sts['context_window'] = sts._context_window
+
 def getCollectionName():
     """
     Get the name of the selected document
@@ -157,7 +224,7 @@ list_collections()
 
 st.subheader("Document list",divider="blue")
 description = '''
-The current collection of documents that are stored in watsonx.data are found in the list below. Select the document(s) that you want vectorized and press the Vectorize button. If you use an existing collection name (see above), it will replace the contents of that collection. Note that you must have at least one collection in order to use RAG prompts.
+The current collection of documents that are stored in watsonx.data are found in the list below. Select the document(s) that you want vectorized and press the Vectorize button. If you use an existing collection name (see above), the Replace option will replace the contents of that collection, while the Append option adds the selected documents to it without rebuilding it. Note that you must have at least one collection in order to use RAG prompts.
 '''
 
 st.write(description)
@@ -166,7 +233,7 @@ with st.container(border=True):
 
     selectDocuments()
 
-    textColumns = st.columns([20,80])
+    textColumns = st.columns([20,30,50])
 
     with textColumns[0]:
         st.markdown("""
@@ -186,19 +253,114 @@ with st.container(border=True):
         </style><span style="font-size: 14px">Vector Size
         """,unsafe_allow_html=True)
 
-    textColumns = st.columns([20,80])    
+    with textColumns[2]:
+        st.markdown("""
+        <style>
+        [data-testid=column]:nth-of-type(1) [data-testid=stVerticalBlock]{
+            gap:0rem ;
+        }
+        </style><span style="font-size: 14px">Load Mode
+        """,unsafe_allow_html=True)
+
+    textColumns = st.columns([20,30,50])    
 
     with textColumns[0]:
         st.text_input("Enter collection name",value="Default",key="_collection_name",on_change=getCollectionName,label_visibility="collapsed")         
     with textColumns[1]:
         st.pills("Vector Size",
-                 ["Small","Medium","Large"],
+                 ["Small","Medium","Large","Small-to-Big"],
                  selection_mode="single",
                  on_change=getVectorsize,
                  key="_vectorsize",
                  default=sts.vectorsize,
                  label_visibility="collapsed"
                  )      
+    with textColumns[2]:
+        st.pills("Load Mode",
+                 ["Replace","Append"],
+                 selection_mode="single",
+                 on_change=getVectorMode,
+                 key="_vector_mode",
+                 default=sts.vector_mode,
+                 label_visibility="collapsed"
+                 )
+
+    with st.expander("Advanced Settings"):
+        st.pills("Embedding Backend",
+                 ["torch","onnx","onnx-int8"],
+                 selection_mode="single",
+                 on_change=getBackend,
+                 key="_embedding_backend",
+                 default=sts.embedding_backend
+                 )
+        st.number_input("Embedding Workers",
+                        min_value=1,
+                        max_value=os.cpu_count() or 1,
+                        value=sts.embedding_workers,
+                        on_change=getWorkers,
+                        key="_embedding_workers",
+                        help="Large documents are split across this many processes. Use 1 to vectorize in the application process."
+                        )
+        profiles = [profile for profile in wxd_milvus.INDEX_PROFILES if not profile.startswith("BIN_")]
+        st.selectbox("Index Type",
+                     profiles,
+                     index=profiles.index(sts.index_profile),
+                     on_change=getIndexProfile,
+                     key="_index_profile",
+                     help="FLAT is exact and best for small collections. HNSW gives high recall on large collections. IVF_SQ8, IVF_PQ, and DISKANN use less memory."
+                     )
+        st.slider("Recall Target",
+                  min_value=0.80,
+                  max_value=1.00,
+                  value=sts.recall_target,
+                  step=0.01,
+                  on_change=getRecallTarget,
+                  key="_recall_target",
+                  help="The index and search parameters are chosen automatically from the size of the collection. Searches use the fastest settings that reach this recall."
+                  )
+        fusions = ["Off","RRF","Weighted"]
+        st.selectbox("Keyword Search",
+                     fusions,
+                     index=fusions.index(sts.fusion),
+                     on_change=getFusion,
+                     key="_fusion",
+                     help="Store BM25 keyword vectors with the chunks and combine keyword and vector matches when searching. RRF combines the rankings, Weighted combines the scores."
+                     )
+        storages = list(wxd_milvus.STORAGE_MODES)
+        st.selectbox("Vector Storage",
+                     storages,
+                     index=storages.index(sts.storage),
+                     on_change=getStorage,
+                     key="_storage",
+                     help="FLOAT16 halves the memory used by the vectors. SQ8 stores one byte per dimension. BINARY stores one bit per dimension and re-ranks the matches with full precision vectors kept on disk."
+                     )
+        projections = ["Off","PCA","Truncate"]
+        st.selectbox("Dimension Reduction",
+                     projections,
+                     index=projections.index(sts.projection),
+                     on_change=getProjection,
+                     key="_projection",
+                     help="Store smaller vectors in Milvus. PCA is learned from the document chunks. Truncate keeps the first dimensions and is only suitable for Matryoshka embedding models."
+                     )
+        st.number_input("Reduced Dimensions",
+                        min_value=8,
+                        max_value=384,
+                        step=8,
+                        value=sts.projection_dim,
+                        on_change=getProjectionDim,
+                        key="_projection_dim",
+                        disabled=(sts.projection == "Off"),
+                        help="The number of dimensions kept when Dimension Reduction is on. The questions are reduced the same way when the collection is searched."
+                        )
+        st.number_input("Context Window",
+                        min_value=0,
+                        max_value=5,
+                        value=sts.context_window,
+                        on_change=getContextWindow,
+                        key="_context_window",
+                        disabled=(sts.vectorsize != "Small-to-Big"),
+                        help="Small-to-Big results are expanded with this many neighbouring chunks on each side. Use 0 to return the small chunks alone."
+                        )
           
     vectorize = st.button("Vectorize Collection")          
     
@@ -241,6 +403,11 @@ with st.container(border=True):
                     st.error("Unknown error")
             else:
                 with st.spinner("Vectorizing collection"):
+                    status = st.empty()
+
+                    def progress(batch, chunks):
+                        status.caption(f"Batch {batch}: {chunks} chunks vectorized")
+
                     ids = []
                     edited_rows = sts.docs_selected['edited_rows']
                     for row_no in edited_rows:
@@ -249,7 +416,8 @@ with st.container(border=True):
                             id = df.loc[row_no,'id']
                             ids.append(id)
 
-                    collection = wxd_milvus.storeVectors(connection,collection_name,ids,sts.vectorsize)
+                    collection = wxd_milvus.storeVectors(connection,collection_name,ids,sts.vectorsize,backend=sts.embedding_backend,workers=sts.embedding_workers,progress=progress,index_profile=sts.index_profile,recall_target=sts.recall_target,mode=(sts.vector_mode or "Replace").lower(),fusion=None if sts.fusion == "Off" else sts.fusion.lower(),storage=sts.storage,projection=None if sts.projection == "Off" else sts.projection.lower(),dimension=sts.projection_dim,context_window=sts.context_window if sts.vectorsize == "Small-to-Big" else None)
+                    status.empty()
                     if (collection in [None,""]):
                         st.error("Error in vectorizing the document. Check the log for details.")
                         sts.collection = None
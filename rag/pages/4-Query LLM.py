@@ -13,10 +13,11 @@
 import streamlit as st
 import pandas as pd
 from streamlit import session_state as sts
-from wxd_milvus import query_milvus, createPrompt, listCollections
+from wxd_milvus import query_collections, createPrompt, listCollections, collectionDocuments
 from wxd_utilities import log, runOS, setCredentials, check_password, setPage
 from wxd_data import getDocuments, connectPresto, badConnection, getDocument
 from wxd_ollama import getLLMs, askLLM
+from wxd_embeddings import prewarmQueryCache, embeddingModel
 
 def add_prompt(prompt):
     """
@@ -29,19 +30,53 @@ def add_prompt(prompt):
             if (prompt not in sts.queries):
                 sts.queries.append(prompt)
 
+def pageDocuments(connection):
+    """
+    Return the documents in the watsonx.data catalog. The list is read once each time the page is
+    run and kept in sts, so the selection boxes do not query Presto every time they change.
+    """
+    if (sts.get("page_documents") is None):
+        sts.page_documents = getDocuments(connection)
+    return sts.page_documents
+
 @st.fragment
-def collection_select():
+def collection_select(connection):
     """
     Retrieve a list of collections that are currently registered in Milvus and
-    allow the user to select from one to use in the search.
+    allow the user to select one or more to use in the search. The search can be
+    limited to some of the documents in the collections.
     """
     collection_list = listCollections()
     collection_list.sort()        
-    col_name = st.selectbox("Milvus Collection", collection_list, index=0,label_visibility="visible",placeholder="Milvus Collection")
-    if (col_name not in [None, ""]):
-        sts.collection_name = col_name 
+    selected_collections = [name for name in sts.get("collection_names") or [] if name in collection_list]
+    if (len(selected_collections) == 0 and len(collection_list) > 0):
+        selected_collections = [collection_list[0]]
+    col_names = st.multiselect("Milvus Collections", collection_list, default=selected_collections,label_visibility="visible",placeholder="Milvus Collection")
+    sts.collection_names = col_names
+    if (len(col_names) == 0):
+        sts.collection_name = None
+        sts.collection_index = None
+        sts.collection_documents = None
+    else:
+        sts.collection_name = col_names[0] 
         sts.collection_index = collection_list.index(sts.collection_name)
 
+        doc_ids = []
+        for col_name in col_names:
+            doc_ids.extend([id for id in collectionDocuments(col_name) if id not in doc_ids])
+        doc_ids.sort()
+        names = {}
+        documents = pageDocuments(connection)
+        if (documents is not None):
+            for index, row in documents.iterrows():
+                names[row['id']] = row['document']
+
+        selected = st.multiselect("Collection Documents", doc_ids, default=None,
+                                  format_func=lambda id: f"{id}: {names.get(id,'')}",
+                                  placeholder="All documents",
+                                  key=f"_collection_documents_{'_'.join(col_names)}")
+        sts.collection_documents = selected if len(selected) > 0 else None
+
 @st.fragment
 def document_select(connection):
     """
@@ -49,7 +84,7 @@ def document_select(connection):
     user to select one as the source to be used for a question. You can optionally 
     include a RAG prompt with this. 
     """
-    document_list = getDocuments(connection)
+    document_list = pageDocuments(connection)
     display_text = []
     for index, row in document_list.iterrows():
         index = row['id']
@@ -71,6 +106,10 @@ def toSettings():
         settings.append("Verbose")
     if (sts.random == True):
         settings.append("Random")
+    if (sts.rerank == True):
+        settings.append("Rerank")
+    if (sts.diverse == True):
+        settings.append("Diverse")
     return settings
 
 def toTemperature():
@@ -123,21 +162,48 @@ def getTemperature():
 
 def getSettings():
     """
-    LLM settings. Display the RAG prompt on the screen (default is yes), and 
-    use repeatible seeds when generating the reply (default is no).
+    LLM settings. Display the RAG prompt on the screen (default is yes), 
+    use repeatible seeds when generating the reply (default is no), 
+    re-rank the RAG sentences with a cross-encoder (default is no), and
+    drop near-duplicate RAG sentences (default is no).
     """
  
     sts['displayrag'] = False
     sts['random'] = False
+    sts['rerank'] = False
+    sts['diverse'] = False
     if (len(sts.llm_settings) > 0):
         for key in sts.llm_settings:
             if ("Verbose" in key):
                 sts['displayrag'] = True
             elif ("Random" in key):
                 sts['random'] = True
+            elif ("Rerank" in key):
+                sts['rerank'] = True
+            elif ("Diverse" in key):
+                sts['diverse'] = True
             else:
                 pass
 
+def getDiversity():
+    """
+    The balance between relevance and diversity used when Diverse is on. 1.0 ranks the RAG
+    sentences by relevance only, lower values prefer sentences that add new text.
+    """
+    sts['mmr_lambda'] = sts._mmr_lambda
+
+def diversitySlider():
+    st.slider("Relevance vs Diversity",
+              min_value=0.0,
+              max_value=1.0,
+              value=float(sts.mmr_lambda),
+              step=0.05,
+              on_change=getDiversity,
+              key="_mmr_lambda",
+              disabled=(sts.diverse == False),
+              help="Used when Diverse is on. 1.0 chooses the most relevant sentences, lower values skip sentences that repeat text that was already chosen."
+              )
+
 def setButtons():
     """
     There are two settings that we want to use to adjust the performance of the LLM: Random seed and a verbose mode. The titles of the buttons will change as you change the values.
@@ -178,6 +244,12 @@ if (connection == None):
 
 program = "Chat"
 
+# The document list is read again when the page is run, but not when a selection box changes
+sts.page_documents = None
+
+# Repeated questions from the Previous Questions list skip the embedding model
+prewarmQueryCache(sts.queries,embeddingModel(sts.embedding_backend))
+
 st.header("Query LLM",divider=True)
 
 introduction = \
@@ -220,20 +292,21 @@ with st.sidebar:
             if (selected_model not in [None, ""]):
                 sts.model = selected_model
 
-            collection_select()
+            collection_select(connection)
 
             document_select(connection)
 
             previous_prompt = None
 
             st.pills("LLM Settings",
-                    ["Verbose","Random"],
+                    ["Verbose","Random","Rerank","Diverse"],
                     selection_mode="multi",
                     on_change=getSettings,
                     key="llm_settings",
                     default=toSettings(),
                     label_visibility="visible"
                     )
+            diversitySlider()
             st.pills("Maximum RAG Sentences",
                     ["Off",3,6,9],
                     selection_mode="single",
@@ -277,7 +350,7 @@ with cols[0]:
         
         with cols[2]:
 
-            collection_select()
+            collection_select(connection)
 
         with cols[3]:
 
@@ -287,13 +360,14 @@ with cols[0]:
 
         with cols[4]:
             st.pills("LLM Settings",
-                    ["Verbose","Random"],
+                    ["Verbose","Random","Rerank","Diverse"],
                     selection_mode="multi",
                     on_change=getSettings,
                     key="llm_settings",
                     default=toSettings(),
                     label_visibility="visible"
                     )
+            diversitySlider()
 
         with cols[5]:
             st.pills("Maximum RAG Sentences",
@@ -364,7 +438,7 @@ if prompt := st.chat_input(placeholder="Enter your question"):
         # 3: Yes you do want a RAG prompt to be generated
         else:
 
-            sentences = query_milvus(prompt,sts.collection_name,sts.sentences)
+            sentences = query_collections(prompt,sts.collection_names,sts.sentences,backend=sts.embedding_backend,recall_target=sts.recall_target,doc_ids=sts.collection_documents,rerank=sts.rerank,mmr_lambda=sts.mmr_lambda if sts.diverse else None)
             llm_prompt, min_distance = createPrompt(prompt,sentences)
             if (llm_prompt == None):
                 st.error("Unable to create a RAG prompt based on the collection that was provided.")
@@ -379,7 +453,7 @@ if prompt := st.chat_input(placeholder="Enter your question"):
         if (sts.document_index not in [None,""]):
             settings = f"Model: {span_blue}{sts.model}{span_end}&emsp;Document: {span_blue}{sts.document_name}{span_end}&emsp;Temperature: {span_blue}{toTemperature()}{span_end}&emsp;Random Seed: {random_color}{sts.random}{span_end}" 
         elif (sts.rag == False):
-            settings = f"Model: {span_blue}{sts.model}{span_end}&emsp;RAG: {rag_color}{sts.rag}{span_end}&emsp;Temperature: {span_blue}{toTemperature()}{span_end}&emsp;Random Seed: {random_color}{sts.random}{span_end}&emsp;Collection: {span_blue}{sts.collection_name}{span_end}&emsp;"                          
+            settings = f"Model: {span_blue}{sts.model}{span_end}&emsp;RAG: {rag_color}{sts.rag}{span_end}&emsp;Temperature: {span_blue}{toTemperature()}{span_end}&emsp;Random Seed: {random_color}{sts.random}{span_end}&emsp;Collection: {span_blue}{', '.join(sts.collection_names)}{span_end}&emsp;"                          
         else:
             if (min_distance <= .75):
                 distance_color = span_green
@@ -387,7 +461,10 @@ if prompt := st.chat_input(placeholder="Enter your question"):
                 distance_color = span_yellow
             else:
                 distance_color = span_red
-            settings = f"Model: {span_blue}{sts.model}{span_end}&emsp;RAG: {rag_color}{sts.rag}{span_end}&emsp;Sentences: {span_blue}{sts.sentences}{span_end}&emsp;Temperature: {span_blue}{toTemperature()}{span_end}&emsp;Random Seed: {random_color}{sts.random}{span_end}&emsp;Collection: {span_blue}{sts.collection_name}{span_end}&emsp;Distance: {distance_color}{min_distance:.2f}{span_end}"                            
+            settings = f"Model: {span_blue}{sts.model}{span_end}&emsp;RAG: {rag_color}{sts.rag}{span_end}&emsp;Sentences: {span_blue}{sts.sentences}{span_end}&emsp;Temperature: {span_blue}{toTemperature()}{span_end}&emsp;Random Seed: {random_color}{sts.random}{span_end}&emsp;Collection: {span_blue}{', '.join(sts.collection_names)}{span_end}&emsp;Distance: {distance_color}{min_distance:.2f}{span_end}"
+            timings = sentences.attrs.get("timings")
+            if (timings is not None):
+                settings = f"{settings}&emsp;Retrieval: {span_blue}embed {timings['embed_ms']:.0f}ms, search {timings['search_ms']:.0f}ms, diversify {timings['mmr_ms']:.0f}ms, rerank {timings['rerank_ms']:.0f}ms, expand {timings['expand_ms']:.0f}ms{span_end}"                            
 
         display_prompt = f"{display_prompt}\n\n{settings}"
 
@@ -545,10 +545,16 @@ with st.container(border=True):
 
                     with st.spinner("Creating document vectors"):
                         sleep(0.5)                    
+                        status = st.empty()
+
+                        def progress(batch, chunks):
+                            status.caption(f"Batch {batch}: {chunks} chunks vectorized")
+
                         collection_name = "IBM 2023 Annual Report"
                         collection_name = collection_name.replace(" ","_")
                         ids = [1]
-                        collection = storeVectors(connection,collection_name,ids,"Small")
+                        collection = storeVectors(connection,collection_name,ids,"Small",progress=progress)
+                        status.empty()
                         if (collection in [None,""]):
                             db.log("Rebuild","[3] Unable to vectorize the default document. See the log for details.")
                             st.error("Error in vectorizing the document. Check the log for details.")
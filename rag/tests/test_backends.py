@@ -0,0 +1,170 @@
+#
+#   Run the same load, query, append, delete, and drop operations against each vector backend.
+#   The embedding model is replaced with a hashed bag of words so the tests do not download a
+#   model, and every cache directory is moved into a temporary directory. The milvus backend runs
+#   against a Milvus Lite file, once with aliases (skipped when the installed Milvus Lite does not
+#   implement them) and once rebuilding the collection in place as storeVectors does without them.
+#
+
+import hashlib
+import os
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("streamlit")
+pytest.importorskip("langchain")
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+COLLECTION = "backend_test"
+
+def hashedVector(text, dim):
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in text.lower().split():
+        vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+@pytest.fixture(params=["local", "milvus", "milvus-in-place"])
+def backend(request, tmp_path, monkeypatch):
+    import wxd_embeddings, wxd_milvus, wxd_vectorstore
+
+    dim = wxd_embeddings.EMBEDDING_DIM
+
+    def embedPassages(passages, model_name=None, workers=None, cache=None):
+        return np.vstack([hashedVector(passage, dim) for passage in passages]) if passages else np.zeros((0, dim), dtype=np.float32)
+
+    def getQueryEmbedding(query, model_name=None):
+        return hashedVector(query, dim), {"queue_ms": 0.0, "encode_ms": 0.0, "batch_size": 1, "cache": "miss"}
+
+    monkeypatch.setattr(wxd_embeddings, "embedPassages", embedPassages)
+    monkeypatch.setattr(wxd_embeddings, "getQueryEmbedding", getQueryEmbedding)
+    monkeypatch.setattr(wxd_embeddings, "CHUNK_CACHE", str(tmp_path / "embeddings.db"))
+    monkeypatch.setattr(wxd_vectorstore, "VECTOR_STORE", str(tmp_path / "vectors"))
+    monkeypatch.setattr(wxd_vectorstore, "LOCAL_COLLECTIONS", str(tmp_path / "vectors" / "collections"))
+    monkeypatch.setattr(wxd_milvus, "COLLECTION_INFO", str(tmp_path / "collections"))
+    monkeypatch.setattr(wxd_milvus, "_aliases", None)
+    wxd_milvus._loaded.clear()
+    wxd_milvus._mirrors.clear()
+    wxd_milvus._term_stats.clear()
+
+    name = request.param
+    uri = str(tmp_path / "milvus.db")
+    if (name.startswith("milvus")):
+        pytest.importorskip("pymilvus")
+        pytest.importorskip("milvus_lite")
+        from pymilvus import connections
+        request.addfinalizer(lambda: connections.disconnect("default"))
+        monkeypatch.setattr(wxd_milvus, "VECTOR_BACKEND", "milvus")
+        monkeypatch.setattr(wxd_milvus, "MILVUS_URI", uri)
+        assert wxd_milvus.connectMilvus()
+        if (name == "milvus-in-place"):
+            monkeypatch.setattr(wxd_milvus, "_aliases", False)
+        elif (wxd_milvus.aliasesSupported() == False):
+            pytest.skip("the installed Milvus Lite does not implement aliases")
+    else:
+        monkeypatch.setattr(wxd_milvus, "VECTOR_BACKEND", "local")
+
+    return {"name": name, "uri": uri}
+
+@pytest.fixture
+def documents():
+    from wxd_benchmark import sampleDocuments
+
+    return sampleDocuments(SAMPLES)[1:21]
+
+def probeChunk(documents):
+    from wxd_milvus import chunkDocuments, chunkSize
+
+    return next(chunkDocuments(documents[:1], chunkSize("Small")))
+
+def test_store_and_query(backend, documents):
+    from wxd_milvus import storeVectors, collectionNames, collectionDocuments, query_milvus
+
+    loaded = documents[:15]
+    ids = [id for id, _ in loaded]
+    probe = probeChunk(loaded)
+
+    assert storeVectors(None, COLLECTION, ids, "Small", documents=loaded) is not None
+    assert COLLECTION in collectionNames()
+    assert sorted(collectionDocuments(COLLECTION)) == sorted(ids)
+
+    df = query_milvus(probe["text"], COLLECTION, 3)
+    assert len(df) == 3
+    assert df["text"].iloc[0] == probe["text"]
+    assert int(df["doc_id"].iloc[0]) == probe["doc_id"]
+
+    df = query_milvus(probe["text"], COLLECTION, 3, doc_ids=[ids[1]])
+    assert set(df["doc_id"]) == {ids[1]}
+
+def test_replace(backend, documents):
+    from wxd_milvus import storeVectors, collectionNames, collectionDocuments, query_milvus
+
+    first, second = documents[:5], documents[5:10]
+
+    assert storeVectors(None, COLLECTION, [id for id, _ in first], "Small", documents=first) is not None
+    assert storeVectors(None, COLLECTION, [id for id, _ in second], "Small", documents=second) is not None
+    assert collectionNames().count(COLLECTION) == 1
+    assert sorted(collectionDocuments(COLLECTION)) == sorted(id for id, _ in second)
+
+    probe = probeChunk(second)
+    df = query_milvus(probe["text"], COLLECTION, 3)
+    assert set(df["doc_id"]) <= {id for id, _ in second}
+
+def test_append(backend, documents):
+    from wxd_milvus import storeVectors, collectionDocuments, query_milvus
+
+    loaded, appended = documents[:15], documents[15:]
+    probe = probeChunk(appended)
+
+    assert storeVectors(None, COLLECTION, [id for id, _ in loaded], "Small", documents=loaded) is not None
+    assert storeVectors(None, COLLECTION, [id for id, _ in appended], "Small", mode="append", documents=appended) is not None
+    assert sorted(collectionDocuments(COLLECTION)) == sorted(id for id, _ in documents)
+
+    df = query_milvus(probe["text"], COLLECTION, 3)
+    assert df["text"].iloc[0] == probe["text"]
+
+def test_delete(backend, documents):
+    from wxd_milvus import storeVectors, collectionDocuments, query_milvus, deleteDocumentVectors
+
+    loaded = documents[:15]
+    probe = probeChunk(loaded)
+
+    assert storeVectors(None, COLLECTION, [id for id, _ in loaded], "Small", documents=loaded) is not None
+
+    deleted = deleteDocumentVectors([probe["doc_id"]], [COLLECTION])
+    assert deleted.get(COLLECTION, 0) > 0
+    assert probe["doc_id"] not in collectionDocuments(COLLECTION)
+
+    df = query_milvus(probe["text"], COLLECTION, 3)
+    assert probe["doc_id"] not in set(int(id) for id in df["doc_id"])
+
+def test_drop(backend, documents):
+    from wxd_milvus import storeVectors, collectionNames, dropCollections
+
+    loaded = documents[:5]
+
+    assert storeVectors(None, COLLECTION, [id for id, _ in loaded], "Small", documents=loaded) is not None
+    assert dropCollections([COLLECTION])
+    assert COLLECTION not in collectionNames()
+
+def test_checkBackends(backend):
+    import wxd_milvus
+    from wxd_benchmark import checkBackends
+
+    saved = (wxd_milvus.VECTOR_BACKEND, wxd_milvus.MILVUS_URI)
+    name = "local" if backend["name"] == "local" else "milvus"
+
+    results = checkBackends([name], backend["uri"], SAMPLES)
+
+    assert (wxd_milvus.VECTOR_BACKEND, wxd_milvus.MILVUS_URI) == saved
+    result = results.iloc[0].to_dict()
+    failed = [check for check in ["connect","store","list","documents","query","filter","append","delete","drop"] if result[check] == False]
+    assert failed == []
+    assert result["passed"]
+
+def test_checkBackends_requires_uri():
+    from wxd_benchmark import checkBackends
+
+    with pytest.raises(ValueError):
+        checkBackends(["milvus"], None, SAMPLES)
@@ -0,0 +1,48 @@
+#
+#   Check that Small-to-Big expansion returns the requested number of passages when matching
+#   chunks are neighbours. The collection is replaced with an object that answers the query for
+#   the neighbouring chunks.
+#
+
+import re
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("streamlit")
+
+class FakeCollection:
+    name = "fake"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def query(self, expr, output_fields=None):
+        windows = [tuple(map(int, match)) for match in re.findall(r"doc_id == (\d+) and chunk_index >= (\d+) and chunk_index <= (\d+)", expr)]
+        return [chunk for chunk in self.chunks if any(chunk["doc_id"] == doc and low <= chunk["chunk_index"] <= high for doc, low, high in windows)]
+
+def document(doc_id, count, size=10):
+    return [{"doc_id": doc_id, "chunk_index": index, "start_offset": index * size, "end_offset": (index + 1) * size,
+             "article_text": f"{doc_id}-{index:02d}".ljust(size, ".")} for index in range(count)]
+
+def test_neighbouring_hits_do_not_reduce_the_passages():
+    from wxd_milvus import expandResults
+
+    collection = FakeCollection(document(1, 20) + document(2, 20))
+    hits = [(1, 5), (1, 6), (1, 4), (2, 10), (1, 15), (2, 2)]
+    df = pd.DataFrame({"distance": [0.1 * rank for rank in range(len(hits))],
+                       "text": [f"{doc}-{index:02d}" for doc, index in hits],
+                       "doc_id": [doc for doc, _ in hits],
+                       "chunk_index": [index for _, index in hits]})
+
+    expanded = expandResults(collection, df, 1, 3)
+
+    assert len(expanded) == 3
+    assert list(zip(expanded["doc_id"], expanded["chunk_index"])) == [(1, 5), (2, 10), (1, 15)]
+    assert expanded["text"].iloc[0].startswith("1-04") and "1-06" in expanded["text"].iloc[0]
+
+def test_without_a_window_the_first_results_are_kept():
+    from wxd_milvus import expandResults
+
+    df = pd.DataFrame({"distance": [0.1, 0.2, 0.3], "text": ["a", "b", "c"], "doc_id": [1, 1, 1], "chunk_index": [0, 1, 2]})
+
+    assert list(expandResults(FakeCollection([]), df, 0, 2)["text"]) == ["a", "b"]
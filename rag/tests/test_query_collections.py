@@ -0,0 +1,49 @@
+#
+#   Check how query_collections merges the results of several collections. The searches are
+#   replaced with fixed results so no Milvus server or embedding model is needed.
+#
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("streamlit")
+
+@pytest.fixture
+def fixedSearch(monkeypatch):
+    import wxd_embeddings, wxd_milvus
+
+    frames = {
+        "manuals" : pd.DataFrame({"distance": [0.30, 0.45, 0.60], "text": ["reset the router", "hold the reset button", "router lights"]}),
+        "recipes" : pd.DataFrame({"distance": [2.00, 2.10, 2.20], "text": ["bake the bread", "knead the dough", "preheat the oven"]}),
+        "hybrid"  : pd.DataFrame({"distance": [0.90, 0.40], "text": ["router warranty", "reset the router"], "score": [0.033, 0.032]}),
+    }
+
+    def searchCollection(collection_name, query_embeddings, max_results, *args, **kwargs):
+        return [frames[collection_name].head(max_results)]
+
+    monkeypatch.setattr(wxd_milvus, "connectMilvus", lambda: True)
+    monkeypatch.setattr(wxd_milvus, "searchCollection", searchCollection)
+    monkeypatch.setattr(wxd_milvus, "contextWindow", lambda collection_name, context_window=None: 0)
+    monkeypatch.setattr(wxd_milvus, "expandCollection", lambda collection_name, df, context_window=None, max_results=None: df)
+    monkeypatch.setattr(wxd_embeddings, "getQueryEmbedding",
+                        lambda query, model_name=None: (np.zeros(4, dtype=np.float32), {"queue_ms": 0.0, "encode_ms": 0.0, "batch_size": 1, "cache": "hit"}))
+
+    return frames
+
+def test_irrelevant_collection_does_not_displace_closer_chunks(fixedSearch):
+    from wxd_milvus import query_collections
+
+    df = query_collections("how do I reset my router", ["recipes", "manuals"], 3)
+
+    assert list(df["text"]) == ["reset the router", "hold the reset button", "router lights"]
+    assert list(df["collection"]) == ["manuals"] * 3
+
+def test_hybrid_results_are_merged_by_distance(fixedSearch):
+    from wxd_milvus import query_collections
+
+    df = query_collections("how do I reset my router", ["hybrid", "manuals", "recipes"], 4)
+
+    assert list(df["distance"]) == sorted(df["distance"])
+    assert list(df["text"]) == ["reset the router", "hold the reset button", "router lights", "router warranty"]
+    assert df["text"].is_unique
@@ -0,0 +1,79 @@
+#
+#   Check the exact results and the questions used to tune the search parameters of an index.
+#   The collection is replaced with an object that returns its vectors in batches.
+#
+
+import types
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("streamlit")
+
+class Iterator:
+    def __init__(self, rows, batch_size):
+        self.batches = [rows[pos:pos+batch_size] for pos in range(0, len(rows), batch_size)] + [[]]
+
+    def next(self):
+        return self.batches.pop(0)
+
+    def close(self):
+        pass
+
+class FakeCollection:
+    name = "fake"
+
+    def __init__(self, vectors, dtype="FLOAT_VECTOR", stored=None):
+        self.vectors = vectors
+        self.stored = stored if stored is not None else [list(vector) for vector in vectors]
+        self.num_entities = len(vectors)
+        self.schema = types.SimpleNamespace(fields=[types.SimpleNamespace(name="vector", dtype=types.SimpleNamespace(name=dtype))])
+
+    def query_iterator(self, batch_size=1000, output_fields=None):
+        rows = [{"id": 100 + row, "vector": vector} for row, vector in enumerate(self.stored)]
+        return Iterator(rows, batch_size)
+
+def test_exactNeighbours_matches_brute_force():
+    from wxd_milvus import exactNeighbours
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((250, 16)).astype(np.float32)
+    queries = rng.standard_normal((5, 16)).astype(np.float32)
+
+    found = exactNeighbours(FakeCollection(vectors), queries, 7, batch_size=40)
+
+    distances = ((queries[:,None,:] - vectors[None,:,:]) ** 2).sum(axis=2)
+    expected = [set((np.argsort(row)[:7] + 100).tolist()) for row in distances]
+    assert found == expected
+
+def test_exactNeighbours_uses_hamming_for_binary():
+    from wxd_milvus import exactNeighbours, storageVectors
+
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((60, 16)).astype(np.float32)
+    queries = rng.standard_normal((3, 16)).astype(np.float32)
+    stored = storageVectors("BINARY_VECTOR", vectors)
+
+    found = exactNeighbours(FakeCollection(vectors, "BINARY_VECTOR", [[bits] for bits in stored]), queries, 5, batch_size=16)
+
+    bits = lambda values: np.unpackbits(np.frombuffer(b"".join(storageVectors("BINARY_VECTOR", values)), dtype=np.uint8)).reshape(len(values), -1)
+    hamming = (bits(queries)[:,None,:] != bits(vectors)[None,:,:]).sum(axis=2)
+    for row, ids in zip(hamming, found):
+        assert sorted(row[np.asarray(sorted(ids)) - 100]) == sorted(row)[:5]
+
+def test_exactNeighbours_skips_large_collections(monkeypatch):
+    import wxd_milvus
+
+    monkeypatch.setattr(wxd_milvus, "TUNE_EXACT_LIMIT", 10)
+    vectors = np.ones((11, 4), dtype=np.float32)
+
+    assert wxd_milvus.exactNeighbours(FakeCollection(vectors), vectors[:2], 3) is None
+
+def test_tuneQueries_are_near_but_not_equal_to_the_samples():
+    from wxd_milvus import tuneQueries
+
+    samples = np.random.default_rng(3).standard_normal((20, 32)).astype(np.float32)
+    queries = tuneQueries(samples, noise=0.1)
+
+    moved = np.linalg.norm(queries - samples, axis=1) / np.linalg.norm(samples, axis=1)
+    assert np.allclose(moved, 0.1, atol=1e-4)
+    assert np.array_equal(queries, tuneQueries(samples, noise=0.1))
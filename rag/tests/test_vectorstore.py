@@ -0,0 +1,57 @@
+#
+#   Check that a collection of the local backend is read back from a single save.
+#
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("streamlit")
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    import wxd_vectorstore
+
+    monkeypatch.setattr(wxd_vectorstore, "LOCAL_COLLECTIONS", str(tmp_path))
+    return tmp_path
+
+def columns(texts):
+    return {"article_text": texts, "doc_id": [1] * len(texts), "chunk_index": list(range(len(texts)))}
+
+def test_save_replaces_the_previous_generation(store):
+    from wxd_vectorstore import saveLocalCollection, readLocalCollection
+
+    assert saveLocalCollection("docs", {"chunks": 2}, np.ones((2, 4)), columns(["a", "b"]))
+    assert saveLocalCollection("docs", {"chunks": 3}, np.zeros((3, 4)), columns(["c", "d", "e"]))
+
+    info, vectors, saved = readLocalCollection("docs")
+    assert info["chunks"] == 3
+    assert vectors.shape == (3, 4) and not vectors.any()
+    assert saved["article_text"] == ["c", "d", "e"]
+    assert len(list(store.glob("docs.*.npy"))) == 1
+
+def test_read_skips_a_generation_removed_by_a_save(store, monkeypatch):
+    import wxd_vectorstore
+    from wxd_vectorstore import saveLocalCollection, readLocalCollection
+
+    assert saveLocalCollection("docs", {"chunks": 1}, np.ones((1, 4)), columns(["a"]))
+    load = np.load
+    calls = []
+
+    def saveDuringRead(filename, *args, **kwargs):
+        if (len(calls) == 0):
+            calls.append(filename)
+            saveLocalCollection("docs", {"chunks": 2}, np.zeros((2, 4)), columns(["b", "c"]))
+        return load(filename, *args, **kwargs)
+
+    monkeypatch.setattr(np, "load", saveDuringRead)
+
+    info, vectors, saved = readLocalCollection("docs")
+    assert len(vectors) == len(saved["article_text"]) == info["chunks"] == 2
+
+def test_drop_removes_every_file(store):
+    from wxd_vectorstore import saveLocalCollection, dropLocalCollection, listLocalCollections
+
+    assert saveLocalCollection("docs", {"chunks": 1}, np.ones((1, 4)), columns(["a"]))
+    dropLocalCollection("docs")
+    assert listLocalCollections() == []
+    assert list(store.iterdir()) == []
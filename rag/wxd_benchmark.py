@@ -0,0 +1,519 @@
+#---------------------------------------------------------------------------------------------
+# Licensed Materials - Property of IBM 
+# (C) Copyright IBM Corp. 2025 All Rights Reserved.
+# US Government Users Restricted Rights - Use, duplication or disclosure restricted by GSA ADP 
+# Schedule Contract with IBM Corp.
+#
+# Developed by George Baklarz
+#---------------------------------------------------------------------------------------------
+#
+#   Benchmark routines
+#
+#   sampleChunks        - Split one of the sample documents into chunks for benchmarking
+#   benchmarkEmbeddings - Compare the throughput and accuracy of the embedding backends
+#   sampleDocuments     - Return the sample documents as (id, text) pairs
+#   exactSearch         - Brute force nearest neighbours used as the ground truth
+#   benchmarkIndexes    - Compare the recall, latency, build time, and memory of the index profiles
+#   benchmarkStorage    - Compare the recall, latency, and memory of the vector storage modes
+#   benchmarkProjection - Compare the recall, latency, and memory of reduced vector dimensions
+#   checkBackends       - Run the same load, query, and delete checks against each vector backend
+#
+#   The benchmarks do not need a watsonx.data system. The index benchmark runs against Milvus
+#   Lite (a local file) by default, or any Milvus server given with --uri. Note that Milvus Lite
+#   searches every index type as FLAT, so use a Milvus server to compare the index profiles.
+#   Run them from the rag directory:
+#
+#   python3 wxd_benchmark.py embeddings --file samples/IBM_Annual_Report_2023.txt
+#   python3 wxd_benchmark.py indexes --uri ./milvus_benchmark.db --k 9
+#   python3 wxd_benchmark.py storage --uri ./milvus_benchmark.db --k 9
+#   python3 wxd_benchmark.py projection --method pca --dims 64 128 192
+#   python3 wxd_benchmark.py backends --backends milvus local --uri ./milvus_benchmark.db
+#
+
+import time
+from wxd_utilities import log
+
+def sampleChunks(filename, chunk_size=512, chunk_overlap=32):
+    """
+    Read a text file and split it into chunks the same way that storeVectors does.
+    """
+
+    from wxd_milvus import chunkDocuments
+
+    with open(filename, encoding="utf-8", errors="ignore") as fd:
+        document = fd.read()
+
+    return [chunk["text"] for chunk in chunkDocuments([(0, document)], chunk_size, chunk_overlap)]
+
+def benchmarkEmbeddings(passages, backends=None, batch_size=32):
+    """
+    Encode the passages with each embedding backend and return a dataframe with the throughput,
+    the speedup over PyTorch, and the cosine similarity of each vector to the PyTorch vector. A
+    backend is compatible with existing collections if the minimum cosine similarity is at least
+    the tolerance listed in EMBEDDING_TOLERANCE. The caches are bypassed so every passage is encoded.
+    """
+
+    import numpy as np
+    import pandas as pd
+    from wxd_embeddings import getEmbeddingModel, embeddingModel, EMBEDDING_BACKENDS, EMBEDDING_TOLERANCE
+
+    program = "benchmarkEmbeddings"
+
+    if (backends in [None,[]]):
+        backends = list(EMBEDDING_BACKENDS)
+    if ("torch" not in backends):
+        backends = ["torch"] + backends
+
+    results = []
+    reference = None
+    reference_rate = None
+
+    for backend in backends:
+        model = getEmbeddingModel(embeddingModel(backend))
+        if (model is None):
+            log(program,f"[1] Backend {backend} is not available")
+            continue
+
+        model.encode(passages[:batch_size], batch_size=batch_size)        # Warm up
+
+        start = time.perf_counter()
+        vectors = np.asarray(model.encode(passages, batch_size=batch_size), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        if (reference is None):
+            reference = vectors
+            reference_rate = len(passages) / elapsed
+        cosine = np.sum(vectors * reference, axis=1)
+
+        rate = len(passages) / elapsed
+        results.append({
+            "backend"      : backend,
+            "passages"     : len(passages),
+            "seconds"      : round(elapsed, 3),
+            "passages/sec" : round(rate, 1),
+            "speedup"      : round(rate / reference_rate, 2),
+            "min cosine"   : round(float(cosine.min()), 5),
+            "mean cosine"  : round(float(cosine.mean()), 5),
+            "tolerance"    : EMBEDDING_TOLERANCE[backend],
+            "compatible"   : bool(cosine.min() >= EMBEDDING_TOLERANCE[backend])
+        })
+
+    return pd.DataFrame(results)
+
+def sampleDocuments(directory="samples"):
+    """
+    Return the bundled sample data as (id, text) documents: the IBM annual report is document 1,
+    and each consumer complaint is a separate document numbered from 2.
+    """
+
+    import csv, os
+
+    documents = []
+
+    with open(os.path.join(directory, "IBM_Annual_Report_2023.txt"), encoding="utf-8", errors="ignore") as fd:
+        documents.append((1, fd.read()))
+
+    with open(os.path.join(directory, "complaints-2025.csv"), encoding="utf-8", errors="ignore") as fd:
+        reader = csv.reader(fd, delimiter=',', quotechar='"')
+        next(reader)
+        for row_no, row in enumerate(reader):
+            if (len(row) > 2 and row[2].strip() != ""):
+                documents.append((row_no + 2, row[2]))
+
+    return documents
+
+def exactSearch(vectors, queries, k):
+    """
+    Return the row numbers of the k nearest vectors (squared L2 distance) for every query, nearest
+    first. This is the exact answer that the Milvus indexes are compared against.
+    """
+
+    import numpy as np
+
+    distances = np.sum(vectors**2, axis=1)[None,:] - 2 * queries @ vectors.T
+    k = min(k, vectors.shape[0])
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1)
+
+    return np.take_along_axis(nearest, order, axis=1)
+
+def estimateMemory(profile, count, dim):
+    """
+    Estimate the memory used by an index when Milvus does not report it (Milvus Lite).
+    """
+
+    params = profile["params"]
+    index_type = profile["index_type"]
+
+    if (index_type == "IVF_SQ8"):
+        per_vector = dim
+    elif (index_type == "IVF_PQ"):
+        per_vector = params.get("m", 48) * params.get("nbits", 8) / 8
+    elif (index_type == "HNSW"):
+        per_vector = 4 * dim + params.get("M", 16) * 2 * 8
+    elif (index_type.startswith("BIN_")):
+        per_vector = dim / 8
+    elif (index_type == "DISKANN"):
+        per_vector = dim / 4                  # Compressed vectors kept in memory, the graph is on disk
+    else:
+        per_vector = 4 * dim
+
+    return count * per_vector
+
+def benchmarkIndexes(profiles=None, k=9, query_count=100, recall_target=None, uri="./milvus_benchmark.db", directory="samples"):
+    """
+    Build a collection from the sample documents with each index profile and compare recall@k,
+    the p50/p95/p99 search latency, the build time, and the memory used. The ground truth is an
+    exact NumPy search over the same vectors. The questions are a random sample of the chunks.
+    """
+
+    import random
+    import numpy as np
+    import pandas as pd
+    from pymilvus import connections, utility
+    from wxd_milvus import (INDEX_PROFILES, indexProfile, createCollection, chunkDocuments, insertChunks, chunkSize,
+                            autoIndexParams, buildIndex, tuneSearchParams, searchParams)
+    from wxd_embeddings import embedPassages, embeddingModel, EMBEDDING_DIM
+
+    program = "benchmarkIndexes"
+
+    if (profiles in [None,[]]):
+        profiles = [name for name in INDEX_PROFILES if not name.startswith("BIN_")]
+
+    connections.connect(alias="default", uri=uri)
+
+    chunks = list(chunkDocuments(sampleDocuments(directory), chunkSize("Small")))
+    texts = [chunk["text"] for chunk in chunks]
+    vectors = np.asarray(embedPassages(texts, embeddingModel()), dtype=np.float32)
+
+    random.seed(42)
+    query_rows = random.sample(range(len(chunks)), min(query_count, len(chunks)))
+    queries = vectors[query_rows]
+    truth = [set(texts[row] for row in rows) for rows in exactSearch(vectors, queries, k)]
+
+    results = []
+    for name in profiles:
+        profile = indexProfile(name)
+        collection_name = f"benchmark_{name}"
+        result = {"profile": name, "chunks": len(chunks)}
+
+        try:
+            utility.drop_collection(collection_name)
+            collection = createCollection(collection_name)
+            if (collection is None):
+                raise RuntimeError("collection create failed")
+            insertChunks(collection, iter(chunks), embeddingModel())
+
+            start = time.time()
+            collection.flush()
+            profile["params"] = autoIndexParams(profile, len(chunks))
+            if (buildIndex(collection, profile) == False):
+                raise RuntimeError("index build failed")
+            result["build_s"] = round(time.time() - start, 2)
+
+            tuning = tuneSearchParams(collection, profile, list(vectors[:64]), limit=k, recall_target=recall_target)
+            if (tuning is not None):
+                profile["search_params"] = tuning["search_params"]
+            result["params"] = f"{profile['params']} {profile['search_params']}"
+
+            found = []
+            latencies = []
+            for query in queries:
+                begin = time.perf_counter()
+                hits = collection.search(data=[list(map(float, query))], anns_field="vector",
+                                         param=searchParams(profile, k), limit=k, output_fields=["article_text"])
+                latencies.append((time.perf_counter() - begin) * 1000)
+                found.append(set(hit.entity.get("article_text") for hit in hits[0]))
+
+            result["recall@k"] = round(float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])), 4)
+            result["p50_ms"] = round(float(np.percentile(latencies, 50)), 2)
+            result["p95_ms"] = round(float(np.percentile(latencies, 95)), 2)
+            result["p99_ms"] = round(float(np.percentile(latencies, 99)), 2)
+
+            try:
+                memory = sum(segment.mem_size for segment in utility.get_query_segment_info(collection_name))
+            except Exception:
+                memory = 0
+            result["estimated"] = (memory == 0)
+            if (memory == 0):
+                memory = estimateMemory(profile, len(chunks), EMBEDDING_DIM)
+            result["memory_mb"] = round(memory / 1024 / 1024, 2)
+
+            utility.drop_collection(collection_name)
+
+        except Exception as e:
+            log(program,f"[1] Profile {name} failed")
+            log(program,f"[1] {repr(e)}")
+            result["error"] = repr(e)
+
+        results.append(result)
+
+    return pd.DataFrame(results)
+
+def benchmarkStorage(modes=None, k=9, query_count=100, uri="./milvus_benchmark.db", directory="samples"):
+    """
+    Build a collection from the sample documents with each vector storage mode and compare
+    recall@k, the p50/p95 search latency, and the memory used by the vectors. BINARY collections
+    are searched the way the application searches them, by Hamming distance followed by a re-rank
+    with the full precision vectors. The ground truth is an exact NumPy search.
+    """
+
+    import random
+    import numpy as np
+    import pandas as pd
+    from pymilvus import connections, utility
+    from wxd_milvus import (STORAGE_MODES, INDEX_PROFILE, BINARY_RERANK, indexProfile, createCollection, chunkDocuments,
+                            insertChunks, chunkSize, autoIndexParams, buildIndex, searchParams, storageVectors, vectorType,
+                            rerankBinary)
+    from wxd_embeddings import embedPassages, embeddingModel, EMBEDDING_DIM
+    from wxd_vectorstore import dropLocalVectors
+
+    program = "benchmarkStorage"
+
+    if (modes in [None,[]]):
+        modes = list(STORAGE_MODES)
+
+    connections.connect(alias="default", uri=uri)
+
+    chunks = list(chunkDocuments(sampleDocuments(directory), chunkSize("Small")))
+    texts = [chunk["text"] for chunk in chunks]
+    vectors = np.asarray(embedPassages(texts, embeddingModel()), dtype=np.float32)
+
+    random.seed(42)
+    query_rows = random.sample(range(len(chunks)), min(query_count, len(chunks)))
+    queries = vectors[query_rows]
+    truth = [set(texts[row] for row in rows) for rows in exactSearch(vectors, queries, k)]
+
+    results = []
+    for mode in modes:
+        storage = STORAGE_MODES[mode]
+        profile = indexProfile(storage["index"] or INDEX_PROFILE)
+        collection_name = f"benchmark_storage_{mode.lower()}"
+        result = {"storage": mode, "index": profile["index_type"], "chunks": len(chunks)}
+
+        try:
+            utility.drop_collection(collection_name)
+            dropLocalVectors(collection_name)
+            collection = createCollection(collection_name, storage=mode)
+            if (collection is None):
+                raise RuntimeError("collection create failed")
+            local_store = collection_name if mode == "BINARY" else None
+            insertChunks(collection, iter(chunks), embeddingModel(), local_store=local_store)
+            collection.flush()
+            profile["params"] = autoIndexParams(profile, len(chunks))
+            if (buildIndex(collection, profile) == False):
+                raise RuntimeError("index build failed")
+
+            vector_type = vectorType(collection)
+            limit = k * BINARY_RERANK if mode == "BINARY" else k
+
+            found = []
+            latencies = []
+            for query in queries:
+                begin = time.perf_counter()
+                hits = collection.search(data=storageVectors(vector_type, [query]), anns_field="vector",
+                                         param=searchParams(profile, limit), limit=limit, output_fields=["article_text"])
+                df = pd.DataFrame({"distance": [hit.distance for hit in hits[0]],
+                                   "text": [hit.entity.get("article_text") for hit in hits[0]]})
+                if (mode == "BINARY"):
+                    df = rerankBinary(local_store, query, [hit.id for hit in hits[0]], df, k)
+                latencies.append((time.perf_counter() - begin) * 1000)
+                found.append(set(df["text"]))
+
+            result["recall@k"] = round(float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])), 4)
+            result["p50_ms"] = round(float(np.percentile(latencies, 50)), 2)
+            result["p95_ms"] = round(float(np.percentile(latencies, 95)), 2)
+            result["vector_mb"] = round(len(chunks) * EMBEDDING_DIM * storage["bytes"] / 1024 / 1024, 2)
+
+            utility.drop_collection(collection_name)
+            dropLocalVectors(collection_name)
+
+        except Exception as e:
+            log(program,f"[1] Storage mode {mode} failed")
+            log(program,f"[1] {repr(e)}")
+            result["error"] = repr(e)
+
+        results.append(result)
+
+    return pd.DataFrame(results)
+
+def benchmarkProjection(method="pca", dims=None, k=9, query_count=100, directory="samples"):
+    """
+    Reduce the vectors of the sample documents to each dimension with the projection method and
+    compare recall@k, the search latency, and the memory used by the vectors against the full
+    vectors. The projection is fitted to the first INSERT_BATCH_SIZE chunks, as it is when a
+    collection is built, and the searches are exact NumPy searches so only the projection is
+    measured. Milvus is not needed.
+    """
+
+    import random
+    import numpy as np
+    import pandas as pd
+    from wxd_milvus import INSERT_BATCH_SIZE, chunkDocuments, chunkSize, fitProjection, projectVectors
+    from wxd_embeddings import embedPassages, embeddingModel, EMBEDDING_DIM
+
+    if (dims in [None,[]]):
+        dims = [64, 128, 192, 256]
+
+    chunks = list(chunkDocuments(sampleDocuments(directory), chunkSize("Small")))
+    texts = [chunk["text"] for chunk in chunks]
+    vectors = np.asarray(embedPassages(texts, embeddingModel()), dtype=np.float32)
+
+    random.seed(42)
+    query_rows = random.sample(range(len(chunks)), min(query_count, len(chunks)))
+    queries = vectors[query_rows]
+    truth = [set(rows) for rows in exactSearch(vectors, queries, k)]
+
+    results = []
+    for dim in [EMBEDDING_DIM] + [dim for dim in dims if dim < EMBEDDING_DIM]:
+        result = {"method": method if dim < EMBEDDING_DIM else "none", "dim": dim, "chunks": len(chunks)}
+        reduced, reduced_queries = vectors, queries
+        if (dim < EMBEDDING_DIM):
+            projection = {"method": method, "dim": dim}
+            if (method == "pca"):
+                fitProjection(projection, vectors[:INSERT_BATCH_SIZE])
+                result["explained"] = projection["explained"]
+            reduced = projectVectors(projection, vectors)
+            reduced_queries = projectVectors(projection, queries)
+
+        begin = time.perf_counter()
+        found = exactSearch(reduced, reduced_queries, k)
+        result["search_ms"] = round((time.perf_counter() - begin) * 1000 / len(queries), 4)
+        result["recall@k"] = round(float(np.mean([len(set(f) & t) / len(t) for f, t in zip(found, truth)])), 4)
+        result["vector_mb"] = round(len(chunks) * dim * 4 / 1024 / 1024, 2)
+        results.append(result)
+
+    return pd.DataFrame(results)
+
+def checkBackends(backends=None, uri="./milvus_benchmark.db", directory="samples", collection_name="backend_check"):
+    """
+    Run the same checks against each vector backend through the functions the application uses:
+    connect, store a collection, list it, query it (with and without a document filter), append
+    documents, delete a document, and drop the collection. Twenty of the sample complaints are
+    used as the documents. The milvus backend uses the server or Milvus Lite file given by uri (the
+    watsonx.data connection in the session is not available outside of Streamlit).
+    A DataFrame with one row per backend and True or False for each check is returned.
+    """
+
+    import pandas as pd
+    import wxd_milvus
+    from wxd_milvus import (VECTOR_BACKENDS, connectMilvus, storeVectors, collectionNames, collectionDocuments,
+                            query_milvus, deleteDocumentVectors, dropCollections, chunkDocuments, chunkSize)
+
+    program = "checkBackends"
+
+    if (backends in [None,[]]):
+        backends = list(VECTOR_BACKENDS)
+    if ("milvus" in backends and uri in [None,""]):
+        log(program,"[2] A Milvus server or Milvus Lite file (uri) is required for the milvus backend")
+        raise ValueError("uri is required for the milvus backend")
+
+    documents = sampleDocuments(directory)[1:21]
+    loaded, appended = documents[:15], documents[15:]
+    loaded_ids = [id for id, _ in loaded]
+    probe = next(chunkDocuments(loaded[:1], chunkSize("Small")))
+
+    def topDocument(df):
+        return int(df['doc_id'].iloc[0]) if (df is not None and len(df) > 0) else None
+
+    saved = (wxd_milvus.VECTOR_BACKEND, wxd_milvus.MILVUS_URI)
+    results = []
+    for backend in backends:
+        wxd_milvus.VECTOR_BACKEND = backend
+        if (backend == "milvus"):
+            wxd_milvus.MILVUS_URI = uri
+
+        checks = [
+            ("connect",   lambda: connectMilvus()),
+            ("store",     lambda: storeVectors(None, collection_name, loaded_ids, "Small", documents=loaded) is not None),
+            ("list",      lambda: collection_name in collectionNames()),
+            ("documents", lambda: sorted(collectionDocuments(collection_name)) == sorted(loaded_ids)),
+            ("query",     lambda: query_milvus(probe["text"], collection_name, 3)['text'].iloc[0] == probe["text"]),
+            ("filter",    lambda: set(query_milvus(probe["text"], collection_name, 3, doc_ids=[loaded_ids[1]])['doc_id']) == {loaded_ids[1]}),
+            ("append",    lambda: storeVectors(None, collection_name, [id for id, _ in appended], "Small", mode="append", documents=appended) is not None
+                                  and len(collectionDocuments(collection_name)) == len(documents)),
+            ("delete",    lambda: collection_name in deleteDocumentVectors([probe["doc_id"]], [collection_name])
+                                  and topDocument(query_milvus(probe["text"], collection_name, 3)) != probe["doc_id"]),
+            ("drop",      lambda: dropCollections([collection_name]) and collection_name not in collectionNames()),
+        ]
+
+        result = {"backend": backend}
+        for name, check in checks:
+            start = time.perf_counter()
+            try:
+                result[name] = bool(check())
+            except Exception as e:
+                log(program,f"[1] {backend} {name} check failed")
+                log(program,f"[1] {repr(e)}")
+                result[name] = False
+            result[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        result["passed"] = all(result[name] for name, _ in checks)
+        results.append(result)
+
+    wxd_milvus.VECTOR_BACKEND, wxd_milvus.MILVUS_URI = saved
+
+    return pd.DataFrame(results)
+
+def main():
+    """
+    Command line entry point for the benchmarks.
+    """
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="watsonx.data Milvus RAG benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    embeddings = commands.add_parser("embeddings", help="Compare the embedding backends")
+    embeddings.add_argument("--file", default="samples/IBM_Annual_Report_2023.txt")
+    embeddings.add_argument("--backends", nargs="*", default=None)
+    embeddings.add_argument("--batch-size", type=int, default=32)
+
+    indexes = commands.add_parser("indexes", help="Compare the Milvus index profiles")
+    indexes.add_argument("--uri", default="./milvus_benchmark.db")
+    indexes.add_argument("--profiles", nargs="*", default=None)
+    indexes.add_argument("--k", type=int, default=9)
+    indexes.add_argument("--queries", type=int, default=100)
+    indexes.add_argument("--recall-target", type=float, default=None)
+    indexes.add_argument("--samples", default="samples")
+
+    storage = commands.add_parser("storage", help="Compare the vector storage modes")
+    storage.add_argument("--uri", default="./milvus_benchmark.db")
+    storage.add_argument("--modes", nargs="*", default=None)
+    storage.add_argument("--k", type=int, default=9)
+    storage.add_argument("--queries", type=int, default=100)
+    storage.add_argument("--samples", default="samples")
+
+    projection = commands.add_parser("projection", help="Compare reduced vector dimensions")
+    projection.add_argument("--method", default="pca", choices=["pca","truncate"])
+    projection.add_argument("--dims", nargs="*", type=int, default=None)
+    projection.add_argument("--k", type=int, default=9)
+    projection.add_argument("--queries", type=int, default=100)
+    projection.add_argument("--samples", default="samples")
+
+    backends = commands.add_parser("backends", help="Run the same checks against each vector backend")
+    backends.add_argument("--backends", nargs="*", default=None)
+    backends.add_argument("--uri", default="./milvus_benchmark.db")
+    backends.add_argument("--samples", default="samples")
+
+    args = parser.parse_args()
+
+    if (args.command == "embeddings"):
+        passages = sampleChunks(args.file)
+        print(benchmarkEmbeddings(passages, args.backends, args.batch_size).to_string(index=False))
+    elif (args.command == "indexes"):
+        print(benchmarkIndexes(args.profiles, args.k, args.queries, args.recall_target, args.uri, args.samples).to_string(index=False))
+    elif (args.command == "storage"):
+        print(benchmarkStorage(args.modes, args.k, args.queries, args.uri, args.samples).to_string(index=False))
+    elif (args.command == "projection"):
+        print(benchmarkProjection(args.method, args.dims, args.k, args.queries, args.samples).to_string(index=False))
+    elif (args.command == "backends"):
+        results = checkBackends(args.backends, args.uri, args.samples)
+        print(results.to_string(index=False))
+        if (not results["passed"].all()):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,895 @@
+#---------------------------------------------------------------------------------------------
+# Licensed Materials - Property of IBM 
+# (C) Copyright IBM Corp. 2025 All Rights Reserved.
+# US Government Users Restricted Rights - Use, duplication or disclosure restricted by GSA ADP 
+# Schedule Contract with IBM Corp.
+#
+# Developed by George Baklarz
+#---------------------------------------------------------------------------------------------
+#
+#   Embedding routines
+#
+#   getEmbeddingModel   - Return the shared copy of an embedding model (loaded once per process)
+#   warmEmbeddingModels - Load the default embedding model in the background at startup
+#   releaseIdleModels   - Unload any models that have not been used recently
+#   encodeTexts         - Convert a list of strings into vectors
+#   rerankPassages      - Score (question, chunk) pairs with a cross-encoder in one batch
+#   embedQuery          - Convert one question into a vector, batching it with concurrent questions
+#   getQueryEmbedding   - Return the vector for a question, using the query cache when possible
+#   getQueryEmbeddings  - Return the vectors for a list of questions, encoding the new ones in one batch
+#   prewarmQueryCache   - Place the vectors for previously asked questions into the query cache
+#   queryCacheStats     - Return the hit and miss counts for the query cache
+#   embedPassages       - Convert document chunks into vectors, reusing vectors stored in the chunk cache
+#   embeddingModel      - Return the model name used to select an embedding backend
+#   releaseEmbeddingPool - Shut down the worker processes used for large documents
+#   openChunkCache      - Open the chunk cache once for a load that embeds many batches
+#   closeChunkCache     - Prune the chunk cache and close it at the end of a load
+#   pruneChunkCache     - Remove the least recently used vectors and the vectors of retired models
+#   dropChunkCache      - Remove every vector stored for a model from the chunk cache
+#   sparseTerms         - Split text into words and hash each one to a sparse vector dimension
+#   sparsePassages      - Convert document chunks into BM25 sparse vectors, updating the term statistics
+#   sparseQuery         - Convert a question into a sparse vector weighted by the term statistics
+#
+#   A model name may carry a backend suffix (sentence-transformers/all-MiniLM-L6-v2#onnx-int8). The
+#   full name is used as the key for the model registry and for both caches, so vectors produced by
+#   different backends are never mixed.
+#
+
+import queue
+import threading
+import time
+from wxd_utilities import log
+
+EMBEDDING_MODEL     = 'sentence-transformers/all-MiniLM-L6-v2'  # 384 dim
+EMBEDDING_DIM       = 384
+EMBEDDING_BACKEND   = "torch"
+MODEL_IDLE_SECONDS  = 1800                                        # Unload a model after 30 minutes of no use
+MODEL_CHECK_SECONDS = 60
+BATCH_WAIT_MS       = 5                                           # How long to wait for other questions to arrive
+BATCH_MAX_SIZE      = 32
+QUERY_CACHE_SIZE    = 2048                                        # Number of question vectors kept in memory
+QUERY_CACHE_TTL     = None                                        # Seconds before a cached vector expires (None = never)
+UNCASED_MODELS      = ['sentence-transformers/all-MiniLM-L6-v2']  # Models whose tokenizer lowercases the text
+CHUNK_CACHE         = "/home/watsonx/cache/embeddings.db"         # Persistent vectors keyed by model + chunk hash
+CHUNK_CACHE_BATCH   = 500
+CHUNK_CACHE_ROWS    = 200000                                      # Most vectors kept in the chunk cache (about 300MB at 384 dim)
+EMBEDDING_WORKERS   = 1                                           # Worker processes used to vectorize a document
+POOL_MIN_PASSAGES   = 256                                         # Smaller jobs are encoded in this process
+POOL_SHARD_SIZE     = 128                                         # Most passages sent to a worker at a time
+RERANK_MODEL        = 'cross-encoder/ms-marco-MiniLM-L-6-v2'     # Small CPU cross-encoder for re-ranking
+RERANK_MODELS       = ['cross-encoder/ms-marco-MiniLM-L-6-v2']    # Models loaded as cross-encoders
+BM25_K1             = 1.2                                         # Term frequency saturation
+BM25_B              = 0.75                                        # Chunk length normalization
+
+#
+# Embedding backends. The ONNX files are published with the all-MiniLM-L6-v2 model; the int8 file
+# is dynamically quantized for AVX2 CPUs. EMBEDDING_TOLERANCE is the minimum cosine similarity
+# between a vector from the backend and the PyTorch vector for the same text, which is what keeps
+# the vectors usable against collections built with PyTorch. Check it with wxd_benchmark.py.
+#
+
+EMBEDDING_BACKENDS = {
+    "torch"     : {},
+    "onnx"      : {"backend": "onnx"},
+    "onnx-int8" : {"backend": "onnx", "model_kwargs": {"file_name": "onnx/model_quint8_avx2.onnx"}}
+}
+
+EMBEDDING_TOLERANCE = {
+    "torch"     : 1.0,
+    "onnx"      : 0.999,
+    "onnx-int8" : 0.98
+}
+
+#
+# The model registry is shared by every Streamlit session in the process. Streamlit only imports
+# a module once, so these values survive page changes and reruns. Each entry has its own lock so
+# that a slow model load does not block requests for a different model.
+#
+
+_models      = {}
+_models_lock = threading.Lock()
+_reaper      = None
+
+_batchers      = {}
+_batchers_lock = threading.Lock()
+
+_query_cache       = {}                                          # Insertion ordered, oldest entry first
+_query_cache_lock  = threading.Lock()
+_query_cache_stats = {"hits": 0, "misses": 0}
+
+_pool       = None                                               # Worker processes for embedPassages
+_pool_lock  = threading.Lock()
+_pool_model = None                                               # The model loaded inside a worker process
+
+_chunk_cache_pruned = False                                      # Retired models are removed once per process
+
+def getEmbeddingModel(model_name=EMBEDDING_MODEL):
+    """
+    Return the embedding model with the given name. The model is loaded the first time it is
+    requested and then shared by all sessions and pages in the process. None is returned if the
+    model cannot be loaded.
+    """
+
+    program = "getEmbeddingModel"
+
+    while True:
+        with _models_lock:
+            entry = _models.get(model_name)
+            if (entry is None):
+                entry = {"model": None, "lock": threading.Lock(), "last_used": time.time()}
+                _models[model_name] = entry
+        entry["lock"].acquire()
+        if (_models.get(model_name) is entry):
+            break
+        entry["lock"].release()            # Released by the idle check while we waited
+
+    try:
+        if (entry["model"] is None):
+            from sentence_transformers import SentenceTransformer
+            base_name, backend = _splitModel(model_name)
+            if (backend not in EMBEDDING_BACKENDS):
+                log(program,f"[2] Unknown embedding backend {backend}")
+                return None
+            try:
+                start = time.time()
+                if (base_name in RERANK_MODELS):
+                    from sentence_transformers import CrossEncoder
+                    entry["model"] = CrossEncoder(base_name)
+                else:
+                    entry["model"] = SentenceTransformer(base_name, **EMBEDDING_BACKENDS[backend])
+                log(program,f"Loaded {model_name} in {time.time()-start:.2f}s")
+            except Exception as e:
+                log(program,f"[1] Unable to load {model_name}")
+                log(program,f"[1] {repr(e)}")
+                return None
+            _startReaper()
+        entry["last_used"] = time.time()
+        return entry["model"]
+    finally:
+        entry["lock"].release()
+
+def warmEmbeddingModels(model_names=None):
+    """
+    Load the embedding models in a background thread so that the first question or vectorization
+    request does not pay the model load cost. Models that are already loaded are not reloaded.
+    """
+
+    if (model_names in [None,[]]):
+        model_names = [EMBEDDING_MODEL]
+
+    def warm():
+        for model_name in model_names:
+            getEmbeddingModel(model_name)
+
+    threading.Thread(target=warm, name="warmEmbeddingModels", daemon=True).start()
+
+def releaseIdleModels(idle_seconds=MODEL_IDLE_SECONDS):
+    """
+    Unload any model that has not been used for idle_seconds. A model that is being loaded or used
+    by another thread is skipped and will be checked again on the next pass.
+    """
+
+    import gc
+
+    program = "releaseIdleModels"
+
+    released = []
+    now = time.time()
+    with _models_lock:
+        for model_name, entry in list(_models.items()):
+            if (entry["model"] is None or now - entry["last_used"] < idle_seconds):
+                continue
+            if (entry["lock"].acquire(blocking=False) == False):
+                continue
+            try:
+                del _models[model_name]
+                entry["model"] = None
+                released.append(model_name)
+            finally:
+                entry["lock"].release()
+
+    if (len(released) > 0):
+        gc.collect()
+        for model_name in released:
+            log(program,f"Released idle model {model_name}")
+
+    with _pool_lock:
+        idle_pool = (_pool is not None and now - _pool["last_used"] >= idle_seconds)
+    if idle_pool:
+        releaseEmbeddingPool()
+
+    return released
+
+def _startReaper():
+    """
+    Start the background thread that unloads idle models. Only one thread is started per process.
+    """
+
+    global _reaper
+
+    def reap():
+        while True:
+            time.sleep(MODEL_CHECK_SECONDS)
+            releaseIdleModels()
+
+    with _models_lock:
+        if (_reaper is None):
+            _reaper = threading.Thread(target=reap, name="releaseIdleModels", daemon=True)
+            _reaper.start()
+
+def encodeTexts(texts, model_name=EMBEDDING_MODEL):
+    """
+    Convert a list of strings into a list of vectors using the shared embedding model. None is
+    returned if the model is not available or the encoding fails.
+    """
+
+    program = "encodeTexts"
+
+    model = getEmbeddingModel(model_name)
+    if (model is None):
+        log(program,"[1] No embedding model available")
+        return None
+
+    try:
+        return model.encode(texts)
+    except Exception as e:
+        log(program,f"[2] Error in Sentence Transformer")
+        log(program,f"[2] {repr(e)}")
+        return None
+
+def rerankPassages(pairs, model_name=RERANK_MODEL):
+    """
+    Score a list of (question, chunk) pairs with a cross-encoder. All of the pairs are scored in a
+    single batch; a higher score means the chunk is more relevant to the question. The scores are
+    returned as an array along with the time taken in milliseconds, or None if the model is not
+    available. The cross-encoder shares the model registry, so it is loaded once per process and
+    unloaded when idle.
+    """
+
+    import numpy as np
+
+    program = "rerankPassages"
+
+    model = getEmbeddingModel(model_name)
+    if (model is None):
+        log(program,"[1] No re-rank model available")
+        return None, None
+
+    try:
+        start = time.perf_counter()
+        scores = model.predict(pairs, batch_size=max(len(pairs), 1), show_progress_bar=False)
+        return np.asarray(scores, dtype=np.float32), (time.perf_counter() - start) * 1000
+    except Exception as e:
+        log(program,f"[2] Error in Cross Encoder")
+        log(program,f"[2] {repr(e)}")
+        return None, None
+
+def embedQuery(query, model_name=EMBEDDING_MODEL, timeout=60):
+    """
+    Convert a single question into a vector. Questions that arrive from other sessions within a few
+    milliseconds of each other are encoded together in one call to the model, which is much cheaper
+    on a CPU than encoding each question separately. The return value is the vector and a dictionary
+    with the time spent waiting in the queue, the time spent encoding, and the size of the batch.
+    (None, None) is returned if the question could not be encoded.
+    """
+
+    program = "embedQuery"
+
+    request = {
+        "text"    : query,
+        "queued"  : time.perf_counter(),
+        "done"    : threading.Event(),
+        "vector"  : None,
+        "timings" : None
+    }
+
+    _getBatcher(model_name).put(request)
+
+    if (request["done"].wait(timeout) == False):
+        log(program,f"[1] Timed out after {timeout}s waiting for the embedding model")
+        return None, None
+
+    if (request["vector"] is None):
+        log(program,"[2] Unable to vectorize the query")
+        return None, None
+
+    return request["vector"], request["timings"]
+
+def _getBatcher(model_name):
+    """
+    Return the request queue for a model, starting the thread that services it if required.
+    """
+
+    with _batchers_lock:
+        requests = _batchers.get(model_name)
+        if (requests is None):
+            requests = queue.Queue()
+            threading.Thread(target=_runBatcher, args=(model_name, requests), name="embedQuery", daemon=True).start()
+            _batchers[model_name] = requests
+
+    return requests
+
+def _runBatcher(model_name, requests):
+    """
+    Collect questions from the queue and encode them as a batch. The batch is closed BATCH_WAIT_MS
+    after the first question was queued, or when BATCH_MAX_SIZE questions have been collected. If
+    the previous batch took longer than that, whatever is waiting is taken immediately.
+    """
+
+    program = "embedQuery"
+
+    while True:
+        batch = [requests.get()]
+        deadline = batch[0]["queued"] + BATCH_WAIT_MS / 1000
+        while (len(batch) < BATCH_MAX_SIZE):
+            remaining = deadline - time.perf_counter()
+            try:
+                if (remaining > 0):
+                    batch.append(requests.get(timeout=remaining))
+                else:
+                    batch.append(requests.get_nowait())
+            except queue.Empty:
+                break
+
+        start = time.perf_counter()
+        try:
+            vectors = encodeTexts([request["text"] for request in batch], model_name)
+        except Exception as e:
+            log(program,f"[3] {repr(e)}")
+            vectors = None
+        end = time.perf_counter()
+
+        for i, request in enumerate(batch):
+            if (vectors is not None):
+                request["vector"] = vectors[i]
+            request["timings"] = {
+                "queue_ms"   : (start - request["queued"]) * 1000,
+                "encode_ms"  : (end - start) * 1000,
+                "batch_size" : len(batch)
+            }
+            request["done"].set()
+
+def normalizeQuery(query, model_name=EMBEDDING_MODEL):
+    """
+    Reduce a question to the form used as the query cache key. Runs of whitespace are collapsed
+    since the tokenizer ignores them, and the text is lowercased for models with an uncased
+    tokenizer, so the normalized text produces exactly the same vector as the original.
+    """
+
+    normalized = " ".join(str(query).split())
+    if (_splitModel(model_name)[0] in UNCASED_MODELS):
+        normalized = normalized.lower()
+    return normalized
+
+def getQueryEmbedding(query, model_name=EMBEDDING_MODEL):
+    """
+    Return the vector for a question along with the timings from embedQuery. Questions that have
+    been asked before (by any session) are returned from the query cache without running the
+    model, in which case the timings include "cache": "hit".
+    """
+
+    key = (model_name, normalizeQuery(query, model_name))
+
+    vector = _getCachedQuery(key)
+    if (vector is not None):
+        return vector, {"queue_ms": 0.0, "encode_ms": 0.0, "batch_size": 0, "cache": "hit"}
+
+    vector, timings = embedQuery(key[1], model_name)
+    if (vector is None):
+        return None, None
+
+    _putCachedQuery(key, vector)
+    timings["cache"] = "miss"
+
+    return vector, timings
+
+def getQueryEmbeddings(queries, model_name=EMBEDDING_MODEL):
+    """
+    Return the vectors for a list of questions along with the timings. Questions in the query
+    cache are reused, and the rest are encoded by the model in a single batch and added to the
+    cache. None is returned for the vectors if the model could not encode the questions.
+    """
+
+    keys = [(model_name, normalizeQuery(query, model_name)) for query in queries]
+    vectors = [_getCachedQuery(key) for key in keys]
+
+    missing = []
+    for key, vector in zip(keys, vectors):
+        if (vector is None and key not in missing):
+            missing.append(key)
+
+    timings = {"queue_ms": 0.0, "encode_ms": 0.0, "batch_size": len(missing), "hits": sum(vector is not None for vector in vectors)}
+
+    if (len(missing) > 0):
+        start = time.perf_counter()
+        encoded = encodeTexts([key[1] for key in missing], model_name)
+        if (encoded is None):
+            return None, None
+        timings["encode_ms"] = (time.perf_counter() - start) * 1000
+        encoded = dict(zip(missing, encoded))
+        for key, vector in encoded.items():
+            _putCachedQuery(key, vector)
+        vectors = [encoded[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+    return vectors, timings
+
+def prewarmQueryCache(queries, model_name=EMBEDDING_MODEL):
+    """
+    Encode any of the questions that are not already in the query cache so that asking them again
+    skips the model. The work is done in one batch on a background thread. Prewarming does not
+    count as a cache hit or miss.
+    """
+
+    program = "prewarmQueryCache"
+
+    if (queries in [None,[]]):
+        return
+
+    keys = []
+    with _query_cache_lock:
+        for query in queries:
+            if (query in [None,""]):
+                continue
+            key = (model_name, normalizeQuery(query, model_name))
+            if (key not in _query_cache and key not in keys):
+                keys.append(key)
+
+    if (len(keys) == 0):
+        return
+
+    def warm():
+        vectors = encodeTexts([key[1] for key in keys], model_name)
+        if (vectors is None):
+            log(program,"[1] Unable to prewarm the query cache")
+            return
+        for key, vector in zip(keys, vectors):
+            _putCachedQuery(key, vector)
+        log(program,f"Prewarmed {len(keys)} questions")
+
+    threading.Thread(target=warm, name="prewarmQueryCache", daemon=True).start()
+
+def queryCacheStats():
+    """
+    Return the number of hits, misses, and entries in the query cache.
+    """
+
+    with _query_cache_lock:
+        stats = dict(_query_cache_stats)
+        stats["size"] = len(_query_cache)
+
+    return stats
+
+def _getCachedQuery(key):
+    """
+    Look up a question vector and mark it as recently used. Expired entries are removed.
+    """
+
+    with _query_cache_lock:
+        entry = _query_cache.pop(key, None)
+        if (entry is not None):
+            if (QUERY_CACHE_TTL is None or time.time() - entry["added"] < QUERY_CACHE_TTL):
+                _query_cache[key] = entry
+                _query_cache_stats["hits"] += 1
+                return entry["vector"]
+        _query_cache_stats["misses"] += 1
+        return None
+
+def _putCachedQuery(key, vector):
+    """
+    Add a question vector to the cache, removing the least recently used entries when the cache
+    is full.
+    """
+
+    with _query_cache_lock:
+        _query_cache.pop(key, None)
+        _query_cache[key] = {"vector": vector, "added": time.time()}
+        while (len(_query_cache) > QUERY_CACHE_SIZE):
+            del _query_cache[next(iter(_query_cache))]
+
+def embedPassages(passages, model_name=EMBEDDING_MODEL, workers=None, cache=None):
+    """
+    Convert a list of document chunks into an array of vectors. Every chunk vector is kept in a
+    persistent cache keyed by the model name and a hash of the chunk text, so re-vectorizing a
+    document that has not changed (or storing it under a different collection name) only runs
+    the model for chunks that have not been seen before. When workers is greater than one, large
+    jobs are split across that many worker processes. A load that embeds many batches passes the
+    chunk cache it opened (see openChunkCache); otherwise the cache is opened for this call only.
+    None is returned if the encoding fails.
+    """
+
+    import hashlib
+    import numpy as np
+
+    program = "embedPassages"
+
+    opened = cache is None
+    if opened:
+        cache = openChunkCache()
+
+    try:
+        hashes = [hashlib.sha256(passage.encode('utf-8')).hexdigest() for passage in passages]
+
+        vectors = _readChunkCache(cache, model_name, hashes)
+
+        missing = {}
+        for passage_hash, passage in zip(hashes, passages):
+            if (passage_hash not in vectors and passage_hash not in missing):
+                missing[passage_hash] = passage
+
+        if (workers in [None,0]):
+            workers = EMBEDDING_WORKERS
+
+        if (len(missing) > 0):
+            encoded = None
+            if (workers > 1 and len(missing) >= POOL_MIN_PASSAGES):
+                encoded = _encodeParallel(list(missing.values()), model_name, workers)
+            if (encoded is None):
+                encoded = encodeTexts(list(missing.values()), model_name)
+            if (encoded is None):
+                log(program,"[1] Unable to vectorize the passages")
+                return None
+            new_vectors = dict(zip(missing.keys(), np.asarray(encoded, dtype=np.float32)))
+            _writeChunkCache(cache, model_name, new_vectors)
+            vectors.update(new_vectors)
+    finally:
+        if opened:
+            closeChunkCache(cache, model_name)
+
+    log(program,f"Passages={len(passages)} cached={len(passages)-len(missing)} encoded={len(missing)}")
+
+    if (len(passages) == 0):
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    return np.vstack([vectors[passage_hash] for passage_hash in hashes])
+
+def releaseEmbeddingPool():
+    """
+    Shut down the worker processes used by embedPassages. They are restarted the next time a
+    large document is vectorized.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        pool = _pool
+        _pool = None
+
+    if (pool is not None):
+        pool["executor"].shutdown(wait=False, cancel_futures=True)
+        log("releaseEmbeddingPool",f"Released {pool['workers']} embedding workers")
+
+def _encodeParallel(texts, model_name, workers):
+    """
+    Encode the texts in shards across a pool of worker processes. The texts are divided evenly
+    between the workers, in shards of at most POOL_SHARD_SIZE, so every worker has work even
+    for a single insert batch. The shards are returned in their original order. None is returned
+    if the pool fails, in which case the caller encodes the texts in this process.
+    """
+
+    import math
+    import numpy as np
+
+    program = "encodeParallel"
+
+    try:
+        executor = _getPool(model_name, workers)
+        shard_size = max(1, min(POOL_SHARD_SIZE, math.ceil(len(texts) / workers)))
+        shards = [texts[pos:pos+shard_size] for pos in range(0, len(texts), shard_size)]
+        start = time.time()
+        vectors = np.vstack(list(executor.map(_encodeShard, shards)))
+        log(program,f"Encoded {len(texts)} passages with {workers} workers in {time.time()-start:.2f}s")
+        return vectors
+    except Exception as e:
+        log(program,f"[1] Embedding workers failed, encoding in process")
+        log(program,f"[1] {repr(e)}")
+        releaseEmbeddingPool()
+        return None
+
+def _getPool(model_name, workers):
+    """
+    Return the worker pool for a model, replacing the current pool if it was started for a
+    different model or number of workers. The CPU threads are divided evenly between the workers
+    so that they do not compete with each other.
+    """
+
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    global _pool
+
+    with _pool_lock:
+        if (_pool is not None and (_pool["model"] != model_name or _pool["workers"] != workers)):
+            _pool["executor"].shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+        if (_pool is None):
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=get_context("spawn"),
+                                           initializer=_initializeWorker,
+                                           initargs=(model_name, threads))
+            _pool = {"executor": executor, "model": model_name, "workers": workers, "last_used": time.time()}
+            log("getPool",f"Started {workers} embedding workers with {threads} threads each")
+
+        _pool["last_used"] = time.time()
+        executor = _pool["executor"]
+
+    _startReaper()
+
+    return executor
+
+def _initializeWorker(model_name, threads):
+    """
+    Runs once in each worker process: limit the CPU threads and load the model.
+    """
+
+    import os
+
+    global _pool_model
+
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+
+    base_name, backend = _splitModel(model_name)
+    options = dict(EMBEDDING_BACKENDS[backend])
+    if (options.get("backend") == "onnx"):
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        options["model_kwargs"] = dict(options.get("model_kwargs", {}), session_options=session_options)
+
+    _pool_model = SentenceTransformer(base_name, **options)
+
+def _encodeShard(texts):
+    """
+    Runs in a worker process: encode one shard of texts.
+    """
+
+    import numpy as np
+
+    return np.asarray(_pool_model.encode(texts), dtype=np.float32)
+
+def openChunkCache():
+    """
+    Open the chunk cache database, creating it if required. A load opens the cache once, passes
+    it to embedPassages for every batch, and closes it with closeChunkCache when it is done. None
+    is returned if the cache is not available, in which case every chunk is encoded.
+    """
+
+    import os, sqlite3
+
+    program = "openChunkCache"
+
+    try:
+        os.makedirs(os.path.dirname(CHUNK_CACHE), exist_ok=True)
+        cache = sqlite3.connect(CHUNK_CACHE, timeout=30)
+        cache.execute("PRAGMA journal_mode=WAL")
+        cache.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, vector BLOB, used REAL DEFAULT 0, PRIMARY KEY (model, hash))")
+        columns = [row[1] for row in cache.execute("PRAGMA table_info(embeddings)")]
+        if ("used" not in columns):
+            cache.execute("ALTER TABLE embeddings ADD COLUMN used REAL DEFAULT 0")
+        cache.execute("CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)")
+        return cache
+    except Exception as e:
+        log(program,f"[1] Chunk cache {CHUNK_CACHE} is not available")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+def closeChunkCache(cache, model_name=None):
+    """
+    Prune the chunk cache (see pruneChunkCache) and close it at the end of a load. The model that
+    was used is kept even if it is not one of the configured models.
+    """
+
+    if (cache is None):
+        return
+
+    try:
+        pruneChunkCache(keep=None if model_name is None else [model_name], cache=cache)
+    finally:
+        cache.close()
+
+def _readChunkCache(cache, model_name, hashes):
+    """
+    Return a dictionary of the cached vectors (keyed by hash) for the hashes that were found.
+    """
+
+    import numpy as np
+
+    program = "readChunkCache"
+
+    vectors = {}
+    if (cache is None):
+        return vectors
+
+    unique = list(set(hashes))
+    try:
+        for pos in range(0, len(unique), CHUNK_CACHE_BATCH):
+            keys = unique[pos:pos+CHUNK_CACHE_BATCH]
+            markers = ",".join(["?"] * len(keys))
+            rows = cache.execute(f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({markers})", [model_name] + keys)
+            for passage_hash, vector in rows:
+                vectors[passage_hash] = np.frombuffer(vector, dtype=np.float32)
+        if (len(vectors) > 0):
+            with cache:
+                now = time.time()
+                cache.executemany("UPDATE embeddings SET used = ? WHERE model = ? AND hash = ?",
+                                  [(now, model_name, passage_hash) for passage_hash in vectors])
+    except Exception as e:
+        log(program,f"[1] {repr(e)}")
+
+    return vectors
+
+def _writeChunkCache(cache, model_name, vectors):
+    """
+    Save a dictionary of vectors (keyed by hash) into the chunk cache.
+    """
+
+    program = "writeChunkCache"
+
+    if (cache is None):
+        return
+
+    try:
+        with cache:
+            now = time.time()
+            cache.executemany("INSERT OR REPLACE INTO embeddings (model, hash, vector, used) VALUES (?, ?, ?, ?)",
+                              [(model_name, passage_hash, vector.tobytes(), now) for passage_hash, vector in vectors.items()])
+    except Exception as e:
+        log(program,f"[1] {repr(e)}")
+
+def pruneChunkCache(max_rows=CHUNK_CACHE_ROWS, keep=None, cache=None):
+    """
+    Keep the chunk cache within max_rows vectors by removing the least recently used ones. The
+    first call in a process also removes the vectors of any model that is no longer one of the
+    configured embedding models (EMBEDDING_MODEL with each of the EMBEDDING_BACKENDS), since those
+    vectors can never be read again. Models in the keep list are retained as well. An open cache
+    may be supplied. The number of vectors removed is returned.
+    """
+
+    global _chunk_cache_pruned
+
+    program = "pruneChunkCache"
+
+    opened = cache is None
+    if opened:
+        cache = openChunkCache()
+    if (cache is None):
+        return 0
+
+    removed = 0
+    try:
+        with cache:
+            if (_chunk_cache_pruned == False):
+                models = [embeddingModel(backend) for backend in EMBEDDING_BACKENDS] + (keep or [])
+                markers = ",".join(["?"] * len(models))
+                removed += cache.execute(f"DELETE FROM embeddings WHERE model NOT IN ({markers})", models).rowcount
+                _chunk_cache_pruned = True
+            rows = cache.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if (rows > max_rows):
+                removed += cache.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY used LIMIT ?)",
+                                         [rows - max_rows]).rowcount
+    except Exception as e:
+        log(program,f"[1] {repr(e)}")
+    finally:
+        if opened:
+            cache.close()
+
+    if (removed > 0):
+        log(program,f"Removed {removed} vectors from the chunk cache")
+
+    return removed
+
+def dropChunkCache(model_name):
+    """
+    Remove every vector stored for a model from the chunk cache. Call this when a model is removed
+    so that its vectors do not take up space. The number of vectors removed is returned.
+    """
+
+    program = "dropChunkCache"
+
+    cache = openChunkCache()
+    if (cache is None):
+        return 0
+
+    removed = 0
+    try:
+        with cache:
+            removed = cache.execute("DELETE FROM embeddings WHERE model = ?", [model_name]).rowcount
+    except Exception as e:
+        log(program,f"[1] {repr(e)}")
+    finally:
+        cache.close()
+
+    log(program,f"Removed {removed} vectors for {model_name}")
+
+    return removed
+
+def embeddingModel(backend=None, model_name=EMBEDDING_MODEL):
+    """
+    Return the model name that selects the given backend (torch, onnx, or onnx-int8). The PyTorch
+    backend uses the plain model name so existing cache entries remain valid.
+    """
+
+    if (backend in [None,"","torch"]):
+        return model_name
+    return f"{model_name}#{backend}"
+
+def _splitModel(model_name):
+    """
+    Split a model name into the base model and the backend.
+    """
+
+    base_name, _, backend = model_name.partition("#")
+    if (backend == ""):
+        backend = "torch"
+    return base_name, backend
+
+def sparseTerms(text):
+    """
+    Split text into lowercase words and map each word to a sparse vector dimension. The mapping
+    is a CRC32 hash of the word, so it is the same in every process and no vocabulary is stored.
+    """
+
+    import re, zlib
+
+    return [zlib.crc32(term.encode("utf-8")) for term in re.findall(r"\w+", text.lower())]
+
+def sparsePassages(passages, term_stats):
+    """
+    Convert a list of chunks into BM25 sparse vectors ({dimension: weight}). The chunk side of
+    BM25 (term frequency saturation and length normalization) is stored in the vector, and the
+    document frequencies in term_stats are updated so that sparseQuery can weight the question
+    terms by their inverse document frequency. The term_stats dictionary has the number of chunks
+    ("chunks"), the number of words ("words"), and the number of chunks containing each term ("df").
+    """
+
+    from collections import Counter
+
+    term_stats.setdefault("chunks", 0)
+    term_stats.setdefault("words", 0)
+    term_stats.setdefault("df", {})
+
+    counts = [Counter(sparseTerms(passage)) for passage in passages]
+    for terms in counts:
+        term_stats["chunks"] += 1
+        term_stats["words"] += sum(terms.values())
+        for term in terms:
+            key = str(term)
+            term_stats["df"][key] = term_stats["df"].get(key, 0) + 1
+
+    average = term_stats["words"] / max(term_stats["chunks"], 1)
+
+    vectors = []
+    for terms in counts:
+        length = sum(terms.values())
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / max(average, 1))
+        vector = {term: tf * (BM25_K1 + 1) / (tf + norm) for term, tf in terms.items()}
+        vectors.append(vector if len(vector) > 0 else {0: 1e-6})        # Milvus does not accept empty sparse vectors
+
+    return vectors
+
+def sparseQuery(query, term_stats):
+    """
+    Convert a question into a sparse vector whose weights are the BM25 inverse document
+    frequencies of its words. The inner product with a chunk from sparsePassages is the BM25
+    score of the chunk.
+    """
+
+    import math
+
+    chunks = term_stats.get("chunks", 0)
+    df = term_stats.get("df", {})
+
+    vector = {}
+    for term in set(sparseTerms(query)):
+        n = df.get(str(term), 0)
+        vector[term] = math.log(1 + (chunks - n + 0.5) / (n + 0.5))
+
+    return vector if len(vector) > 0 else {0: 1e-6}
@@ -10,19 +10,165 @@
 #   Milvus routines
 #
 #   connectMilvis   - Connect to the Milvus system
+#   localBackend    - Return True if collections are kept in the local backend instead of Milvus
 #   dropCollections - Drop all collections in Milvus
 #   listCollections - Return a list of collection names
+#   collectionNames - Return the names of the collections (aliases of versioned collections)
+#   dropCollection  - Drop a collection, its versions, and its settings
+#   dropVersion     - Drop a version of a collection that was never switched to
+#   swapAlias       - Point a collection name at a newly built version
+#   aliasesSupported - Return True if the Milvus server implements collection aliases
+#   resolveCollection - Return the version that a collection name currently points to
+#   collectVersions - Drop the old versions of a collection in the background
 #   storeVectors    - Store document vectors into Milvus
+#   appendVectors   - Add new documents to an existing collection
+#   deleteDocumentVectors - Remove the chunks of documents from the collections that contain them
 #   query_milvus    - Given a string, retrieve the vectors from Milvus that best match
+#   query_milvus_batch - Given a list of strings, retrieve the best matches for each in one search
+#   searchVectors   - Search a collection with one or more query vectors
+#   hybridSearch    - Search the dense and BM25 sparse vectors of a collection and fuse the results
+#   query_collections - Search several collections in parallel and merge the results
+#   refineResults   - Apply the diversity and re-rank stages to search results
+#   rerankResults   - Re-order search results with a cross-encoder and keep the best
+#   diversifyResults - Choose diverse chunks from search results with maximal marginal relevance
+#   mmrSelect       - Maximal marginal relevance selection of vectors
+#   expandResults   - Replace small chunks with a window of their neighbouring chunks
+#   vectorType      - Return the type of vector a collection stores (its storage mode)
+#   storageVectors  - Convert embedding vectors into the form stored in a collection
+#   floatVector     - Return a vector read from Milvus as a float32 array
+#   getMirror       - Return the local copy of a small collection used for exact searches
+#   searchMirror    - Exact search of the local copy of a small collection
+#   collectionToken - Return a token that changes whenever the contents of a collection change
+#   rerankBinary    - Re-rank binary search candidates with the full precision vectors
+#   stitchChunks    - Join neighbouring chunks into one passage, removing the overlap
+#   collectionDocuments - Return the IDs of the documents stored in a collection
+#   getLoadedCollection - Return a loaded collection, releasing others to stay within the memory budget
+#   withLoadedCollection - Run an action on a loaded collection, loading it again if Milvus released it
+#   forgetCollection - Remove a collection from the loaded collection cache
 #   createPrompt    - Create a prompt string based on search results
 #   loadvectors     - Given a list of document IDs, load the documents in as vectors into Milvus
+#   chunkSize       - Convert a vector size (Small, Medium, Large) into a chunk size
+#   readDocuments   - Generator returning the text of each document
+#   chunkDocuments  - Generator splitting documents into chunks
+#   insertBatchSize - Return the number of chunks inserted at a time for a number of workers
+#   batchChunks     - Generator grouping chunks into batches
+#   insertChunks    - Vectorize and insert chunks into a collection in batches
+#   indexProfile    - Return the index build and search parameters for an index profile
+#   searchParams    - Return the search parameters for a collection's index profile
+#   toDistance      - Convert a Milvus score into an L2 style distance
+#   getCollectionInfo  - Return the settings a collection was built with
+#   saveCollectionInfo - Save the settings a collection was built with
+#   dropCollectionInfo - Remove the settings of a dropped collection
+#   getTermStats    - Return the BM25 term statistics of a collection
+#   saveTermStats   - Save the BM25 term statistics of a collection
+#   fitProjection   - Learn the PCA projection of a collection from a sample of its vectors
+#   projectVectors  - Reduce vectors to the dimension of a collection's projection
+#   getProjection   - Return the projection a collection was built with
+#   saveProjection  - Save the projection of a collection
+#   createCollection   - Create an empty collection with the document schema
+#   autoIndexParams - Choose the index build parameters from the number of chunks
+#   buildIndex      - Build the vector index of a collection and load it
+#   tuneQueries     - Form tuning questions by moving sample chunks a small random distance
+#   exactNeighbours - Find the exact nearest chunks of the tuning questions by reading every vector
+#   tuneSearchParams   - Measure recall and latency to choose the search parameters
+#   chooseSearchParams - Pick the fastest measured search parameters that meet a recall target
+#   storeLocalCollection - Store document vectors in the local backend
+#   getLocalMirror  - Return a collection of the local backend ready to be searched
+#   deleteLocalDocuments - Remove the chunks of documents from a local backend collection
+#   searchCollection   - Search a collection of either backend
+#   expandCollection   - Expand search results with neighbouring chunks in either backend
+#
+#   Two vector backends are available. The default (milvus) is the watsonx.data Milvus service,
+#   or the Milvus server or Milvus Lite file named by the WXD_MILVUS_URI environment variable. The
+#   local backend keeps the collections in NumPy files (see wxd_vectorstore) and searches them
+#   exactly in process, so the application and its benchmarks run without Milvus. The backend is
+#   chosen with the WXD_VECTOR_BACKEND environment variable, or by setting VECTOR_BACKEND.
 #
 
+import os
+import time
+import threading
 import warnings
+from collections import OrderedDict
 import streamlit as st
 from streamlit import session_state as sts
 from wxd_utilities import log
 
+CHUNK_OVERLAP     = 32
+VECTOR_BACKENDS   = ["milvus","local"]
+VECTOR_BACKEND    = os.environ.get("WXD_VECTOR_BACKEND", "milvus")
+MILVUS_URI        = os.environ.get("WXD_MILVUS_URI")    # Milvus server or Milvus Lite file used instead of watsonx.data
+INSERT_BATCH_SIZE = 512                 # Chunks vectorized and inserted into Milvus at a time
+COLLECTION_INFO   = "/home/watsonx/cache/collections"      # Settings saved with each collection
+INDEX_PROFILE     = "IVF_FLAT"
+STORAGE_MODE      = "FLOAT32"
+BINARY_RERANK     = 10                  # Candidates found by Hamming distance per result of a BINARY collection
+RECALL_TARGET     = 0.95                # Recall that the search parameters are tuned for
+TUNE_SAMPLES      = 64                  # Chunks used as sample questions when tuning
+TUNE_LIMIT        = 9                   # Results per sample question (the largest RAG sentence setting)
+TUNE_NOISE        = 0.1                 # Sample chunks are moved by this fraction of their length to form the questions
+TUNE_RUNS         = 5                   # Timed searches per setting; the median latency is used
+TUNE_EXACT_LIMIT  = 200000              # Larger collections are tuned against the most exhaustive search instead of exact results
+DOCUMENT_PARTITIONS = 64                # Partitions that the chunks are spread across by doc_id
+FUSION_METHODS    = ["rrf", "weighted"] # How dense and BM25 results are combined in a hybrid collection
+RRF_K             = 60                  # Reciprocal rank fusion constant
+HYBRID_WEIGHTS    = [0.7, 0.3]          # Dense and BM25 weights for weighted fusion
+HYBRID_CANDIDATES = 4                   # Each search in a hybrid search returns this many times the results
+CANDIDATE_FETCH   = 5                   # Candidates fetched per result when re-ranking or diversifying
+VERSION_DELAY     = 60                  # Seconds an old version is kept after a rebuild so running searches can finish
+CONTEXT_WINDOW    = 2                   # Neighbouring chunks on each side added to a Small-to-Big result
+MMR_LAMBDA        = 0.7                 # 1.0 ranks by relevance only, 0.0 by diversity only
+EXACT_SEARCH_LIMIT = 5000               # Collections with up to this many chunks are searched in process (0 = never)
+PROJECTIONS       = ["pca","truncate"]  # Ways of reducing the dimension of the vectors stored in Milvus
+PROJECTION_DIM    = 128
+SEARCH_WORKERS    = 8                   # Collections searched at the same time by query_collections
+LOADED_MEMORY_MB  = 4096                # Milvus memory that loaded collections may use before the least recently queried are released
+
+#
+# Collections that this process has loaded, in least recently queried order. Each entry is the
+# collection handle and the approximate memory that it uses in Milvus.
+#
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+_term_stats = {}                        # BM25 term statistics by collection (file time, statistics)
+_projections = {}                       # PCA projections by collection (file time, projection)
+_mirrors = {}                           # Local copies of small collections by collection name
+_mirrors_lock = threading.Lock()
+_aliases = None                         # Whether the Milvus server implements aliases (checked once)
+
+#
+# Index profiles. Each profile has the parameters used to build the index and the parameters
+# used when searching it. A profile is saved with the collection so that searches automatically
+# use the parameters that match the index.
+#
+
+INDEX_PROFILES = {
+    "FLAT"     : {"index_type": "FLAT",     "metric_type": "L2", "params": {},                                    "search_params": {}},
+    "IVF_FLAT" : {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 2048},                      "search_params": {"nprobe": 5}},
+    "IVF_SQ8"  : {"index_type": "IVF_SQ8",  "metric_type": "L2", "params": {"nlist": 1024},                      "search_params": {"nprobe": 16}},
+    "IVF_PQ"   : {"index_type": "IVF_PQ",   "metric_type": "L2", "params": {"nlist": 1024, "m": 48, "nbits": 8}, "search_params": {"nprobe": 16}},
+    "HNSW"     : {"index_type": "HNSW",     "metric_type": "L2", "params": {"M": 16, "efConstruction": 200},    "search_params": {"ef": 64}},
+    "DISKANN"  : {"index_type": "DISKANN",  "metric_type": "L2", "params": {},                                    "search_params": {"search_list": 100}},
+    "BIN_IVF_FLAT" : {"index_type": "BIN_IVF_FLAT", "metric_type": "HAMMING", "params": {"nlist": 1024},      "search_params": {"nprobe": 16}},
+}
+
+#
+# Storage modes. The vectors can be stored in Milvus at full precision (FLOAT32), at half precision
+# (FLOAT16), quantized to one byte per dimension by an IVF_SQ8 index (SQ8), or as one sign bit per
+# dimension (BINARY). A BINARY collection is searched by Hamming distance for BINARY_RERANK times
+# the results needed, and the candidates are re-ranked with the full precision vectors that are
+# kept on local disk (wxd_vectorstore). The bytes are the memory used per dimension in Milvus.
+#
+
+STORAGE_MODES = {
+    "FLOAT32" : {"dtype": "FLOAT_VECTOR",   "index": None,           "bytes": 4},
+    "FLOAT16" : {"dtype": "FLOAT16_VECTOR", "index": None,           "bytes": 2},
+    "SQ8"     : {"dtype": "FLOAT_VECTOR",   "index": "IVF_SQ8",      "bytes": 1},
+    "BINARY"  : {"dtype": "BINARY_VECTOR",  "index": "BIN_IVF_FLAT", "bytes": 0.125},
+}
+
 def connectMilvus():
     """
     Connect to the local Milvus service using the ORM service. 
@@ -33,6 +179,18 @@ def connectMilvus():
 
     program = "connectMilvus"
 
+    if localBackend():
+        return True
+
+    if (MILVUS_URI is not None):
+        try:
+            connections.connect(alias='default', uri=MILVUS_URI)
+            return True
+        except Exception as e:
+            log(program,f"[1] Unable to connect to {MILVUS_URI}")
+            log(program,f"[1] {repr(e)}")
+            return False
+
     if ("milvusConnection" in sts):
         connection = sts.milvusConnection
         if (connection is not None):
@@ -65,12 +223,20 @@ def connectMilvus():
 
     return connection
 
+def localBackend():
+    """
+    Return True if the collections are kept in the local backend instead of Milvus.
+    """
+
+    return (VECTOR_BACKEND == "local")
+
 def dropCollections(deleteOnly=None):
     """
     Remove all of the collections that are currently in the Milvus database.
     """
 
     from pymilvus import utility
+    from wxd_vectorstore import dropLocalVectors
 
     program = "dropCollections"
 
@@ -78,23 +244,247 @@ def dropCollections(deleteOnly=None):
         log(program,"[1] Unable to drop collections")
         return False
     
-    collections = listCollections()
+    collections = collectionNames()
 
     for collection in collections:
         if (deleteOnly is not None):
             if (collection in deleteOnly):
-                try:
-                    utility.drop_collection(collection)
-                except:
-                    pass
+                dropCollection(collection)
         else:
+            dropCollection(collection)
+
+    if (deleteOnly is None and not localBackend()):
+        # Versions that were never switched to (a failed rebuild) have no name to drop them by
+        for collection in utility.list_collections():
             try:
                 utility.drop_collection(collection)
+                dropLocalVectors(collection)
+                dropCollectionInfo(collection)
             except:
                 pass
             
     return True
 
+def collectionNames():
+    """
+    Return the names of the collections that can be queried. A collection built by storeVectors
+    is a versioned collection (name_v<timestamp>) that is queried through an alias with the
+    collection name, so the alias is returned instead of the version. Versions without an alias
+    (being built, or waiting to be dropped) are not returned.
+    """
+
+    from pymilvus import utility
+    from wxd_vectorstore import listLocalCollections
+
+    if localBackend():
+        return listLocalCollections()
+
+    aliases_supported = aliasesSupported()
+    names = []
+    for collection in utility.list_collections():
+        aliases = utility.list_aliases(collection) if aliases_supported else []
+        if (len(aliases) > 0):
+            names.extend(aliases)
+        elif (isVersion(collection) == False):
+            names.append(collection)
+
+    return sorted(names)
+
+def versionName(collection_name):
+    """
+    Return the name of a new version of a collection.
+    """
+
+    return f"{collection_name}_v{int(time.time() * 1000)}"
+
+def isVersion(name, collection_name=None):
+    """
+    Return True if the name is a version of the collection (or of any collection if no
+    collection_name is supplied).
+    """
+
+    import re
+
+    prefix = re.escape(collection_name) if collection_name is not None else ".+"
+    return re.fullmatch(prefix + r"_v\d{13}", name) is not None
+
+def collectionVersions(collection_name):
+    """
+    Return the versions of a collection in Milvus, oldest first.
+    """
+
+    from pymilvus import utility
+
+    return sorted([name for name in utility.list_collections() if isVersion(name, collection_name)])
+
+def dropCollection(collection_name):
+    """
+    Drop a collection: its alias, all of its versions, and the settings saved with it. Errors are
+    logged and ignored so that as much as possible is removed.
+    """
+
+    from pymilvus import utility
+    from wxd_vectorstore import dropLocalVectors, dropLocalCollection
+
+    program = "dropCollection"
+
+    if localBackend():
+        dropLocalCollection(collection_name)
+        with _mirrors_lock:
+            _mirrors.pop(f"local:{collection_name}", None)
+        return
+
+    forgetCollection(collection_name, release=False)
+
+    try:
+        utility.drop_alias(collection_name)
+    except Exception:
+        pass
+
+    try:
+        names = collectionVersions(collection_name)
+        if (collection_name in utility.list_collections()):
+            names.append(collection_name)
+        for name in names:
+            utility.drop_collection(name)
+            dropLocalVectors(name)
+            dropCollectionInfo(name)
+    except Exception as e:
+        log(program,f"[1] Unable to drop {collection_name}")
+        log(program,f"[1] {repr(e)}")
+
+    dropCollectionInfo(collection_name)
+
+def dropVersion(version):
+    """
+    Drop a version of a collection that was never switched to (a rebuild that failed), along with
+    its local vectors and settings. Errors are logged and ignored.
+    """
+
+    from pymilvus import utility
+    from wxd_vectorstore import dropLocalVectors
+
+    program = "dropVersion"
+
+    try:
+        if (version in utility.list_collections()):
+            utility.drop_collection(version)
+            log(program,f"Dropped unfinished version {version}")
+    except Exception as e:
+        log(program,f"[1] Unable to drop {version}")
+        log(program,f"[1] {repr(e)}")
+
+    dropLocalVectors(version)
+    dropCollectionInfo(version)
+
+def swapAlias(collection_name, version):
+    """
+    Point the collection name at a new version in one step, so searches move from the old version
+    to the new one without a period where the collection is missing or empty. A collection built
+    by an earlier release that has the collection name itself is dropped first (once). False is
+    returned if the alias could not be set.
+    """
+
+    from pymilvus import utility
+
+    program = "swapAlias"
+
+    try:
+        if (collection_name in utility.list_collections()):
+            log(program,f"Replacing {collection_name} from an earlier release with an alias")
+            forgetCollection(collection_name, release=False)
+            utility.drop_collection(collection_name)
+        try:
+            utility.alter_alias(version, collection_name)
+        except Exception:
+            utility.create_alias(version, collection_name)
+    except Exception as e:
+        log(program,f"[1] Unable to point {collection_name} at {version}")
+        log(program,f"[1] {repr(e)}")
+        return False
+
+    log(program,f"{collection_name} now uses {version}")
+    return True
+
+def aliasesSupported():
+    """
+    Return True if the Milvus server implements collection aliases. Milvus Lite 2.5 rejects the
+    alias calls as unimplemented, in which case a rebuild drops the collection and creates it again
+    under its own name instead of switching an alias. The answer is checked once per process.
+    """
+
+    global _aliases
+
+    from pymilvus import utility
+
+    program = "aliasesSupported"
+
+    if (_aliases is None):
+        try:
+            utility.list_aliases(versionName("alias_check"))
+            _aliases = True
+        except Exception as e:
+            error = repr(e).upper()
+            _aliases = not ("UNIMPLEMENTED" in error or "NOT IMPLEMENTED" in error or "NOT SUPPORT" in error)
+        if (_aliases == False):
+            log(program,"Milvus does not support aliases - collections are rebuilt in place")
+
+    return _aliases
+
+def resolveCollection(collection_name):
+    """
+    Return the name of the Milvus collection that a collection name refers to: the version that
+    its alias points to, or the name itself for a collection without versions. The version saved
+    in the collection settings is tried first, and the versions are searched when the alias no
+    longer points to it (the settings are missing or were written by another process).
+    """
+
+    from pymilvus import utility
+
+    if (aliasesSupported() == False):
+        return collection_name
+
+    names = utility.list_collections()
+    if (collection_name in names):
+        return collection_name
+
+    cached = getCollectionInfo(collection_name).get("version")
+    if (cached in names and collection_name in utility.list_aliases(cached)):
+        return cached
+
+    for version in sorted([name for name in names if isVersion(name, collection_name)], reverse=True):
+        if (collection_name in utility.list_aliases(version)):
+            return version
+
+    return collection_name
+
+def collectVersions(collection_name, keep, delay=VERSION_DELAY):
+    """
+    Drop the versions of a collection that are older than the version being kept. The drop runs
+    on a background thread after a delay, so that searches that started on an old version can
+    finish. Versions newer than the kept version (a rebuild that started since) are left alone.
+    """
+
+    from pymilvus import utility
+    from wxd_vectorstore import dropLocalVectors
+
+    program = "collectVersions"
+
+    def collect():
+        time.sleep(delay)
+        try:
+            for version in collectionVersions(collection_name):
+                if (version < keep):
+                    utility.drop_collection(version)
+                    dropLocalVectors(version)
+                    dropCollectionInfo(version)
+                    log(program,f"Dropped old version {version}")
+        except Exception as e:
+            log(program,f"[1] Unable to drop the old versions of {collection_name}")
+            log(program,f"[1] {repr(e)}")
+
+    threading.Thread(target=collect, name="collectVersions", daemon=True).start()
+
 @st.fragment
 def listCollections(_checkbox=False):
     """
@@ -112,7 +502,7 @@ def listCollections(_checkbox=False):
         log(program,"[1] Unable to list collections")
         return None
     
-    collection_list = utility.list_collections()
+    collection_list = collectionNames()
 
     if _checkbox:
         false_list = [False] * len(collection_list)
@@ -120,202 +510,2185 @@ def listCollections(_checkbox=False):
 
     return collection_list
 
-def storeVectors(_connection, collection_name, ids, vectorsize):
+def storeVectors(_connection, collection_name, ids, vectorsize, backend=None, workers=None, progress=None, index_profile=None, recall_target=None, mode="replace", fusion=None, context_window=None, storage=None, projection=None, dimension=None, documents=None):
     """
-    Given a text document, split the text into chunks and then load them into
-    Milvus. After the load is completed, return the collection that can be
-    used for queries.
+    Given a list of document IDs, split the text of each document into chunks and then load them
+    into Milvus. After the load is completed, return the collection that can be used for queries,
+    or None if there was an error. A rebuild is loaded into a new version of the collection while
+    the current one is still searched (see swapAlias and collectVersions).
+
+    backend, workers, progress - how the chunks are vectorized and reported (see insertChunks)
+    index_profile, recall_target - the index and its tuning (see indexProfile, tuneSearchParams)
+    mode       - "replace" or "append" (see appendVectors)
+    fusion     - one of the FUSION_METHODS to add BM25 keyword search (see hybridSearch)
+    context_window - neighbouring chunks added to a search result (see contextWindow)
+    storage, projection, dimension - how the vectors are kept (see STORAGE_MODES, projectVectors)
+    documents  - (id, text) pairs to use instead of reading the documents from watsonx.data
+
+    The local backend only uses the vectorsize, backend, workers, progress, and mode settings
+    (see storeLocalCollection).
     """
 
-    from wxd_data import getDocument
-    from pymilvus import utility, FieldSchema, CollectionSchema, Collection, DataType
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
-    from sentence_transformers import SentenceTransformer
+    from wxd_embeddings import embeddingModel, EMBEDDING_DIM
   
     program = "loadVectors"
 
+    if localBackend():
+        unsupported = {"fusion": fusion, "projection": projection, "storage": None if storage == "FLOAT32" else storage}
+        unsupported = [f"{setting}={value}" for setting, value in unsupported.items() if value is not None]
+        if (len(unsupported) > 0):
+            log(program,f"[10] The local backend does not support {', '.join(unsupported)}")
+            return None
+        ignored = {"index_profile": index_profile, "recall_target": recall_target, "context_window": context_window}
+        ignored = [f"{setting}={value}" for setting, value in ignored.items() if value is not None]
+        if (len(ignored) > 0):
+            log(program,f"The local backend searches exactly and ignores {', '.join(ignored)}")
+        return storeLocalCollection(_connection, collection_name, ids, vectorsize, backend, workers, progress, mode, documents)
+
     if (connectMilvus() == False):
         log(program,"[1] Unable to list collections")
         return None
 
-    document = None
-    for id in ids:
-        if (document == None):
-            document = getDocument(_connection, id)
-        else: 
-            nextdoc  = getDocument(_connection, id)
-            document = f"{document}\n{nextdoc}"
-
-    if (document in [None,""]):
-        log(program,"[2] Error extracting the document")
-        return None
- 
-    title = "Document"
+    if (mode == "append" and collection_name in collectionNames()):
+        return appendVectors(_connection, collection_name, ids, workers, progress, documents)
 
-    log(program,f"Loading document with length={len(document)}")
+    log(program,f"Loading {len(ids)} document(s) into {collection_name}")
     
     warnings.filterwarnings('ignore')
     
-    if (vectorsize == "Small"):
-        chunk_size = 512
-    elif (vectorsize == "Medium"):
-        chunk_size = 1024
-    elif (vectorsize == "Large"):
-        chunk_size = 2048
-    else:
-        chunk_size = 512
-        
-    chunk_overlap = 32
-    try:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap) 
-        docs = text_splitter.create_documents([document])
-    except Exception as e:
-        log(program,f"[3] Error in Text Splitter")
-        log(program,f"[3] {repr(e)}")
+    chunk_size = chunkSize(vectorsize)
+
+    profile = indexProfile(index_profile)
+    if (profile is None):
+        log(program,f"[3] Invalid index profile {index_profile}")
         return None
+
+    if (fusion is not None and fusion not in FUSION_METHODS):
+        log(program,f"[3] Invalid fusion method {fusion}")
+        return None
+
+    if (storage in [None,""]):
+        storage = STORAGE_MODE
+    if (storage not in STORAGE_MODES):
+        log(program,f"[3] Invalid storage mode {storage}")
+        return None
+    if (STORAGE_MODES[storage]["index"] is not None and profile["index_type"] != STORAGE_MODES[storage]["index"]):
+        log(program,f"{storage} storage uses the {STORAGE_MODES[storage]['index']} index instead of {profile['index_type']}")
+        profile = indexProfile(STORAGE_MODES[storage]["index"])
+    elif (profile["index_type"].startswith("BIN_") and storage != "BINARY"):
+        log(program,f"[3] Index {profile['index_type']} needs BINARY storage")
+        return None
+    if (storage == "BINARY" and fusion is not None):
+        log(program,f"[3] Keyword search is not available with BINARY storage")
+        return None
+
+    dim = EMBEDDING_DIM
+    if (projection is not None):
+        if (projection not in PROJECTIONS):
+            log(program,f"[3] Invalid projection {projection}")
+            return None
+        dim = int(dimension or PROJECTION_DIM)
+        if (dim < 1 or dim > EMBEDDING_DIM or (storage == "BINARY" and dim % 8 != 0)):
+            log(program,f"[3] Invalid projection dimension {dim}")
+            return None
+        projection = {"method": projection, "dim": dim}
+
+    if (profile["index_type"] == "IVF_PQ" and isinstance(index_profile, dict) and "params" in index_profile
+            and dim % profile["params"].get("m", 48) != 0):
+        log(program,f"[3] IVF_PQ m={profile['params'].get('m', 48)} does not divide the vector dimension {dim}")
+        return None
+
+    # Without aliases the collection is dropped and built again under its own name, so it cannot
+    # be searched until the load is complete
+    in_place = (aliasesSupported() == False)
+    if in_place:
+        dropCollection(collection_name)
+        version = collection_name
+    else:
+        version = versionName(collection_name)
+    log(program,f"Building {version}")
     
-    passages = []
-    passage_titles = []
-    for doc in docs:
-        passages.append(doc.page_content)
-        passage_titles.append(title)
-    
-    utility.drop_collection(collection_name)
-    
-    fields = [
-        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True), # Primary key
-        FieldSchema(name="article_title", dtype=DataType.VARCHAR, max_length=255,),
-        FieldSchema(name="article_text", dtype=DataType.VARCHAR, max_length=2500,),
-        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=384),
-    ]
-    
-    schema = CollectionSchema(fields, "Documents")
-    
-    collection = Collection(collection_name, schema)
+    built = False
+    try:
+        collection = createCollection(version, sparse=fusion is not None, storage=storage, dim=dim)
+        if (collection is None):
+            log(program,f"[5] Unable to create {version}")
+            return None
     
-    # Create index
-    index_params = {
-            'metric_type':'L2',
-            'index_type':"IVF_FLAT", #IVF_FLAT
-            'params':{"nlist":2048}
-    }
+        # Chunk, vectorize, and insert the documents one batch at a time
+        if (documents is None):
+            documents = readDocuments(_connection, ids)
+        chunks = chunkDocuments(documents, chunk_size)
 
-    try:
-        collection.create_index(field_name="vector", index_params=index_params)
+        samples = []
+        term_stats = {} if fusion is not None else None
+        local_store = version if storage == "BINARY" else None
+        inserted = insertChunks(collection, chunks, embeddingModel(backend), workers, progress, samples, term_stats, local_store, projection)
+        if (inserted is None):
+            return None
+
+        if (inserted == 0):
+            log(program,"[2] Error extracting the document")
+            return None
+
+        try:
+            collection.flush()  # Ensures data persistence
+        except Exception as e:
+            log(program,f"[7] Error flushing the collection")
+            log(program,f"[7] {repr(e)}")
+            return None
+
+        # Create the index now that the number of chunks is known
+        auto_tune = not (isinstance(index_profile, dict) and "params" in index_profile)
+        if auto_tune:
+            profile["params"] = autoIndexParams(profile, inserted, dim)
+
+        if (buildIndex(collection, profile) == False):
+            log(program,f"[4] Error in Index Creation")
+            return None
+
+        tuning = None
+        if auto_tune:
+            tuning = tuneSearchParams(collection, profile, samples, recall_target=recall_target)
+            if (tuning is not None):
+                profile["search_params"] = tuning["search_params"]
+
+        # The settings are saved under the version before searches can reach it, so a search always
+        # uses the settings of the version it runs against (see getLoadedCollection)
+        if (projection is not None and saveProjection(version, projection) == False):
+            log(program,f"[8] Unable to save the projection of {version}")
+            return None
+        if (term_stats is not None):
+            saveTermStats(version, term_stats)
+
+        info = {
+            "collection" : collection_name,
+            "version"    : version,
+            "documents"  : [int(id) for id in ids],
+            "vectorsize" : vectorsize,
+            "backend"    : backend,
+            "index"      : profile,
+            "tuning"     : tuning,
+            "fusion"     : fusion,
+            "storage"    : storage,
+            "projection" : None if projection is None else {key: projection[key] for key in ["method","dim","explained"] if key in projection},
+            "context_window" : context_window if context_window is not None else (CONTEXT_WINDOW if vectorsize == "Small-to-Big" else 0),
+            "chunks"     : inserted
+        }
+        saveCollectionInfo(version, info)
+
+        # Switch searches to the new version, then drop the old one once running searches are done
+        if (in_place == False and swapAlias(collection_name, version) == False):
+            log(program,f"[8] Unable to switch {collection_name} to the new version")
+            return None
+        saveCollectionInfo(collection_name, info)
+        forgetCollection(collection_name, release=False)
+        built = True
     except Exception as e:
-        log(program,f"[4] Error in Index Creation")
-        log(program,f"[4] {repr(e)}")
+        log(program,f"[9] Error building {version}")
+        log(program,f"[9] {repr(e)}")
+        return None
+    finally:
+        # A version that was not switched to is dropped rather than left loaded in Milvus
+        if (built == False):
+            dropVersion(version)
+
+    if (in_place == False):
+        collectVersions(collection_name, version)
+
+    log(program,f"Loading complete - {inserted} chunks")        
+    return collection 
+
+def appendVectors(_connection, collection_name, ids, workers=None, progress=None, documents=None):
+    """
+    Add documents to an existing collection without rebuilding it. Documents that are already in
+    the collection are skipped, and the new chunks are split and vectorized with the settings the
+    collection was built with. Milvus indexes the new chunks with the existing index, so the index
+    is not rebuilt. The documents are read from watsonx.data unless (id, text) documents are
+    supplied. The collection is returned, or None if there was an error.
+    """
+
+    from wxd_embeddings import embeddingModel
+
+    program = "appendVectors"
+
+    if (connectMilvus() == False):
+        log(program,"[1] Unable to connect to Milvus")
         return None
 
+    warnings.filterwarnings('ignore')
 
-    # Create vector embeddings + data
     try:
-        model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2') # 384 dim
-        passage_embeddings = model.encode(passages)
+        collection = getLoadedCollection(collection_name)
     except Exception as e:
-        log(program,f"[5] Error in Sentence Transformer")
-        log(program,f"[5] {repr(e)}")
-        return None    
-    
-    basic_collection = Collection(collection_name) 
-    data = [
-        passage_titles,        
-        passages,
-        passage_embeddings
-    ]
+        log(program,f"[2] Unable to open collection {collection_name}")
+        log(program,f"[2] {repr(e)}")
+        return None
 
-    try:
-        out = basic_collection.insert(data)
-        basic_collection.flush()  # Ensures data persistence
+    if ("doc_id" not in [field.name for field in collection.schema.fields]):
+        st.error(f"Collection {collection_name} was created by an earlier release and needs to be replaced before documents can be appended.")
+        log(program,f"[3] Collection {collection_name} has no document IDs and must be rebuilt")
+        return None
+
+    info = getCollectionInfo(collection_name)
+
+    present = []
+    new_ids = []
+    for id in ids:
+        found = collection.query(expr=f"doc_id == {int(id)}", output_fields=["doc_id"], limit=1)
+        if (len(found) > 0):
+            present.append(int(id))
+        else:
+            new_ids.append(int(id))
+
+    if (len(present) > 0):
+        log(program,f"Skipping documents already in {collection_name}: {present}")
+
+    if (len(new_ids) == 0):
+        log(program,f"No new documents to append to {collection_name}")
+        return collection
+
+    log(program,f"Appending {len(new_ids)} document(s) to {collection_name}")
 
+    if (documents is None):
+        documents = readDocuments(_connection, new_ids)
+    else:
+        documents = ((id, text) for id, text in documents if int(id) in new_ids)
+    chunks = chunkDocuments(documents, chunkSize(info.get("vectorsize")))
+
+    # The handle is the version the collection name points at, and its settings are saved under it
+    version = collection.name
+
+    term_stats = None
+    if ("sparse" in [field.name for field in collection.schema.fields]):
+        term_stats = getTermStats(version)
+
+    local_store = None
+    if (vectorType(collection) == "BINARY_VECTOR"):
+        local_store = version
+
+    inserted = insertChunks(collection, chunks, embeddingModel(info.get("backend")), workers, progress, term_stats=term_stats, local_store=local_store,
+                            projection=getProjection(version, info))
+    if (inserted is None):
+        return None
+
+    try:
+        collection.flush()
     except Exception as e:
-        st.error("Vector loading error. Check the log for details.")	          
-        log(program,f"[6] Error in Vector load step.")
-        log(program,f"[6] {repr(e)}")
+        log(program,f"[4] Error flushing the collection")
+        log(program,f"[4] {repr(e)}")
         return None
 
-    log(program,f"Loading complete")        
-    return basic_collection 
+    getLoadedCollection(collection_name, refresh=True)
+    if (term_stats is not None):
+        saveTermStats(version, term_stats)
+
+    previous = info.get("chunks", 0)
+    info["documents"] = sorted(set(info.get("documents", [])) | set(new_ids))
+    info["chunks"] = previous + inserted
+    saveCollectionInfo(collection_name, info)
+
+    if (previous > 0 and info["chunks"] > 4 * previous):
+        log(program,f"Collection {collection_name} has grown from {previous} to {info['chunks']} chunks. Replace it to retune the index.")
+
+    log(program,f"Append complete - {inserted} chunks")
+    return collection
 
-def query_milvus(query, collection_name, max_results):
+def deleteDocumentVectors(doc_ids, collection_names=None):
     """
-    Given a query, convert the text into a vector and then look for similar text chunks in the document(s) that you vectorized. The max_results field determines how many sentences are returned.
+    Remove the chunks of the documents from the collections that contain them, so that a deleted
+    document no longer shows up in searches and the collection does not need to be rebuilt. All
+    collections are checked unless a list of collection_names is supplied. The number of chunks
+    deleted from each collection is returned as a dictionary, or None if Milvus is not available.
     """
 
-    from sentence_transformers import SentenceTransformer
     from pymilvus import Collection
-    import pandas
 
-    program = "query_milvus"
+    program = "deleteDocumentVectors"
 
     if (connectMilvus() == False):
-        log(program,"[1] Unable to query collections")
-        return None    
-    
-    collection = Collection(collection_name) 
-    collection.load()    
+        log(program,"[1] Unable to connect to Milvus")
+        return None
 
-    model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2') # 384 dim
-    query_embeddings = model.encode([query])
+    doc_ids = [int(id) for id in doc_ids]
+    if (len(doc_ids) == 0):
+        return {}
 
-    # Search
-    search_params = {
-        "metric_type": "L2", 
-        "params": {"nprobe": 5}
-    }
+    if localBackend():
+        deleted = {}
+        for collection_name in (collection_names or collectionNames()):
+            count = deleteLocalDocuments(collection_name, doc_ids)
+            if (count is not None and count > 0):
+                deleted[collection_name] = count
+        return deleted
 
-    results = collection.search(
-        data=query_embeddings, 
-        anns_field="vector", 
-        param=search_params,
-        limit=max_results,
-        expr=None, 
-        output_fields=['article_text'],
-    )
+    if (collection_names is None):
+        try:
+            collection_names = collectionNames()
+        except Exception as e:
+            log(program,"[2] Unable to list collections")
+            log(program,f"[2] {repr(e)}")
+            return None
 
-    distances = []
-    text = []
+    deleted = {}
+    for collection_name in collection_names:
+        info = getCollectionInfo(collection_name)
+        if ("documents" in info and len(set(info["documents"]) & set(doc_ids)) == 0):
+            continue
 
-    for i in range(0,len(results[0])):
-        distances.append(results[0][i].distance)
-        text.append(results[0][i].entity.get('article_text'))
-    
-    df = pandas.DataFrame(zip(distances,text),columns=['distance','text']).sort_values(by=['distance'])
+        try:
+            collection = Collection(collection_name)
+            if ("doc_id" not in [field.name for field in collection.schema.fields]):
+                log(program,f"Collection {collection_name} has no document IDs and must be rebuilt to remove documents")
+                continue
+            collection = getLoadedCollection(collection_name)
+            result = collection.delete(expr=f"doc_id in {doc_ids}")
+            collection.flush()
+            getLoadedCollection(collection_name, refresh=True)
+        except Exception as e:
+            log(program,f"[3] Unable to delete documents {doc_ids} from {collection_name}")
+            log(program,f"[3] {repr(e)}")
+            continue
 
-    log(program,f"Milvus query - records returned = {len(df)}")
-    
-    return df
+        deleted[collection_name] = result.delete_count
+        log(program,f"Deleted {result.delete_count} chunks of documents {doc_ids} from {collection_name}")
 
-def createPrompt(prompt, results):
+        if ("documents" in info):
+            info["documents"] = [id for id in info["documents"] if id not in doc_ids]
+            info["chunks"] = max(info.get("chunks", 0) - result.delete_count, 0)
+            saveCollectionInfo(collection_name, info)
+
+    return deleted
+
+def chunkSize(vectorsize):
     """
-    Given a question (prompt), generate the sentence that will be provided to the LLM.
+    Convert the vector size (Small, Medium, Large) into the number of characters in a chunk. The
+    Small-to-Big size stores small chunks that are expanded with their neighbours when searched.
     """
 
-    import re
-    from wxd_utilities import log
-
-    program = 'createPrompt'
+    if (vectorsize == "Small-to-Big"):
+        chunk_size = 256
+    elif (vectorsize == "Small"):
+        chunk_size = 512
+    elif (vectorsize == "Medium"):
+        chunk_size = 1024
+    elif (vectorsize == "Large"):
+        chunk_size = 2048
+    else:
+        chunk_size = 512
 
-    relevant_chunks  = []
-    min_distance = 999
+    return chunk_size
 
-    for _, row in results.iterrows():
-        chunk = row['text'].strip()
-        # chunk = re.sub(r"^[a-z].*?\.(.*)$",r"\1",chunk).strip()
-        relevant_chunks.append(chunk) # row['text']) # re.sub(r"^.*?\. (.*\.).*$",r"\1",row['text']))
-        if row['distance'] < min_distance:
-            min_distance = row['distance']
+def readDocuments(_connection, ids):
+    """
+    Generator that returns (id, text) for each document, one document at a time. Documents that
+    cannot be extracted are logged and skipped.
+    """
 
-    if (len(relevant_chunks) == 0):
-        log(program,f"[1] No sentences were found to create a RAG prompt.")
-        return None
-    else:
-        log(program,f"RAG generated with {len(relevant_chunks)} sentences. Minimum distance={min_distance}")
-    
-    data = "\n\n".join(relevant_chunks)
+    from wxd_data import getDocument
 
-    header = """Answer the question based on the context below. If the question cannot be answered using the information provided answer with "I don't know"."""
+    program = "readDocuments"
 
-    question = f"{header}\n\nContext:\n\n{data}.\n\nQuestion: {prompt}"
+    for id in ids:
+        document = getDocument(_connection, id)
+        if (document in [None,"",False]):
+            log(program,f"[1] Error extracting document {id}")
+            continue
+        log(program,f"Document {id} length={len(document)}")
+        yield id, document
+
+def chunkDocuments(documents, chunk_size, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Generator that splits each (id, text) document into chunks. Each chunk is returned as a
+    dictionary with the document ID, the position of the chunk in the document, the character
+    offsets of the chunk in the document text, and the chunk text.
+    """
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True) 
+
+    for id, document in documents:
+        for chunk_index, chunk in enumerate(text_splitter.create_documents([document])):
+            start = chunk.metadata.get("start_index", -1)
+            yield {
+                "doc_id"       : id,
+                "chunk_index"  : chunk_index,
+                "start_offset" : start,
+                "end_offset"   : start + len(chunk.page_content) if start >= 0 else -1,
+                "text"         : chunk.page_content
+            }
+
+def insertBatchSize(workers=None):
+    """
+    Return the number of chunks to vectorize and insert at a time. The batch grows with the number
+    of embedding workers so that each worker is sent a full shard of every batch.
+    """
+
+    from wxd_embeddings import EMBEDDING_WORKERS, POOL_SHARD_SIZE
+
+    return max(INSERT_BATCH_SIZE, (workers or EMBEDDING_WORKERS) * POOL_SHARD_SIZE)
+
+def batchChunks(chunks, batch_size=INSERT_BATCH_SIZE):
+    """
+    Generator that groups the chunks into lists of at most batch_size chunks.
+    """
+
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if (len(batch) == batch_size):
+            yield batch
+            batch = []
+
+    if (len(batch) > 0):
+        yield batch
+
+def insertChunks(collection, chunks, model_name, workers=None, progress=None, samples=None, term_stats=None, local_store=None, projection=None):
+    """
+    Vectorize the chunks and insert them into the collection in batches. The insert of one batch
+    runs in the background while the next batch is being vectorized, and only one insert is
+    allowed to be outstanding, so memory use is limited to a couple of batches no matter how large
+    the documents are. If a samples list is provided, it is filled with a random sample of up to
+    TUNE_SAMPLES vectors for tuning the search. If the collection has a sparse field, BM25 vectors
+    are generated for the chunks and term_stats is updated with the term statistics. The vectors
+    are converted to the collection's storage mode, and if a local_store name is given the full
+    precision vectors are also saved locally (see wxd_vectorstore). If a projection is given, the
+    vectors are reduced with it first; a PCA projection without components is fitted to the first
+    batch. The chunk cache is opened once for all of the batches and pruned when they are done.
+    The batches hold insertBatchSize(workers) chunks, and progress(batch, chunks) is called after
+    each one. The number of chunks inserted is returned, or None if there was an error.
+    """
+
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from wxd_embeddings import embedPassages, sparsePassages, openChunkCache, closeChunkCache
+    from wxd_vectorstore import storeLocalVectors
+
+    program = "insertChunks"
+
+    title = "Document"
+    inserted = 0
+    pending = None
+
+    # Columns in the order of the collection schema (collections from earlier releases have fewer fields)
+    fields = [field.name for field in collection.schema.fields if not field.auto_id]
+    if ("sparse" in fields and term_stats is None):
+        term_stats = {}
+    vector_type = vectorType(collection)
+
+    def insert(data, vectors):
+        result = collection.insert(data)
+        if (local_store is not None):
+            if (storeLocalVectors(local_store, result.primary_keys, vectors) == False):
+                raise RuntimeError(f"Unable to save the local vectors of {local_store}")
+        return result
+
+    cache = openChunkCache()
+    with ThreadPoolExecutor(max_workers=1) as inserter:
+        try:
+            for batch_no, batch in enumerate(batchChunks(chunks, insertBatchSize(workers)), 1):
+                passages = [chunk["text"] for chunk in batch]
+                passage_embeddings = embedPassages(passages, model_name, workers, cache)
+                if (passage_embeddings is None):
+                    log(program,f"[5] Error in Sentence Transformer")
+                    return None
+                if (projection is not None):
+                    if (projection["method"] == "pca" and "components" not in projection):
+                        fitProjection(projection, passage_embeddings)
+                    passage_embeddings = projectVectors(projection, passage_embeddings)
+
+                if (pending is not None):
+                    pending.result()
+
+                columns = {
+                    "article_title" : [title] * len(batch),
+                    "article_text"  : passages,
+                    "doc_id"        : [int(chunk["doc_id"]) for chunk in batch],
+                    "chunk_index"   : [chunk["chunk_index"] for chunk in batch],
+                    "start_offset"  : [chunk["start_offset"] for chunk in batch],
+                    "end_offset"    : [chunk["end_offset"] for chunk in batch],
+                    "vector"        : storageVectors(vector_type, passage_embeddings)
+                }
+                if ("sparse" in fields):
+                    columns["sparse"] = sparsePassages(passages, term_stats)
+                data = [columns[name] for name in fields]
+                pending = inserter.submit(insert, data, passage_embeddings)
+
+                if (samples is not None):
+                    for i, vector in enumerate(passage_embeddings):
+                        if (len(samples) < TUNE_SAMPLES):
+                            samples.append(vector)
+                        else:
+                            slot = random.randint(0, inserted + i)
+                            if (slot < TUNE_SAMPLES):
+                                samples[slot] = vector
+
+                inserted += len(batch)
+                log(program,f"Batch {batch_no} - {inserted} chunks vectorized")
+                if (progress is not None):
+                    progress(batch_no, inserted)
+
+            if (pending is not None):
+                pending.result()
+
+        except Exception as e:
+            st.error("Vector loading error. Check the log for details.")	          
+            log(program,f"[6] Error in Vector load step.")
+            log(program,f"[6] {repr(e)}")
+            return None
+        finally:
+            closeChunkCache(cache, model_name)
+
+    return inserted
+
+def query_milvus(query, collection_name, max_results, backend=None, recall_target=None, doc_ids=None, rerank=False, mmr_lambda=None, context_window=None):
+    """
+    Given a query, convert the text into a vector and then look for similar text chunks in the
+    document(s) that you vectorized. The max_results field determines how many sentences are
+    returned. The time taken by each stage is returned in df.attrs["timings"].
+
+    recall_target - the search parameters to use (see chooseSearchParams)
+    doc_ids       - only search the chunks of these documents (see documentFilter)
+    rerank, mmr_lambda - refine the candidates (see rerankResults and diversifyResults)
+    context_window - neighbouring chunks added to each result (see expandResults)
+    """
+
+    from wxd_embeddings import getQueryEmbedding, embeddingModel
+
+    program = "query_milvus"
+
+    if (connectMilvus() == False):
+        log(program,"[1] Unable to query collections")
+        return None    
+    
+    query_embedding, timings = getQueryEmbedding(query, embeddingModel(backend))
+    if (query_embedding is None):
+        log(program,"[2] Unable to vectorize the query")
+        return None
+    query_embeddings = [query_embedding]
+
+    log(program,f"Query vectorized - cache={timings['cache']} queue={timings['queue_ms']:.1f}ms encode={timings['encode_ms']:.1f}ms batch={timings['batch_size']}")
+
+    # Neighbouring hits are stitched into one passage, so extra candidates are kept to fill max_results
+    window = 0 if localBackend() else contextWindow(collection_name, context_window)
+    refine = rerank or mmr_lambda is not None
+    fetch = max_results * CANDIDATE_FETCH if (refine or window > 0) else max_results
+
+    start = time.perf_counter()
+    results = searchCollection(collection_name, query_embeddings, fetch, recall_target, doc_ids, [query], vectors=mmr_lambda is not None)
+    if (results is None):
+        log(program,f"[3] Unable to search {collection_name}")
+        return None
+    df = results[0]
+    search_ms = (time.perf_counter() - start) * 1000
+
+    frames, stage_timings = refineResults([query], query_embeddings, [df], fetch if window > 0 else max_results, rerank, mmr_lambda)
+    df = frames[0]
+
+    start = time.perf_counter()
+    df = expandCollection(collection_name, df, context_window, max_results)
+    stage_timings["expand_ms"] = (time.perf_counter() - start) * 1000
+
+    df.attrs["timings"] = {"embed_ms": timings["queue_ms"] + timings["encode_ms"], "search_ms": search_ms, **stage_timings}
+
+    log(program,f"Milvus query - records returned = {len(df)}")
+    
+    return df
+
+def query_milvus_batch(queries, collection_name, k, backend=None, recall_target=None, doc_ids=None, rerank=False, mmr_lambda=None, context_window=None):
+    """
+    Given a list of queries, convert them into vectors in one pass of the embedding model and
+    look for similar text chunks for all of them in one Milvus search. A list with one result
+    DataFrame (distance, text) per query is returned, in the same order as the queries, or None
+    if there was an error. This is used to answer or evaluate many questions at once. With
+    rerank=True, the candidates of all of the queries are re-ranked in one cross-encoder batch,
+    and mmr_lambda and context_window work as in query_milvus.
+    """
+
+    from wxd_embeddings import getQueryEmbeddings, embeddingModel
+
+    program = "query_milvus_batch"
+
+    if (queries in [None, []]):
+        return []
+
+    if (connectMilvus() == False):
+        log(program,"[1] Unable to query collections")
+        return None    
+    
+    query_embeddings, timings = getQueryEmbeddings(queries, embeddingModel(backend))
+    if (query_embeddings is None):
+        log(program,"[2] Unable to vectorize the queries")
+        return None
+
+    log(program,f"{len(queries)} queries vectorized - cached={timings['hits']} encode={timings['encode_ms']:.1f}ms batch={timings['batch_size']}")
+
+    window = 0 if localBackend() else contextWindow(collection_name, context_window)
+    refine = rerank or mmr_lambda is not None
+    fetch = k * CANDIDATE_FETCH if (refine or window > 0) else k
+    results = searchCollection(collection_name, query_embeddings, fetch, recall_target, doc_ids, queries, vectors=mmr_lambda is not None)
+    if (results is None):
+        log(program,f"[3] Unable to search {collection_name}")
+        return None
+
+    results, _ = refineResults(queries, query_embeddings, results, fetch if window > 0 else k, rerank, mmr_lambda)
+
+    results = [expandCollection(collection_name, df, context_window, k) for df in results]
+
+    log(program,f"Milvus query - {len(results)} result sets returned")
+
+    return results
+
+def query_collections(query, collection_names, max_results, backend=None, recall_target=None, doc_ids=None, rerank=False, mmr_lambda=None, context_window=None):
+    """
+    Given a query, search several collections at the same time and merge the results into a
+    single DataFrame (distance, text, collection) of the max_results closest chunks. The query is
+    vectorized once and the results are merged on distance, which is comparable across dense and
+    hybrid collections (see toDistance and hybridSearch). Chunks with the same text are only
+    returned once. The collections are searched in parallel, and the other settings and the
+    timings work as in query_milvus. None is returned if none of the collections could be searched.
+    """
+
+    import heapq
+    import pandas
+    from concurrent.futures import ThreadPoolExecutor
+    from wxd_embeddings import getQueryEmbedding, embeddingModel
+
+    program = "query_collections"
+
+    if (isinstance(collection_names, str)):
+        collection_names = [collection_names]
+
+    if (collection_names in [None, []]):
+        log(program,"[1] No collections to search")
+        return None
+
+    if (connectMilvus() == False):
+        log(program,"[2] Unable to query collections")
+        return None    
+
+    query_embedding, timings = getQueryEmbedding(query, embeddingModel(backend))
+    if (query_embedding is None):
+        log(program,"[3] Unable to vectorize the query")
+        return None
+
+    expanding = any(not localBackend() and contextWindow(name, context_window) > 0 for name in collection_names)
+    refine = rerank or mmr_lambda is not None
+    fetch = max_results * CANDIDATE_FETCH if (refine or expanding) else max_results
+
+    def search(collection_name):
+        try:
+            results = searchCollection(collection_name, [query_embedding], fetch, recall_target, doc_ids, [query], vectors=mmr_lambda is not None)
+            return collection_name, None if results is None else results[0]
+        except Exception as e:
+            log(program,f"[4] Unable to search {collection_name}")
+            log(program,f"[4] {repr(e)}")
+            return collection_name, None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(len(collection_names), SEARCH_WORKERS)) as pool:
+        results = [(name, df) for name, df in pool.map(search, collection_names) if df is not None]
+    search_ms = (time.perf_counter() - start) * 1000
+    log(program,f"Searched {len(results)} of {len(collection_names)} collections in {search_ms:.1f}ms")
+
+    if (len(results) == 0):
+        return None
+
+    # A k-way merge on distance gives the overall order. Hybrid collections rank their results by
+    # the fused score, so those results are put in distance order before they are merged.
+    frames = [df.sort_values('distance', kind='stable').assign(collection=name).to_dict('records') for name, df in results]
+    ranked = heapq.merge(*frames, key=lambda row: row['distance'])
+
+    rows = []
+    seen = set()
+    for row in ranked:
+        if (row['text'] in seen):
+            continue
+        seen.add(row['text'])
+        rows.append(row)
+        if (len(rows) == fetch):
+            break
+
+    columns = ['distance','text','collection']
+    for row in rows:
+        columns.extend([column for column in row if column not in columns])
+    df = pandas.DataFrame(rows, columns=columns)
+
+    frames, stage_timings = refineResults([query], [query_embedding], [df], fetch if expanding else max_results, rerank, mmr_lambda)
+    df = frames[0]
+
+    # Expand the results of each collection with their neighbouring chunks, keeping the merged order
+    start = time.perf_counter()
+    expanded = []
+    for name in df['collection'].unique():
+        part = df[df['collection'] == name]
+        expanded.append(expandCollection(name, part, context_window))
+    if (len(expanded) > 0):
+        df = pandas.concat(expanded).sort_index().head(max_results).reset_index(drop=True)
+    stage_timings["expand_ms"] = (time.perf_counter() - start) * 1000
+
+    df.attrs["timings"] = {"embed_ms": timings["queue_ms"] + timings["encode_ms"], "search_ms": search_ms, **stage_timings}
+
+    log(program,f"Milvus query - records returned = {len(df)}")
+
+    return df
+
+def refineResults(queries, query_embeddings, frames, k, rerank=False, mmr_lambda=None):
+    """
+    Reduce the candidate chunks of each query to k. If mmr_lambda is set, near-duplicates are
+    dropped first (keeping 2k diverse candidates for the re-rank stage when rerank is also set),
+    and then the cross-encoder picks the best k if rerank is set. Otherwise the first k are kept.
+    The frames are returned without the vector column, along with the time taken by each stage.
+    """
+
+    timings = {"mmr_ms": 0.0, "rerank_ms": 0.0}
+
+    if (mmr_lambda is not None):
+        start = time.perf_counter()
+        frames = diversifyResults(query_embeddings, frames, 2 * k if rerank else k, mmr_lambda)
+        timings["mmr_ms"] = (time.perf_counter() - start) * 1000
+
+    if rerank:
+        frames, timings["rerank_ms"] = rerankResults(queries, frames, k)
+    else:
+        frames = [df.head(k) for df in frames]
+
+    frames = [df.drop(columns=['vector']) if 'vector' in df.columns else df for df in frames]
+
+    return frames, timings
+
+def diversifyResults(query_embeddings, frames, k, mmr_lambda=MMR_LAMBDA):
+    """
+    Choose k chunks for each query by maximal marginal relevance, using the vector column of the
+    frames. Chunks that are very similar to a chunk that was already chosen (for instance the
+    overlapping neighbour of a chunk) are passed over in favour of chunks that add new text. The
+    chosen chunks are returned in the order they were selected. When the chunks come from a
+    collection with a projection, their relevance is taken from the distance column instead.
+    """
+
+    program = "diversifyResults"
+
+    diversified = []
+    for query_embedding, df in zip(query_embeddings, frames):
+        if (len(df) <= k or 'vector' not in df.columns):
+            diversified.append(df)
+            continue
+        dims = set(len(vector) for vector in df['vector'])
+        if (len(dims) > 1):
+            log(program,"Chunks from collections with different projections are not diversified")
+            diversified.append(df)
+            continue
+        relevance = None
+        if (dims != {len(query_embedding)}):
+            relevance = 1.0 - df['distance'].to_numpy(dtype=float) / 2.0
+        selected = mmrSelect(query_embedding, list(df['vector']), k, mmr_lambda, relevance)
+        diversified.append(df.iloc[selected].reset_index(drop=True))
+
+    return diversified
+
+def mmrSelect(query_vector, vectors, k, mmr_lambda=MMR_LAMBDA, relevance=None):
+    """
+    Return the positions of k vectors chosen by maximal marginal relevance. Each step picks the
+    vector with the best mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, where relevance
+    is the cosine similarity to the query and redundancy is the largest cosine similarity to the
+    vectors already chosen. All of the similarities are computed with one matrix product and the
+    redundancy is updated a column at a time, so there are no loops over pairs of vectors. The
+    relevance can be supplied instead of being computed from the query vector.
+    """
+
+    import numpy as np
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if (len(vectors) <= k):
+        return list(range(len(vectors)))
+
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if (relevance is None):
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        relevance = vectors @ query_vector
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[selected[0]] = False
+
+    while (len(selected) < k):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+
+    return selected
+
+def rerankResults(queries, frames, k):
+    """
+    Score the retrieved chunks of each query with the cross-encoder and keep the k best, in
+    order of the re-rank score (added as the rerank column). The chunks of all of the queries are
+    scored in one batch. The re-ranked frames and the time taken in milliseconds are returned. If
+    the cross-encoder is not available, the first k chunks of each frame are kept.
+    """
+
+    from wxd_embeddings import rerankPassages
+
+    program = "rerankResults"
+
+    pairs = [(query, text) for query, df in zip(queries, frames) for text in df['text']]
+    if (len(pairs) == 0):
+        return frames, 0.0
+
+    scores, rerank_ms = rerankPassages(pairs)
+    if (scores is None):
+        log(program,"[1] Re-ranking skipped")
+        return [df.head(k) for df in frames], 0.0
+
+    reranked = []
+    offset = 0
+    for df in frames:
+        df = df.assign(rerank=scores[offset:offset + len(df)])
+        offset += len(df)
+        reranked.append(df.sort_values(by=['rerank'], ascending=False).head(k).reset_index(drop=True))
+
+    log(program,f"Re-ranked {len(pairs)} chunks in {rerank_ms:.1f}ms")
+
+    return reranked, rerank_ms
+
+def searchVectors(collection, query_embeddings, max_results, recall_target=None, doc_ids=None, queries=None, vectors=False):
+    """
+    Search the collection for the max_results closest chunks to each of the query vectors in a
+    single request, using the search parameters that match the collection's index. A list of
+    DataFrames (distance, text), one per query vector and sorted by distance, is returned. If the
+    collection was built with a fusion method and the query texts are supplied, a hybrid search
+    is done instead. With vectors=True, the vectors of the chunks are returned in a vector column.
+    If the collection was built with a projection, the query vectors are projected the same way.
+    Collections with no more than EXACT_SEARCH_LIMIT chunks are searched exactly from a local copy
+    instead of by Milvus (see getMirror).
+    """
+
+    import pandas
+
+    program = "searchVectors"
+
+    info = getCollectionInfo(collection.name)
+    profile = chooseSearchParams(info, recall_target)
+    expr = documentFilter(collection, doc_ids)
+    query_embeddings = projectVectors(getProjection(collection.name, info), query_embeddings)
+
+    if (info.get("fusion") is not None and queries is not None):
+        return hybridSearch(collection, query_embeddings, queries, max_results, profile, expr, info["fusion"], vectors)
+
+    vector_type = vectorType(collection)
+    binary = (vector_type == "BINARY_VECTOR")
+
+    if (not binary):
+        mirror = getMirror(collection, info)
+        if (mirror is not None):
+            return searchMirror(mirror, query_embeddings, max_results, doc_ids, vectors)
+    limit = max_results * BINARY_RERANK if binary else max_results
+    search_params = searchParams(profile, limit)
+
+    output_fields = ['article_text'] + provenanceFields(collection)
+    if (vectors and not binary):
+        output_fields.append('vector')
+
+    start = time.perf_counter()
+    results = collection.search(
+        data=storageVectors(vector_type, query_embeddings), 
+        anns_field="vector", 
+        param=search_params,
+        limit=limit,
+        expr=expr, 
+        output_fields=output_fields,
+    )
+    log(program,f"Milvus search {(time.perf_counter()-start)*1000:.1f}ms nq={len(query_embeddings)} {profile['index_type']} params={search_params['params']} filter={expr}")
+
+    frames = []
+    for query_embedding, hits in zip(query_embeddings, results):
+        distances = []
+        text = []
+        for hit in hits:
+            distances.append(toDistance(hit.distance, search_params["metric_type"]))
+            text.append(hit.entity.get('article_text'))
+        df = pandas.DataFrame(zip(distances,text),columns=['distance','text'])
+        for field in output_fields[1:]:
+            df[field] = [floatVector(hit.entity.get(field)) if field == 'vector' else hit.entity.get(field) for hit in hits]
+        if binary:
+            df = rerankBinary(collection.name, query_embedding, [hit.id for hit in hits], df, max_results, vectors)
+        frames.append(df.sort_values(by=['distance']).reset_index(drop=True))
+
+    return frames
+
+def vectorType(collection):
+    """
+    Return the type of the vector field of a collection (FLOAT_VECTOR, FLOAT16_VECTOR, or
+    BINARY_VECTOR), which is how the storage mode of the collection is recognized.
+    """
+
+    for field in collection.schema.fields:
+        if (field.name == "vector"):
+            return field.dtype.name
+
+    return "FLOAT_VECTOR"
+
+def storageVectors(vector_type, embeddings):
+    """
+    Convert embedding vectors into the form that is stored in, and searched with, a vector field
+    of the given type. Half precision vectors are float16 arrays, and binary vectors are the sign
+    bit of each dimension packed into bytes.
+    """
+
+    import numpy as np
+
+    if (vector_type == "FLOAT16_VECTOR"):
+        return [np.asarray(vector, dtype=np.float16) for vector in embeddings]
+    elif (vector_type == "BINARY_VECTOR"):
+        return [np.packbits(np.asarray(vector) > 0).tobytes() for vector in embeddings]
+
+    return [np.asarray(vector, dtype=np.float32) for vector in embeddings]
+
+def floatVector(vector):
+    """
+    Return a vector read from Milvus as a float32 array. Half precision vectors are returned by
+    Milvus as raw bytes.
+    """
+
+    import numpy as np
+
+    if (isinstance(vector, (bytes, bytearray))):
+        return np.frombuffer(vector, dtype=np.float16).astype(np.float32)
+    return np.asarray(vector, dtype=np.float32)
+
+def getMirror(collection, info):
+    """
+    Return the local copy of a collection with no more than EXACT_SEARCH_LIMIT chunks, or None if
+    the collection is too large or cannot be copied. The copy holds the vector, text, and provenance
+    of every chunk. It is read from Milvus once and saved as a memory mapped NumPy file (see
+    wxd_vectorstore), and it is rebuilt whenever the collection token changes, i.e. when the
+    collection is rebuilt or documents are appended or deleted.
+    """
+
+    import numpy as np
+    from wxd_vectorstore import saveMirror, loadMirror
+
+    program = "getMirror"
+
+    chunks = info.get("chunks")
+    if (chunks is None or chunks > EXACT_SEARCH_LIMIT):
+        return None
+
+    token = collectionToken(collection.name, info)
+    with _mirrors_lock:
+        cached = _mirrors.get(collection.name)
+        if (cached is not None and cached["token"] == token):
+            return cached
+
+    name = info.get("version", collection.name)
+    saved = loadMirror(name, token)
+    if (saved is None):
+        fields = ['article_text'] + provenanceFields(collection)
+        try:
+            start = time.perf_counter()
+            rows = collection.query(expr="", output_fields=fields + ['vector'], limit=EXACT_SEARCH_LIMIT + 1)
+            log(program,f"Copied {len(rows)} chunks of {collection.name} in {(time.perf_counter()-start)*1000:.1f}ms")
+        except Exception as e:
+            log(program,f"[1] Unable to copy {collection.name}")
+            log(program,f"[1] {repr(e)}")
+            return None
+        if (len(rows) == 0 or len(rows) > EXACT_SEARCH_LIMIT):
+            return None
+        vectors = np.stack([floatVector(row['vector']) for row in rows])
+        columns = {field: [row.get(field) for row in rows] for field in fields}
+        saveMirror(name, token, vectors, columns)
+        saved = (vectors, columns)
+
+    vectors, columns = saved
+    mirror = {
+        "token"   : token,
+        "vectors" : vectors,
+        "norms"   : np.einsum('ij,ij->i', vectors, vectors),
+        "columns" : columns,
+        "doc_ids" : np.asarray(columns['doc_id']) if 'doc_id' in columns else None
+    }
+    with _mirrors_lock:
+        _mirrors[collection.name] = mirror
+
+    return mirror
+
+def searchMirror(mirror, query_embeddings, max_results, doc_ids=None, vectors=False):
+    """
+    Search the local copy of a collection for the max_results closest chunks to each query vector
+    with one matrix product and argpartition. The distances are exact squared L2 distances, which
+    is what Milvus returns for normalized vectors with any of the metrics. The frames have the same
+    columns as the ones returned by Milvus searches.
+    """
+
+    import numpy as np
+    import pandas
+
+    program = "searchMirror"
+
+    start = time.perf_counter()
+
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    distances = mirror["norms"][None,:] - 2 * (queries @ mirror["vectors"].T) + np.einsum('ij,ij->i', queries, queries)[:,None]
+    if (doc_ids not in [None,[]] and mirror["doc_ids"] is not None):
+        distances[:, ~np.isin(mirror["doc_ids"], [int(id) for id in doc_ids])] = np.inf
+
+    k = min(max_results, distances.shape[1])
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+    frames = []
+    for row, positions in enumerate(nearest):
+        positions = positions[np.isfinite(distances[row, positions])]
+        positions = positions[np.argsort(distances[row, positions])]
+        df = pandas.DataFrame({'distance': distances[row, positions], 'text': [mirror["columns"]['article_text'][p] for p in positions]})
+        for field, values in mirror["columns"].items():
+            if (field != 'article_text'):
+                df[field] = [values[p] for p in positions]
+        if vectors:
+            df['vector'] = [np.asarray(mirror["vectors"][p]) for p in positions]
+        frames.append(df)
+
+    log(program,f"Exact search {(time.perf_counter()-start)*1000:.3f}ms nq={len(queries)} chunks={distances.shape[1]}")
+
+    return frames
+
+def collectionToken(collection_name, info):
+    """
+    Return a token that changes whenever the contents of a collection change. Rebuilding a
+    collection creates a new version, and appending or deleting documents saves the collection
+    settings again, so the token combines the version with the time the settings were saved.
+    """
+
+    import os
+
+    try:
+        modified = os.path.getmtime(os.path.join(COLLECTION_INFO, f"{collection_name}.json"))
+    except OSError:
+        modified = 0
+
+    return f"{info.get('version', collection_name)}:{info.get('chunks')}:{modified}"
+
+def rerankBinary(local_store, query_embedding, ids, df, k, vectors=False):
+    """
+    Re-rank the candidates of a BINARY collection with their full precision vectors from the local
+    store, replacing the Hamming distance with the exact distance, and keep the best k. With
+    vectors=True, the full precision vectors are returned in a vector column. If the local vectors
+    are missing, the Hamming distances are converted to approximate distances instead.
+    """
+
+    import numpy as np
+    from wxd_vectorstore import readLocalVectors
+
+    program = "rerankBinary"
+
+    if (len(ids) == 0):
+        return df
+
+    dim = len(query_embedding)
+    local = readLocalVectors(local_store, ids, dim)
+    if (local is None):
+        log(program,f"[1] No local vectors for {local_store} - using Hamming distances")
+        # The fraction of differing sign bits approximates the angle between the vectors / pi
+        df['distance'] = 2.0 - 2.0 * np.cos(np.pi * df['distance'] / dim)
+        return df.sort_values(by=['distance']).head(k)
+
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    df['distance'] = np.sum((local - query_vector) ** 2, axis=1)
+    if vectors:
+        df['vector'] = list(local)
+
+    return df.sort_values(by=['distance']).head(k)
+
+def hybridSearch(collection, query_embeddings, queries, max_results, profile, expr=None, fusion="rrf", vectors=False):
+    """
+    Search both the dense vectors and the BM25 sparse vectors of a collection in one request and
+    combine the two result lists with reciprocal rank fusion (rrf) or a weighted sum of the scores
+    (weighted). Keyword matches such as product names or complaint numbers that the dense vectors
+    miss are found by the BM25 search. A list of DataFrames (distance, text, score), one per query
+    and in fused score order, is returned. The distance is the dense distance of the chunk, so it
+    can be compared with the results of a dense search. With vectors=True, the vectors of the
+    chunks are returned in a vector column.
+    """
+
+    import numpy as np
+    import pandas
+    from pymilvus import AnnSearchRequest, RRFRanker, WeightedRanker
+    from wxd_embeddings import sparseQuery
+
+    program = "hybridSearch"
+
+    candidates = max_results * HYBRID_CANDIDATES
+    search_params = searchParams(profile, candidates)
+    term_stats = getTermStats(collection.name)
+
+    requests = [
+        AnnSearchRequest(data=storageVectors(vectorType(collection), query_embeddings), anns_field="vector", param=search_params, limit=candidates, expr=expr),
+        AnnSearchRequest(data=[sparseQuery(query, term_stats) for query in queries], anns_field="sparse",
+                         param={"metric_type": "IP", "params": {}}, limit=candidates, expr=expr)
+    ]
+
+    if (fusion == "weighted"):
+        ranker = WeightedRanker(*HYBRID_WEIGHTS)
+    else:
+        ranker = RRFRanker(RRF_K)
+
+    start = time.perf_counter()
+    provenance = provenanceFields(collection)
+    results = collection.hybrid_search(requests, ranker, limit=max_results, output_fields=['article_text','vector'] + provenance)
+    log(program,f"Milvus hybrid search {(time.perf_counter()-start)*1000:.1f}ms nq={len(queries)} fusion={fusion} {profile['index_type']} params={search_params['params']} filter={expr}")
+
+    metric_type = search_params["metric_type"]
+    frames = []
+    for query_embedding, hits in zip(query_embeddings, results):
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        rows = []
+        for hit in hits:
+            vector = floatVector(hit.entity.get('vector'))
+            if (metric_type == "L2"):
+                score = float(np.sum((query_vector - vector) ** 2))
+            else:
+                score = float(np.dot(query_vector, vector))
+            rows.append((toDistance(score, metric_type), hit.entity.get('article_text'), hit.distance))
+        df = pandas.DataFrame(rows, columns=['distance','text','score'])
+        for field in provenance:
+            df[field] = [hit.entity.get(field) for hit in hits]
+        if vectors:
+            df['vector'] = [floatVector(hit.entity.get('vector')) for hit in hits]
+        frames.append(df)
+
+    return frames
+
+def provenanceFields(collection):
+    """
+    Return the fields that identify where a chunk came from (doc_id and chunk_index), or an empty
+    list for collections created by an earlier release that do not have them.
+    """
+
+    names = [field.name for field in collection.schema.fields]
+    return [name for name in ['doc_id','chunk_index'] if name in names]
+
+def contextWindow(collection_name, context_window=None):
+    """
+    Return the number of neighbouring chunks to add to each search result: the context_window if
+    one is supplied, otherwise the setting the collection was built with (CONTEXT_WINDOW for the
+    Small-to-Big vector size and 0 otherwise).
+    """
+
+    if (context_window is not None):
+        return context_window
+    return getCollectionInfo(collection_name).get("context_window", 0)
+
+def expandResults(collection, df, window, max_results=None):
+    """
+    Small-to-big retrieval. Small chunks match a question precisely but carry little context, so
+    each result is replaced by the passage made of the chunk and the window chunks on either side
+    of it in the same document. The neighbours are fetched with one query and are not vectorized
+    again. A result whose chunk is already part of an earlier (better) passage is dropped, so the
+    caller passes more candidates than it needs and the passages are built in order until there
+    are max_results of them. The first max_results results are returned unexpanded if window is 0
+    or the collection has no chunk positions.
+    """
+
+    program = "expandResults"
+
+    if (window in [None, 0] or len(df) == 0 or 'chunk_index' not in df.columns or df['chunk_index'].isna().any()):
+        return df.head(max_results) if max_results is not None else df
+
+    windows = []
+    for doc_id, chunk_index in zip(df['doc_id'], df['chunk_index']):
+        windows.append((int(doc_id), max(int(chunk_index) - window, 0), int(chunk_index) + window))
+
+    expr = " or ".join([f"(doc_id == {doc_id} and chunk_index >= {low} and chunk_index <= {high})" for doc_id, low, high in set(windows)])
+
+    try:
+        neighbours = collection.query(expr=expr, output_fields=['doc_id','chunk_index','start_offset','end_offset','article_text'])
+    except Exception as e:
+        log(program,f"[1] Unable to retrieve the neighbouring chunks")
+        log(program,f"[1] {repr(e)}")
+        return df
+
+    chunks = {(int(chunk['doc_id']), int(chunk['chunk_index'])): chunk for chunk in neighbours}
+
+    keep = []
+    texts = []
+    covered = set()
+    for position, (doc_id, low, high) in enumerate(windows):
+        chunk_index = int(df['chunk_index'].iloc[position])
+        if ((doc_id, chunk_index) in covered):
+            continue
+        passage = [chunks[(doc_id, index)] for index in range(low, high + 1) if (doc_id, index) in chunks]
+        covered.update((doc_id, int(chunk['chunk_index'])) for chunk in passage)
+        keep.append(position)
+        texts.append(stitchChunks(passage) if len(passage) > 0 else df['text'].iloc[position])
+        if (len(keep) == max_results):
+            break
+
+    expanded = df.iloc[keep].copy()
+    expanded['text'] = texts
+
+    log(program,f"Expanded {len(df)} results to {len(expanded)} passages of up to {2 * window + 1} chunks")
+
+    return expanded
+
+def stitchChunks(chunks):
+    """
+    Join neighbouring chunks of a document in order. Chunks overlap by up to CHUNK_OVERLAP
+    characters, so the character offsets are used to drop the text a chunk shares with the one
+    before it.
+    """
+
+    text = ""
+    end = None
+    for chunk in sorted(chunks, key=lambda chunk: chunk['chunk_index']):
+        piece = chunk['article_text']
+        start = chunk['start_offset']
+        if (end is not None and start >= 0):
+            if (start < end):
+                piece = piece[end - start:]
+            else:
+                piece = " " + piece
+        elif (end is not None):
+            piece = " " + piece
+        text += piece
+        if (start >= 0):
+            end = max(end or 0, chunk['end_offset'])
+
+    return text
+
+def documentFilter(collection, doc_ids=None):
+    """
+    Return the search expression that restricts a search to the chunks of the doc_ids. Because
+    doc_id is the partition key of the collection, Milvus only searches the partitions that hold
+    those documents. None is returned when there is no restriction, or when the collection was
+    created by an earlier release without document IDs.
+    """
+
+    if (doc_ids in [None, []]):
+        return None
+
+    if ("doc_id" not in [field.name for field in collection.schema.fields]):
+        log("documentFilter",f"Collection {collection.name} has no document IDs - searching all documents")
+        return None
+
+    return f"doc_id in {[int(id) for id in doc_ids]}"
+
+def getLoadedCollection(collection_name, refresh=False):
+    """
+    Return the handle of a loaded collection. The first request for a collection loads it and
+    measures the memory it uses in Milvus; later requests reuse the handle without another load
+    request. When the loaded collections use more than LOADED_MEMORY_MB, the least recently
+    queried collections are released. Use refresh=True to measure the memory again after the
+    collection has changed. The handle of a versioned collection is opened on the version that the
+    alias points to (see resolveCollection) rather than on the alias, so a search and the settings
+    it uses always belong to the same version, even while the alias is being switched to a new one.
+    """
+
+    from pymilvus import Collection
+
+    program = "getLoadedCollection"
+
+    with _loaded_lock:
+        if (collection_name in _loaded and refresh == False):
+            _loaded.move_to_end(collection_name)
+            return _loaded[collection_name][0]
+
+    name = resolveCollection(collection_name)
+    collection = Collection(name)
+    collection.load()
+    memory = collectionMemory(name)
+
+    released = []
+    with _loaded_lock:
+        _loaded[collection_name] = (collection, memory)
+        _loaded.move_to_end(collection_name)
+        total = sum(size for _, size in _loaded.values())
+        while (total > LOADED_MEMORY_MB * 1024 * 1024 and len(_loaded) > 1):
+            name, (handle, size) = _loaded.popitem(last=False)
+            released.append(handle)
+            total -= size
+
+    for handle in released:
+        try:
+            handle.release()
+            log(program,f"Released {handle.name} to stay within {LOADED_MEMORY_MB}MB")
+        except Exception as e:
+            log(program,f"[1] Unable to release {handle.name}")
+            log(program,f"[1] {repr(e)}")
+
+    return collection
+
+def withLoadedCollection(collection_name, action):
+    """
+    Return action(collection) for the loaded handle of a collection. If Milvus reports that the
+    collection is not loaded (it was released by Milvus or by another process) or no longer exists
+    (another process rebuilt it and the old version was dropped), the cached handle is dropped and
+    the collection is resolved and loaded again once before the error is raised.
+    """
+
+    program = "withLoadedCollection"
+
+    try:
+        return action(getLoadedCollection(collection_name))
+    except Exception as e:
+        error = str(e).lower()
+        if ("not loaded" not in error and "not found" not in error and "not exist" not in error):
+            raise
+        log(program,f"{collection_name} is no longer loaded - loading it again")
+        forgetCollection(collection_name, release=False)
+        return action(getLoadedCollection(collection_name))
+
+def forgetCollection(collection_name, release=True):
+    """
+    Remove a collection from the loaded collection cache, and release it unless release=False
+    (for instance when it is about to be dropped).
+    """
+
+    with _loaded_lock:
+        entry = _loaded.pop(collection_name, None)
+
+    if (entry is not None and release):
+        try:
+            entry[0].release()
+        except Exception as e:
+            log("forgetCollection",f"[1] {repr(e)}")
+
+def collectionMemory(collection_name):
+    """
+    Return the approximate memory, in bytes, that a loaded collection uses in Milvus. The segment
+    sizes reported by Milvus are used, or an estimate from the number of chunks when they are not
+    available.
+    """
+
+    from pymilvus import utility
+    from wxd_embeddings import EMBEDDING_DIM
+
+    try:
+        memory = sum(segment.mem_size for segment in utility.get_query_segment_info(collection_name))
+        if (memory > 0):
+            return memory
+    except Exception:
+        pass
+
+    info = getCollectionInfo(collection_name)
+    return info.get("chunks", 0) * (EMBEDDING_DIM * 4 + chunkSize(info.get("vectorsize")))
+
+def collectionDocuments(collection_name):
+    """
+    Return the list of document IDs that are stored in a collection. Collections created by an
+    earlier release do not record their documents and return an empty list.
+    """
+
+    if localBackend():
+        mirror = getLocalMirror(collection_name)
+        return [] if mirror is None else mirror["info"].get("documents", [])
+
+    return getCollectionInfo(collection_name).get("documents", [])
+
+def indexProfile(profile=None):
+    """
+    Return a copy of the index profile. The profile can be the name of one of the INDEX_PROFILES,
+    or a dictionary that overrides the values of the profile named by its index_type. None is
+    returned if the profile is not valid.
+    """
+
+    import copy
+
+    if (profile in [None,""]):
+        profile = INDEX_PROFILE
+
+    if (isinstance(profile, str)):
+        if (profile not in INDEX_PROFILES):
+            return None
+        return copy.deepcopy(INDEX_PROFILES[profile])
+
+    index_type = profile.get("index_type", INDEX_PROFILE)
+    if (index_type not in INDEX_PROFILES):
+        return None
+
+    merged = copy.deepcopy(INDEX_PROFILES[index_type])
+    merged["metric_type"] = profile.get("metric_type", merged["metric_type"])
+    merged["params"].update(profile.get("params", {}))
+    merged["search_params"].update(profile.get("search_params", {}))
+
+    if (index_type.startswith("BIN_")):
+        metrics = ["HAMMING","JACCARD"]
+    else:
+        metrics = ["L2","IP","COSINE"]
+    if (merged["metric_type"] not in metrics):
+        return None
+
+    return merged
+
+def searchParams(profile, limit):
+    """
+    Return the search parameters for an index profile. HNSW and DiskANN require the size of the
+    candidate list to be at least the number of results that are requested.
+    """
+
+    params = dict(profile.get("search_params", {}))
+    for key in ["ef","search_list"]:
+        if (key in params):
+            params[key] = max(params[key], limit)
+
+    return {"metric_type": profile["metric_type"], "params": params}
+
+def toDistance(score, metric_type):
+    """
+    Convert a Milvus score into an L2 style distance (smaller is better). The embedding vectors are
+    normalized, so an inner product or cosine score s is the same as a squared L2 distance of 2 - 2s.
+    This keeps the distances comparable no matter which metric the collection uses.
+    """
+
+    if (metric_type in ["IP","COSINE"]):
+        return 2.0 - 2.0 * score
+    return score
+
+def getCollectionInfo(collection_name):
+    """
+    Return the settings that were saved when the collection was built. Collections that were built
+    before the settings were saved have their index profile rebuilt from the index in Milvus.
+    """
+
+    import json, os
+
+    program = "getCollectionInfo"
+
+    filenames = [os.path.join(COLLECTION_INFO, f"{collection_name}.json")]
+    if isVersion(collection_name):
+        # Versions built before the settings were saved under the version share the collection's
+        filenames.append(os.path.join(COLLECTION_INFO, f"{collection_name[:-15]}.json"))
+
+    for filename in filenames:
+        try:
+            with open(filename) as fd:
+                info = json.load(fd)
+            if (info.get("version", collection_name) == collection_name or filename == filenames[0]):
+                return info
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log(program,f"[1] Unable to read {filename}")
+            log(program,f"[1] {repr(e)}")
+
+    profile = indexProfile()
+    try:
+        from pymilvus import Collection
+        for index in Collection(collection_name).indexes:
+            if (index.field_name == "vector"):
+                params = dict(index.params)
+                profile = indexProfile(params.get("index_type", INDEX_PROFILE)) or indexProfile()
+                profile["metric_type"] = params.get("metric_type", profile["metric_type"])
+                build_params = params.get("params", {})
+                if (isinstance(build_params, str)):
+                    build_params = json.loads(build_params)
+                profile["params"] = build_params
+    except Exception as e:
+        log(program,f"[2] Unable to describe the index of {collection_name}")
+        log(program,f"[2] {repr(e)}")
+
+    return {"collection": collection_name, "index": profile}
+
+def saveCollectionInfo(collection_name, info):
+    """
+    Save the settings used to build a collection. The settings of a versioned collection are saved
+    under both the collection name and the version, so that updates (appends and deletes) reach
+    the copy that searches of the version read.
+    """
+
+    import json, os
+
+    program = "saveCollectionInfo"
+
+    names = [collection_name]
+    if (info.get("version") not in [None, collection_name]):
+        names.append(info["version"])
+
+    try:
+        os.makedirs(COLLECTION_INFO, exist_ok=True)
+        for name in names:
+            with open(os.path.join(COLLECTION_INFO, f"{name}.json"),"w") as fd:
+                json.dump(info, fd, indent=2)
+    except Exception as e:
+        log(program,f"[1] Unable to save the settings of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+
+def dropCollectionInfo(collection_name):
+    """
+    Remove the saved settings of a collection or version.
+    """
+
+    import os
+
+    _projections.pop(collection_name, None)
+    _term_stats.pop(collection_name, None)
+    with _mirrors_lock:
+        _mirrors.pop(collection_name, None)
+    for filename in [f"{collection_name}.json", f"{collection_name}.terms.json", f"{collection_name}.projection.npz"]:
+        try:
+            os.remove(os.path.join(COLLECTION_INFO, filename))
+        except OSError:
+            pass
+
+def getTermStats(collection_name):
+    """
+    Return the BM25 term statistics of a hybrid collection. The statistics are kept in a separate
+    file from the collection settings because they grow with the vocabulary of the documents, and
+    they are only read again when the file changes.
+    """
+
+    import json, os
+
+    program = "getTermStats"
+
+    filename = os.path.join(COLLECTION_INFO, f"{collection_name}.terms.json")
+    try:
+        modified = os.path.getmtime(filename)
+        cached = _term_stats.get(collection_name)
+        if (cached is not None and cached[0] == modified):
+            return cached[1]
+        with open(filename) as fd:
+            term_stats = json.load(fd)
+        _term_stats[collection_name] = (modified, term_stats)
+        return term_stats
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log(program,f"[1] Unable to read {filename}")
+        log(program,f"[1] {repr(e)}")
+        return {}
+
+def saveTermStats(collection_name, term_stats):
+    """
+    Save the BM25 term statistics of a hybrid collection.
+    """
+
+    import json, os
+
+    program = "saveTermStats"
+
+    try:
+        os.makedirs(COLLECTION_INFO, exist_ok=True)
+        with open(os.path.join(COLLECTION_INFO, f"{collection_name}.terms.json"),"w") as fd:
+            json.dump(term_stats, fd)
+    except Exception as e:
+        log(program,f"[1] Unable to save the term statistics of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+
+def fitProjection(projection, vectors):
+    """
+    Learn a PCA projection from a sample of vectors and add the mean, the components, and the
+    fraction of the variance that is kept (explained) to the projection. If there are fewer
+    vectors than dimensions, the missing components are zero.
+    """
+
+    import numpy as np
+
+    program = "fitProjection"
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    mean = vectors.mean(axis=0)
+    _, singular, components = np.linalg.svd(vectors - mean, full_matrices=False)
+
+    dim = projection["dim"]
+    kept = components[:dim]
+    if (len(kept) < dim):
+        kept = np.vstack([kept, np.zeros((dim - len(kept), vectors.shape[1]), dtype=np.float32)])
+
+    variance = singular ** 2
+    projection["mean"] = mean
+    projection["components"] = kept.astype(np.float32)
+    projection["explained"] = round(float(variance[:dim].sum() / max(variance.sum(), 1e-12)), 4)
+
+    log(program,f"PCA {vectors.shape[1]} to {dim} dimensions from {len(vectors)} vectors - {projection['explained']:.1%} of the variance kept")
+    return projection
+
+def projectVectors(projection, vectors):
+    """
+    Reduce vectors to the dimension of the projection and normalize them again, so that the L2,
+    IP, and COSINE metrics still agree. A truncate projection keeps the first values of each
+    vector, which is only suitable for Matryoshka models. With no projection the vectors are
+    returned unchanged.
+    """
+
+    import numpy as np
+
+    if (projection is None):
+        return vectors
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if (projection["method"] == "pca"):
+        reduced = (vectors - projection["mean"]) @ projection["components"].T
+    else:
+        reduced = vectors[:, :projection["dim"]]
+
+    return reduced / np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
+
+def getProjection(collection_name, info=None):
+    """
+    Return the projection that a collection was built with, or None if the vectors were stored
+    at full size. The PCA components are kept in a NumPy file beside the collection settings and
+    are only read again when the file changes.
+    """
+
+    import os
+    import numpy as np
+
+    program = "getProjection"
+
+    if (info is None):
+        info = getCollectionInfo(collection_name)
+    settings = info.get("projection")
+    if (settings is None):
+        return None
+    if (settings["method"] != "pca"):
+        return dict(settings)
+
+    filename = os.path.join(COLLECTION_INFO, f"{collection_name}.projection.npz")
+    try:
+        modified = os.path.getmtime(filename)
+        cached = _projections.get(collection_name)
+        if (cached is not None and cached[0] == modified):
+            return cached[1]
+        with np.load(filename) as stored:
+            projection = dict(settings, mean=stored["mean"], components=stored["components"])
+        _projections[collection_name] = (modified, projection)
+        return projection
+    except Exception as e:
+        log(program,f"[1] Unable to read {filename}")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+def saveProjection(collection_name, projection):
+    """
+    Save the components of a PCA projection. Truncation has nothing to save.
+    """
+
+    import os
+    import numpy as np
+
+    program = "saveProjection"
+
+    if (projection["method"] != "pca"):
+        return True
+
+    try:
+        os.makedirs(COLLECTION_INFO, exist_ok=True)
+        with open(os.path.join(COLLECTION_INFO, f"{collection_name}.projection.npz"),"wb") as fd:
+            np.savez(fd, mean=projection["mean"], components=projection["components"])
+    except Exception as e:
+        log(program,f"[1] Unable to save the projection of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        return False
+
+    return True
+
+def createCollection(collection_name, sparse=False, storage=None, dim=None):
+    """
+    Create an empty collection with the schema used for document chunks. Each chunk records the
+    document it came from, its position in the document, and its character offsets. The doc_id is
+    the partition key, so the chunks of a document are kept together in one of the
+    DOCUMENT_PARTITIONS partitions and searches restricted to some documents skip the others. A
+    scalar index on doc_id is created with the collection so documents can be found and deleted
+    without a scan (STL_SORT, or INVERTED where STL_SORT is not supported, as in Milvus Lite).
+    With sparse=True the collection also has a BM25 sparse vector for hybrid search.
+    The type of the vector field comes from the storage mode (see STORAGE_MODES), and its dimension
+    is dim (EMBEDDING_DIM unless the vectors are projected). The vector index is created
+    separately (buildIndex) once the chunks have been inserted. None is returned if the
+    collection could not be created.
+    """
+
+    from pymilvus import FieldSchema, CollectionSchema, Collection, DataType
+    from wxd_embeddings import EMBEDDING_DIM
+
+    program = "createCollection"
+
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True), # Primary key
+        FieldSchema(name="article_title", dtype=DataType.VARCHAR, max_length=255,),
+        FieldSchema(name="article_text", dtype=DataType.VARCHAR, max_length=2500,),
+        FieldSchema(name="doc_id", dtype=DataType.INT64, is_partition_key=True),
+        FieldSchema(name="chunk_index", dtype=DataType.INT32),
+        FieldSchema(name="start_offset", dtype=DataType.INT64),
+        FieldSchema(name="end_offset", dtype=DataType.INT64),
+        FieldSchema(name="vector", dtype=getattr(DataType, STORAGE_MODES[storage or STORAGE_MODE]["dtype"]), dim=dim or EMBEDDING_DIM),
+    ]
+    if (sparse):
+        fields.append(FieldSchema(name="sparse", dtype=DataType.SPARSE_FLOAT_VECTOR))
+    
+    schema = CollectionSchema(fields, "Documents")
+
+    try:
+        collection = Collection(collection_name, schema, num_partitions=DOCUMENT_PARTITIONS)
+    except Exception as e:
+        log(program,f"[1] Unable to create {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+    for index_type in ["STL_SORT","INVERTED"]:
+        try:
+            collection.create_index(field_name="doc_id", index_params={"index_type": index_type}, index_name="doc_id")
+            break
+        except Exception as e:
+            log(program,f"[2] Unable to create a {index_type} index on doc_id of {collection_name}")
+            log(program,f"[2] {repr(e)}")
+
+    if (sparse):
+        try:
+            collection.create_index(field_name="sparse", index_params={"index_type": "SPARSE_INVERTED_INDEX", "metric_type": "IP"}, index_name="sparse")
+        except Exception as e:
+            log(program,f"[3] Unable to create the sparse index of {collection_name}")
+            log(program,f"[3] {repr(e)}")
+            return None
+    
+    return collection
+
+def autoIndexParams(profile, count, dim=None):
+    """
+    Choose the index build parameters from the number of chunks in the collection. IVF indexes use
+    about 4 * sqrt(N) lists, limited so that every list has enough vectors to train on. IVF_PQ
+    splits each vector into m sub-vectors, so m is lowered to the largest divisor of the vector
+    dimension (EMBEDDING_DIM unless the vectors are projected) that is no larger than the profile's.
+    HNSW uses more links per node for very large collections. Other index types keep their parameters.
+    """
+
+    import math
+    from wxd_embeddings import EMBEDDING_DIM
+
+    params = dict(profile["params"])
+    index_type = profile["index_type"]
+
+    if (index_type.startswith("IVF") or index_type.startswith("BIN_IVF")):
+        nlist = int(round(4 * math.sqrt(count)))
+        nlist = min(nlist, max(1, count // 39), 65536)
+        params["nlist"] = max(1, nlist)
+        if (index_type == "IVF_PQ" and count < 256 * 39):
+            params["nbits"] = 4             # Too few vectors to train 256 centroids per sub-quantizer
+        if (index_type == "IVF_PQ"):
+            dim = dim or EMBEDDING_DIM
+            params["m"] = max(m for m in range(1, min(params.get("m", 48), dim) + 1) if dim % m == 0)
+    elif (index_type == "HNSW"):
+        params["M"] = 16 if count < 1000000 else 32
+
+    return params
+
+def buildIndex(collection, profile, index_name="vector"):
+    """
+    Create the vector index described by the profile, wait for it to be built, and load the
+    collection. False is returned if the index could not be created.
+    """
+
+    from pymilvus import utility
+
+    program = "buildIndex"
+
+    index_params = {
+            'metric_type':profile['metric_type'],
+            'index_type':profile['index_type'],
+            'params':profile['params']
+    }
+
+    log(program,f"Index {profile['index_type']} metric={profile['metric_type']} params={profile['params']}")
+
+    try:
+        start = time.time()
+        collection.create_index(field_name="vector", index_params=index_params, index_name=index_name)
+        utility.wait_for_index_building_complete(collection.name, index_name=index_name)
+        collection.load()
+        log(program,f"Index built in {time.time()-start:.2f}s")
+    except Exception as e:
+        log(program,f"[1] {repr(e)}")
+        return False
+
+    return True
+
+def searchCandidates(profile):
+    """
+    Return the list of search parameters to try when tuning, from cheapest to most expensive. The
+    last entry is the most exhaustive search, which is the reference for measuring recall when the
+    exact results cannot be computed.
+    """
+
+    index_type = profile["index_type"]
+    params = profile["params"]
+
+    if ("nlist" in params):
+        nlist = params["nlist"]
+        candidates = [{"nprobe": nprobe} for nprobe in [1,2,4,8,16,32,64,128,256] if nprobe < nlist]
+        candidates.append({"nprobe": nlist})
+    elif (index_type == "HNSW"):
+        candidates = [{"ef": ef} for ef in [16,32,64,128,256,512]]
+    elif (index_type == "DISKANN"):
+        candidates = [{"search_list": size} for size in [16,32,64,100,200,400]]
+    else:
+        candidates = []
+
+    return candidates
+
+def tuneQueries(samples, noise=TUNE_NOISE, seed=0):
+    """
+    Return tuning questions made from sample chunk vectors. A stored chunk always finds itself
+    first, which makes any search look accurate, so each sample is moved in a random direction by
+    noise times its length. The same seed gives the same questions.
+    """
+
+    import numpy as np
+
+    samples = np.asarray(samples, dtype=np.float32)
+    directions = np.random.default_rng(seed).standard_normal(samples.shape).astype(np.float32)
+    directions /= np.maximum(np.linalg.norm(directions, axis=1, keepdims=True), 1e-12)
+
+    return samples + noise * np.linalg.norm(samples, axis=1, keepdims=True) * directions
+
+def exactNeighbours(collection, queries, limit, batch_size=10000):
+    """
+    Return the IDs of the exact limit nearest chunks to each query (a list of sets), found by
+    reading every vector in the collection in batches and keeping the closest ones so far. The
+    distance is squared L2, or the Hamming distance for a BINARY collection, matching the index
+    metric. None is returned if the collection has more than TUNE_EXACT_LIMIT chunks or cannot be
+    read.
+    """
+
+    import numpy as np
+
+    program = "exactNeighbours"
+
+    binary = (vectorType(collection) == "BINARY_VECTOR")
+
+    def stored(vectors):
+        if binary:
+            return np.unpackbits(np.frombuffer(b"".join(bytes(vector[0] if isinstance(vector, list) else vector) for vector in vectors), dtype=np.uint8)).reshape(len(vectors), -1).astype(np.float32)
+        return np.stack([floatVector(vector) for vector in vectors])
+
+    if binary:
+        queries = np.unpackbits(np.frombuffer(b"".join(storageVectors("BINARY_VECTOR", queries)), dtype=np.uint8)).reshape(len(queries), -1).astype(np.float32)
+    else:
+        queries = np.asarray(queries, dtype=np.float32)
+
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+
+    start = time.perf_counter()
+    try:
+        if (collection.num_entities > TUNE_EXACT_LIMIT):
+            return None
+        iterator = collection.query_iterator(batch_size=batch_size, output_fields=["vector"])
+        try:
+            while True:
+                rows = iterator.next()
+                if (len(rows) == 0):
+                    break
+                vectors = stored([row["vector"] for row in rows])
+                distances = np.einsum('ij,ij->i', vectors, vectors)[None,:] - 2 * (queries @ vectors.T) + np.einsum('ij,ij->i', queries, queries)[:,None]
+                ids = np.concatenate([best_ids, np.broadcast_to(np.asarray([row["id"] for row in rows], dtype=np.int64), distances.shape)], axis=1)
+                distances = np.concatenate([best_distances, distances], axis=1)
+                keep = np.argpartition(distances, min(limit, distances.shape[1]) - 1, axis=1)[:, :limit]
+                best_ids = np.take_along_axis(ids, keep, axis=1)
+                best_distances = np.take_along_axis(distances, keep, axis=1)
+        finally:
+            iterator.close()
+    except Exception as e:
+        log(program,f"[1] Unable to read the vectors of {collection.name}")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+    log(program,f"Exact results for {len(queries)} questions in {(time.perf_counter()-start)*1000:.1f}ms")
+
+    return [set(ids.tolist()) for ids in best_ids]
+
+def tuneSearchParams(collection, profile, samples, limit=TUNE_LIMIT, recall_target=None):
+    """
+    Search the collection with tuning questions (sample chunks moved a small distance, see
+    tuneQueries) using each of the candidate search parameters, and measure the recall against the
+    exact nearest chunks (see exactNeighbours) and the median latency per question over TUNE_RUNS
+    searches. The result is a dictionary with the measurements (curve) and the cheapest search
+    parameters that reach the recall target. None is returned if the index has nothing to tune.
+    """
+
+    import statistics
+
+    program = "tuneSearchParams"
+
+    if (recall_target in [None,""]):
+        recall_target = RECALL_TARGET
+
+    candidates = searchCandidates(profile)
+    if (len(candidates) == 0 or len(samples) == 0):
+        return None
+
+    queries = tuneQueries(samples)
+    data = storageVectors(vectorType(collection), queries)
+
+    def search(params):
+        candidate = dict(profile, search_params=params)
+        latencies = []
+        for run in range(TUNE_RUNS):
+            start = time.perf_counter()
+            results = collection.search(data=data, anns_field="vector", param=searchParams(candidate, limit), limit=limit)
+            latencies.append((time.perf_counter() - start) * 1000 / len(data))
+        return [set(hit.id for hit in hits) for hits in results], statistics.median(latencies)
+
+    try:
+        reference = exactNeighbours(collection, queries, limit)
+        exact = reference is not None
+        if (exact == False):
+            log(program,f"Measuring recall against the most exhaustive search {candidates[-1]}")
+            reference, _ = search(candidates[-1])
+        curve = []
+        for params in candidates:
+            found, latency = search(params)
+            recall = sum(len(f & r) / max(1, len(r)) for f, r in zip(found, reference)) / len(reference)
+            curve.append({"search_params": params, "recall": round(recall, 4), "latency_ms": round(latency, 3)})
+            log(program,f"{profile['index_type']} {params} recall={recall:.3f} latency={latency:.2f}ms")
+    except Exception as e:
+        log(program,f"[1] Unable to tune the search parameters")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+    tuning = {"recall_target": recall_target, "exact": exact, "curve": curve}
+    chosen = chooseSearchParams({"index": profile, "tuning": tuning}, recall_target)
+    tuning["search_params"] = chosen["search_params"]
+
+    log(program,f"Chose {chosen['search_params']} for recall target {recall_target}")
+
+    return tuning
+
+def chooseSearchParams(info, recall_target=None):
+    """
+    Return the index profile of a collection with the search parameters that reach the recall
+    target with the lowest measured latency. If the collection was not tuned, or no measurement
+    reached the target, the saved search parameters (or the highest recall measured) are used.
+    """
+
+    profile = dict(info["index"])
+    tuning = info.get("tuning")
+
+    if (tuning in [None,{}] or len(tuning.get("curve", [])) == 0):
+        return profile
+
+    if (recall_target in [None,""]):
+        recall_target = tuning.get("recall_target", RECALL_TARGET)
+
+    curve = tuning["curve"]
+    reached = [point for point in curve if point["recall"] >= recall_target]
+    if (len(reached) > 0):
+        best = min(reached, key=lambda point: point["latency_ms"])
+    else:
+        best = max(curve, key=lambda point: point["recall"])
+
+    profile["search_params"] = best["search_params"]
+
+    return profile
+
+def createPrompt(prompt, results):
+    """
+    Given a question (prompt), generate the sentence that will be provided to the LLM.
+    """
+
+    import re
+    from wxd_utilities import log
+
+    program = 'createPrompt'
+
+    relevant_chunks  = []
+    min_distance = 999
+
+    if (results is None):
+        log(program,f"[1] No collections were searched to create a RAG prompt.")
+        return None, min_distance
+
+    for _, row in results.iterrows():
+        chunk = row['text'].strip()
+        # chunk = re.sub(r"^[a-z].*?\.(.*)$",r"\1",chunk).strip()
+        relevant_chunks.append(chunk) # row['text']) # re.sub(r"^.*?\. (.*\.).*$",r"\1",row['text']))
+        if row['distance'] < min_distance:
+            min_distance = row['distance']
+
+    if (len(relevant_chunks) == 0):
+        log(program,f"[1] No sentences were found to create a RAG prompt.")
+        return None, min_distance
+    else:
+        log(program,f"RAG generated with {len(relevant_chunks)} sentences. Minimum distance={min_distance}")
+    
+    data = "\n\n".join(relevant_chunks)
+
+    header = """Answer the question based on the context below. If the question cannot be answered using the information provided answer with "I don't know"."""
+
+    question = f"{header}\n\nContext:\n\n{data}.\n\nQuestion: {prompt}"
 
     return question, min_distance
+
+def storeLocalCollection(_connection, collection_name, ids, vectorsize, backend=None, workers=None, progress=None, mode="replace", documents=None):
+    """
+    Store the chunks and vectors of the documents in a collection of the local backend. With
+    mode="append" the documents are added to the existing collection (documents already in it are
+    skipped) using the settings it was built with; otherwise the collection is replaced. The
+    collection is searched exactly, so there is no index, storage mode, projection, or keyword
+    search: storeVectors rejects those settings, and logs and ignores the index_profile,
+    recall_target, and context_window. The collection name is returned, or None if there was an
+    error.
+    """
+
+    import numpy as np
+    from wxd_embeddings import embedPassages, embeddingModel, openChunkCache, closeChunkCache, EMBEDDING_DIM
+    from wxd_vectorstore import readLocalCollection, saveLocalCollection
+
+    program = "storeLocalCollection"
+
+    ids = [int(id) for id in ids]
+    existing = readLocalCollection(collection_name) if mode == "append" else None
+    if (existing is not None):
+        info, stored, columns = existing
+        vectorsize, backend = info["vectorsize"], info.get("backend")
+        ids = [id for id in ids if id not in info["documents"]]
+        vectors = [np.array(stored)]
+    else:
+        info = {"collection": collection_name, "backend": backend, "vectorsize": vectorsize, "documents": []}
+        columns = {"article_text": [], "doc_id": [], "chunk_index": []}
+        vectors = [np.zeros((0, EMBEDDING_DIM), dtype=np.float32)]
+
+    log(program,f"Loading {len(ids)} document(s) into local collection {collection_name}")
+
+    if (documents is None):
+        documents = readDocuments(_connection, ids)
+    else:
+        documents = ((id, text) for id, text in documents if int(id) in ids)
+
+    inserted = 0
+    cache = openChunkCache()
+    try:
+        for batch_no, batch in enumerate(batchChunks(chunkDocuments(documents, chunkSize(vectorsize)), insertBatchSize(workers)), 1):
+            passages = [chunk["text"] for chunk in batch]
+            passage_embeddings = embedPassages(passages, embeddingModel(backend), workers, cache)
+            if (passage_embeddings is None):
+                log(program,f"[5] Error in Sentence Transformer")
+                return None
+            vectors.append(np.asarray(passage_embeddings, dtype=np.float32))
+            columns["article_text"].extend(passages)
+            columns["doc_id"].extend(int(chunk["doc_id"]) for chunk in batch)
+            columns["chunk_index"].extend(chunk["chunk_index"] for chunk in batch)
+            inserted += len(batch)
+            if (progress is not None):
+                progress(batch_no, inserted)
+    finally:
+        closeChunkCache(cache, embeddingModel(backend))
+
+    if (inserted == 0 and existing is None):
+        log(program,"[2] Error extracting the document")
+        return None
+
+    info["documents"] = sorted(set(info["documents"]) | set(ids))
+    info["chunks"] = len(columns["article_text"])
+    if (saveLocalCollection(collection_name, info, np.concatenate(vectors), columns) == False):
+        log(program,f"[7] Unable to save {collection_name}")
+        return None
+
+    log(program,f"Loading complete - {inserted} chunks")
+    return collection_name
+
+def getLocalMirror(collection_name):
+    """
+    Return a collection of the local backend in the form searched by searchMirror, or None if the
+    collection does not exist. The collection is kept in memory until its files change.
+    """
+
+    import numpy as np
+    from wxd_vectorstore import readLocalCollection, localCollectionTime
+
+    key = f"local:{collection_name}"
+    token = localCollectionTime(collection_name)
+    if (token is None):
+        return None
+
+    with _mirrors_lock:
+        cached = _mirrors.get(key)
+        if (cached is not None and cached["token"] == token):
+            return cached
+
+    saved = readLocalCollection(collection_name)
+    if (saved is None):
+        return None
+
+    info, vectors, columns = saved
+    mirror = {
+        "token"   : token,
+        "info"    : info,
+        "vectors" : vectors,
+        "norms"   : np.einsum('ij,ij->i', vectors, vectors),
+        "columns" : columns,
+        "doc_ids" : np.asarray(columns['doc_id'])
+    }
+    with _mirrors_lock:
+        _mirrors[key] = mirror
+
+    return mirror
+
+def deleteLocalDocuments(collection_name, doc_ids):
+    """
+    Remove the chunks of the documents from a collection of the local backend. The number of
+    chunks removed is returned, or None if there was an error.
+    """
+
+    import numpy as np
+    from wxd_vectorstore import readLocalCollection, saveLocalCollection
+
+    program = "deleteLocalDocuments"
+
+    saved = readLocalCollection(collection_name)
+    if (saved is None):
+        return None
+
+    info, vectors, columns = saved
+    keep = ~np.isin(np.asarray(columns["doc_id"], dtype=np.int64), doc_ids)
+    deleted = int((~keep).sum())
+    if (deleted == 0 and len(set(info["documents"]) & set(doc_ids)) == 0):
+        return 0
+
+    rows = np.flatnonzero(keep)
+    columns = {field: [values[row] for row in rows] for field, values in columns.items()}
+    info["documents"] = [id for id in info["documents"] if id not in doc_ids]
+    info["chunks"] = len(rows)
+    if (saveLocalCollection(collection_name, info, np.asarray(vectors)[rows], columns) == False):
+        return None
+
+    log(program,f"Deleted {deleted} chunks of documents {doc_ids} from {collection_name}")
+    return deleted
+
+def searchCollection(collection_name, query_embeddings, max_results, recall_target=None, doc_ids=None, queries=None, vectors=False):
+    """
+    Search a collection of the current backend for the max_results closest chunks to each query
+    vector. The results are the same as those of searchVectors. None is returned if the collection
+    does not exist in the local backend.
+    """
+
+    program = "searchCollection"
+
+    if localBackend():
+        mirror = getLocalMirror(collection_name)
+        if (mirror is None):
+            log(program,f"[1] Local collection {collection_name} does not exist")
+            return None
+        return searchMirror(mirror, query_embeddings, max_results, doc_ids, vectors)
+
+    return withLoadedCollection(collection_name, lambda collection: searchVectors(collection, query_embeddings, max_results, recall_target, doc_ids, queries, vectors))
+
+def expandCollection(collection_name, df, context_window=None, max_results=None):
+    """
+    Expand search results with their neighbouring chunks (see expandResults), keeping up to
+    max_results passages. Collections of the local backend are not expanded.
+    """
+
+    program = "expandCollection"
+
+    if localBackend():
+        if (context_window not in [None,0]):
+            log(program,f"The local backend ignores context_window={context_window}")
+        return df.head(max_results) if max_results is not None else df
+
+    window = contextWindow(collection_name, context_window)
+    return withLoadedCollection(collection_name, lambda collection: expandResults(collection, df, window, max_results))
@@ -182,6 +182,21 @@ def setCredentials():
 	sts['queries']         = []
 	sts['sentences']       = 3
 	sts['vectorsize']      = "Small"
+	sts['embedding_backend'] = "torch"
+	sts['embedding_workers'] = 1
+	sts['index_profile']   = "IVF_FLAT"
+	sts['recall_target']   = 0.95
+	sts['vector_mode']     = "Replace"
+	sts['fusion']          = "Off"
+	sts['storage']         = "FLOAT32"
+	sts['projection']      = "Off"
+	sts['projection_dim']  = 128
+	sts['context_window']  = 2
+	sts['rerank']          = False
+	sts['diverse']         = False
+	sts['mmr_lambda']      = 0.7
+	sts['collection_names']   = []
+	sts['collection_documents'] = None
 	sts['temperature']     = .70
 	sts['displaysettings'] = True
 	sts["random"]          = True
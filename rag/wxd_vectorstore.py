@@ -0,0 +1,322 @@
+#---------------------------------------------------------------------------------------------
+# Licensed Materials - Property of IBM 
+# (C) Copyright IBM Corp. 2025 All Rights Reserved.
+# US Government Users Restricted Rights - Use, duplication or disclosure restricted by GSA ADP 
+# Schedule Contract with IBM Corp.
+#
+# Developed by George Baklarz
+#---------------------------------------------------------------------------------------------
+#
+#   Local vector store
+#
+#   storeLocalVectors   - Append chunk IDs and full precision vectors to the local copy of a collection
+#   readLocalVectors    - Return the full precision vectors for a list of chunk IDs
+#   dropLocalVectors    - Remove the local copy of a collection
+#   saveMirror          - Save a complete copy of a small collection for exact searches
+#   loadMirror          - Return the saved copy of a small collection if it is still current
+#   listLocalCollections - Return the names of the collections in the local backend
+#   localCollectionTime - Return the time a local backend collection was last saved
+#   saveLocalCollection - Save the chunks and vectors of a local backend collection
+#   readLocalCollection - Return the chunks and vectors of a local backend collection
+#   dropLocalCollection - Remove a local backend collection
+#
+#   Collections that keep compressed vectors in Milvus (BINARY) also keep the full precision
+#   vectors on local disk so that the candidates found by Milvus can be re-ranked exactly. The
+#   vectors are appended to a raw float32 file as they are inserted, and the file is memory mapped
+#   when it is read, so only the rows that are looked up are brought into memory.
+#
+#   Small collections are searched without Milvus from a mirror: the vectors of every chunk in a
+#   NumPy file that is memory mapped, and the text of the chunks in a JSON file. The mirror is
+#   saved with a token and is only used while the caller's token matches.
+#
+#   The local backend (VECTOR_BACKEND = "local" in wxd_milvus) keeps whole collections in the same
+#   form, so the application can be developed and tested without a Milvus server.
+#
+
+import os
+import threading
+from wxd_utilities import log
+
+VECTOR_STORE = "/home/watsonx/cache/vectors"                      # Local copies of collection vectors
+LOCAL_COLLECTIONS = os.path.join(VECTOR_STORE, "collections")     # Collections of the local backend
+
+_positions      = {}                                              # Chunk ID to row number, by collection
+_positions_lock = threading.Lock()
+
+def _files(collection_name):
+    """
+    Return the names of the ID and vector files of a collection.
+    """
+
+    base = os.path.join(VECTOR_STORE, collection_name)
+    return f"{base}.ids", f"{base}.f32"
+
+def _mirrorFiles(collection_name):
+    """
+    Return the names of the vector and column files of a collection's mirror.
+    """
+
+    base = os.path.join(VECTOR_STORE, collection_name)
+    return f"{base}.mirror.npy", f"{base}.mirror.json"
+
+def storeLocalVectors(collection_name, ids, vectors):
+    """
+    Append the chunk IDs and their vectors to the local copy of the collection. False is returned
+    if the files could not be written.
+    """
+
+    import numpy as np
+
+    program = "storeLocalVectors"
+
+    id_file, vector_file = _files(collection_name)
+
+    try:
+        os.makedirs(VECTOR_STORE, exist_ok=True)
+        with _positions_lock:
+            with open(vector_file, "ab") as fd:
+                fd.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(id_file, "ab") as fd:
+                fd.write(np.asarray(ids, dtype=np.int64).tobytes())
+    except Exception as e:
+        log(program,f"[1] Unable to save the vectors of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        return False
+
+    return True
+
+def readLocalVectors(collection_name, ids, dim):
+    """
+    Return an array with the vector of each chunk ID, in the same order as the IDs. None is
+    returned if the collection has no local copy or any of the IDs are missing from it.
+    """
+
+    import numpy as np
+
+    program = "readLocalVectors"
+
+    id_file, vector_file = _files(collection_name)
+
+    try:
+        size = os.path.getsize(id_file)
+        with _positions_lock:
+            cached = _positions.get(collection_name)
+            if (cached is None or cached[0] != size):
+                stored = np.fromfile(id_file, dtype=np.int64)
+                cached = (size, {int(id): row for row, id in enumerate(stored)})
+                _positions[collection_name] = cached
+        positions = cached[1]
+        rows = [positions[int(id)] for id in ids]
+        vectors = np.memmap(vector_file, dtype=np.float32, mode="r").reshape(-1, dim)
+        return np.asarray(vectors[rows])
+    except (FileNotFoundError, KeyError):
+        return None
+    except Exception as e:
+        log(program,f"[1] Unable to read the vectors of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+def dropLocalVectors(collection_name):
+    """
+    Remove the local copy of a collection.
+    """
+
+    with _positions_lock:
+        _positions.pop(collection_name, None)
+        for filename in _files(collection_name) + _mirrorFiles(collection_name):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+def saveMirror(collection_name, token, vectors, columns):
+    """
+    Save the vectors and the columns (text and provenance of each chunk) of a collection with the
+    token that identifies the state of the collection. False is returned if the files could not be
+    written.
+    """
+
+    import json
+    import numpy as np
+
+    program = "saveMirror"
+
+    vector_file, column_file = _mirrorFiles(collection_name)
+
+    try:
+        os.makedirs(VECTOR_STORE, exist_ok=True)
+        with open(vector_file, "wb") as fd:
+            np.save(fd, np.ascontiguousarray(vectors, dtype=np.float32))
+        # The columns are written last, so a mirror with a matching token always has its vectors
+        with open(column_file, "w") as fd:
+            json.dump({"token": token, "columns": columns}, fd)
+    except Exception as e:
+        log(program,f"[1] Unable to save the mirror of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        return False
+
+    return True
+
+def loadMirror(collection_name, token):
+    """
+    Return the memory mapped vectors and the columns of a collection's mirror, or None if there is
+    no mirror or it was saved with a different token.
+    """
+
+    import json
+    import numpy as np
+
+    program = "loadMirror"
+
+    vector_file, column_file = _mirrorFiles(collection_name)
+
+    try:
+        with open(column_file) as fd:
+            saved = json.load(fd)
+        if (saved.get("token") != token):
+            return None
+        return np.load(vector_file, mmap_mode="r"), saved["columns"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log(program,f"[1] Unable to read the mirror of {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        return None
+
+def _collectionFiles(collection_name, generation=None):
+    """
+    Return the names of the vector and settings files of a collection in the local backend. Each
+    save writes its vectors to a new file named by its generation, and the settings file names the
+    generation that goes with it.
+    """
+
+    base = os.path.join(LOCAL_COLLECTIONS, collection_name)
+    vector_file = f"{base}.npy" if generation is None else f"{base}.{generation}.npy"
+    return vector_file, f"{base}.json"
+
+def _vectorGenerations(collection_name):
+    """
+    Return the vector files of every generation of a collection in the local backend.
+    """
+
+    import glob
+
+    base = os.path.join(LOCAL_COLLECTIONS, glob.escape(collection_name))
+    return glob.glob(f"{base}.[0-9]*.npy")
+
+def listLocalCollections():
+    """
+    Return the names of the collections in the local backend.
+    """
+
+    try:
+        return sorted(filename[:-5] for filename in os.listdir(LOCAL_COLLECTIONS) if filename.endswith(".json"))
+    except FileNotFoundError:
+        return []
+
+def localCollectionTime(collection_name):
+    """
+    Return the time a collection in the local backend was last saved, or None if it does not exist.
+    """
+
+    try:
+        return os.path.getmtime(_collectionFiles(collection_name)[1])
+    except OSError:
+        return None
+
+def saveLocalCollection(collection_name, info, vectors, columns):
+    """
+    Save a collection in the local backend: the vectors of the chunks, their columns (text and
+    provenance), and the settings of the collection. The vectors are written to a new generation
+    file, and the settings file that names it is written under a temporary name and renamed, so
+    the single rename switches searches running at the same time from the old collection to the
+    new one. The vector files of older generations are then removed. False is returned if the files
+    could not be written.
+    """
+
+    import json, time
+    import numpy as np
+
+    program = "saveLocalCollection"
+
+    generation = time.time_ns()
+    vector_file, settings_file = _collectionFiles(collection_name, generation)
+
+    try:
+        os.makedirs(LOCAL_COLLECTIONS, exist_ok=True)
+        with open(vector_file, "wb") as fd:
+            np.save(fd, np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(f"{settings_file}.tmp", "w") as fd:
+            json.dump({"generation": generation, "info": info, "columns": columns}, fd)
+        os.replace(f"{settings_file}.tmp", settings_file)
+    except Exception as e:
+        log(program,f"[1] Unable to save {collection_name}")
+        log(program,f"[1] {repr(e)}")
+        try:
+            os.remove(vector_file)
+        except OSError:
+            pass
+        return False
+
+    for filename in _vectorGenerations(collection_name) + [_collectionFiles(collection_name)[0]]:
+        if (filename != vector_file):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    return True
+
+def readLocalCollection(collection_name):
+    """
+    Return the settings, the memory mapped vectors, and the columns of a collection in the local
+    backend, or None if the collection does not exist. The vectors are read from the generation
+    named in the settings file. If a save replaces that generation before it is opened, the new
+    settings file is read again, so the vectors and columns always come from the same save.
+    """
+
+    import json
+    import numpy as np
+
+    program = "readLocalCollection"
+
+    for attempt in range(3):
+        try:
+            with open(_collectionFiles(collection_name)[1]) as fd:
+                saved = json.load(fd)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log(program,f"[1] Unable to read {collection_name}")
+            log(program,f"[1] {repr(e)}")
+            return None
+
+        vector_file = _collectionFiles(collection_name, saved.get("generation"))[0]
+        try:
+            vectors = np.load(vector_file, mmap_mode="r")
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            log(program,f"[2] Unable to read the vectors of {collection_name}")
+            log(program,f"[2] {repr(e)}")
+            return None
+
+        if (len(vectors) != len(saved["columns"]["article_text"])):
+            log(program,f"[3] {collection_name} has {len(vectors)} vectors for {len(saved['columns']['article_text'])} chunks")
+            return None
+
+        return saved["info"], vectors, saved["columns"]
+
+    log(program,f"[4] {collection_name} kept changing while it was read")
+    return None
+
+def dropLocalCollection(collection_name):
+    """
+    Remove a collection from the local backend.
+    """
+
+    for filename in [_collectionFiles(collection_name)[1]] + _vectorGenerations(collection_name) + [_collectionFiles(collection_name)[0]]:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass